@@ -0,0 +1,179 @@
+# analysis_client.py
+
+import io
+import os
+import json
+import urllib.error
+import urllib.request
+import numpy as np
+import pandas as pd
+from anomaly_flags import FLAGS_DTYPE
+from model_ensemble import EnsembleModel
+
+# Thin client for analysis_service.py. Frames travel as pandas "table" JSON
+# (schema + rows), which keeps datetimes and categoricals intact; their attrs
+# (tower lookup, normalization stats, ...) travel next to them as "attrs".
+
+SERVICE_URL = os.environ.get("DIFA_SERVICE_URL", "")
+REQUEST_TIMEOUT = float(os.environ.get("DIFA_SERVICE_TIMEOUT", "900"))
+HEALTH_TIMEOUT = float(os.environ.get("DIFA_SERVICE_HEALTH_TIMEOUT", "2"))
+
+
+class ServiceError(RuntimeError):
+    pass
+
+
+def encode_frame(df):
+    """
+    DataFrame → JSON text (None stays None). Floats keep 15 significant
+    digits (the most to_json writes), not its default 10.
+    """
+    if df is None:
+        return None
+    return df.reset_index(drop=True).to_json(
+        orient="table", date_format="iso", date_unit="ns", index=False, double_precision=15,
+    )
+
+
+def decode_frame(text, attrs=None):
+    """
+    JSON text from encode_frame → DataFrame (None → empty frame), with
+    `attrs` restored onto it.
+    """
+    df = pd.DataFrame() if text is None else pd.read_json(io.StringIO(text), orient="table")
+    if "flags" in df.columns:
+        df["flags"] = df["flags"].fillna(0).astype(FLAGS_DTYPE)
+    df.attrs = dict(attrs or {})
+    return df
+
+
+def encode_alerts(alerts):
+    return [[str(ts), message] for ts, message in alerts]
+
+
+def decode_alerts(alerts):
+    return [(pd.Timestamp(ts), message) for ts, message in alerts]
+
+
+def encode_model(model):
+    # Only ensembles carry anything the front-end reads (score, timings)
+    if isinstance(model, EnsembleModel):
+        return {
+            "scores": {name: np.asarray(s, dtype=float).tolist() for name, s in model.scores.items()},
+            "seconds": model.seconds,
+            "wall_secs": model.wall_secs,
+        }
+    return None
+
+
+def decode_model(state):
+    if not state:
+        return None
+    scores = {name: np.asarray(s, dtype=float) for name, s in state["scores"].items()}
+    return EnsembleModel(scores, state["seconds"], state["wall_secs"])
+
+
+class AnalysisClient:
+    """
+    Calls the analysis service over HTTP/JSON. Every method mirrors the
+    local function of the same stage and returns the same shapes.
+    """
+
+    def __init__(self, base_url=SERVICE_URL, timeout=REQUEST_TIMEOUT):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def _request(self, path, payload=None, timeout=None):
+        data = None if payload is None else json.dumps(payload, default=str).encode("utf-8")
+        request = urllib.request.Request(
+            self.base_url + path,
+            data=data,
+            method="GET" if data is None else "POST",
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=timeout or self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read()).get("error", e.reason)
+            except ValueError:
+                message = e.reason
+            raise ServiceError(f"{path}: {message}") from e
+        except urllib.error.URLError as e:
+            raise ServiceError(f"Analysis service unreachable at {self.base_url}: {e.reason}") from e
+        except OSError as e:
+            # Timeouts and dropped connections after the request was sent
+            raise ServiceError(f"Analysis service at {self.base_url} failed on {path}: {e}") from e
+
+    def health(self, timeout=HEALTH_TIMEOUT):
+        return self._request("/health", timeout=timeout)
+
+    def normalize(self, df, type="generic"):
+        out = self._request("/normalize", {"type": type, "data": encode_frame(df)})
+        return decode_frame(out["data"], {**df.attrs, **out.get("attrs", {})})
+
+    def timeline(self, gps_df, ipdr_df=None, cdr_df=None):
+        out = self._request("/timeline", {
+            "gps": encode_frame(gps_df), "ipdr": encode_frame(ipdr_df), "cdr": encode_frame(cdr_df),
+        })
+        return decode_frame(out["timeline"], out.get("attrs"))
+
+    def rules(self, timeline_df, gps_threshold_km=100, max_gap_secs=900):
+        out = self._request("/rules", {
+            "timeline": encode_frame(timeline_df),
+            "gps_threshold_km": gps_threshold_km,
+            "max_gap_secs": max_gap_secs,
+        })
+        attrs = {**timeline_df.attrs, **out.get("attrs", {})}
+        return decode_frame(out["timeline"], attrs), decode_alerts(out["alerts"])
+
+    def score(self, timeline_df, model_type="isolation_forest", contamination=0.1, ml_flag=None):
+        """
+        fit_and_score on the service: (model, scaler, features_df, anomaly,
+        flags). Only ensembles come back as a model; scaler and features
+        stay on the service (None).
+        """
+        out = self._request("/score", {
+            "timeline": encode_frame(timeline_df),
+            "model_type": model_type,
+            "contamination": contamination,
+            "ml_flag": ml_flag,
+        })
+        anomaly = np.asarray(out["anomaly"], dtype=int)
+        flags = np.asarray(out["flags"], dtype=FLAGS_DTYPE)
+        return decode_model(out["model"]), None, None, anomaly, flags
+
+    def analyze(self, gps_df, ipdr_df=None, cdr_df=None, normalize=False, **params):
+        """
+        train_anomaly_model on the service, optionally normalizing the raw
+        frames first. Same 5-tuple as train_anomaly_model.
+        """
+        out = self._request("/analyze", {
+            "gps": encode_frame(gps_df), "ipdr": encode_frame(ipdr_df), "cdr": encode_frame(cdr_df),
+            "normalize": normalize, **params,
+        })
+        timeline_df = decode_frame(out["timeline"], out.get("attrs"))
+        return decode_model(out["model"]), None, timeline_df, None, decode_alerts(out["alerts"])
+
+    def correlate(self, timeline, max_time_diff_sec=120):
+        """
+        correlate_events on the service (list of event dicts in and out).
+        """
+        out = self._request("/correlate", {"timeline": timeline, "max_time_diff_sec": max_time_diff_sec})
+        return out["events"]
+
+
+def get_client(base_url=SERVICE_URL, timeout=HEALTH_TIMEOUT):
+    """
+    AnalysisClient for base_url if it is set and the service answers its
+    health check within `timeout` seconds, else None.
+    """
+    if not base_url:
+        return None
+    client = AnalysisClient(base_url)
+    try:
+        client.health(timeout=timeout)
+    except ServiceError:
+        return None
+    return client
@@ -0,0 +1,198 @@
+# analysis_jobs.py
+
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import numpy as np
+from perf_trace import Trace, span
+from anomaly_flags import FLAGS_DTYPE, ML_ANOMALY, ML_MOVEMENT
+from train_model_dual import build_timeline, fit_and_score
+from model_ensemble import EnsembleModel
+from streaming_rules import evaluate_rules
+
+# Stage → progress shown once that stage has started
+STAGES = {
+    "queued": 0.0,
+    "timeline": 0.05,
+    "rules": 0.2,
+    "model": 0.35,
+    "merge": 0.95,
+    "done": 1.0,
+}
+
+# Which inputs (or upstream stages) each stage reads, in run order. A changed
+# input re-runs that stage and everything downstream of it; display-only
+# settings (speed threshold, filters) are not inputs at all.
+STAGE_INPUTS = {
+    "timeline": ["evidence"],
+    "rules": ["timeline", "gps_threshold_km", "max_gap_secs"],
+    "model": ["timeline", "model_type"],
+    "merge": ["rules", "model"],
+}
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="analysis")
+
+
+def stale_stages(changed):
+    """
+    Stages to re-run when the given inputs changed.
+    """
+    stale = set()
+    for stage, inputs in STAGE_INPUTS.items():
+        if any(i in changed or i in stale for i in inputs):
+            stale.add(stage)
+    return stale
+
+
+class AnalysisJob:
+    """
+    One background analysis run. Rule alerts are published to `partial`
+    as (timeline_df, alerts) before the model is fitted; `result` has the
+    same shape as train_anomaly_model's return value once status == "done".
+    Cancellation is checked between stages. The timeline and ML scores are
+    kept so update_rules() can re-run just the rules on new thresholds.
+    `version` goes up whenever partial or result is replaced. With a
+    `client` (analysis_client.AnalysisClient) the timeline, rules and model
+    stages run on the shared analysis service instead of in this process.
+    """
+
+    def __init__(self, inputs, full, client=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.inputs = dict(inputs)
+        self.full = full
+        self.client = client
+        self.status = "queued"
+        self.stage = "queued"
+        self.error = None
+        self.timeline = None
+        self.ml = None
+        self.partial = None
+        self.result = None
+        self.version = 0
+        self.started = datetime.now()
+        self.finished = None
+        self.trace = Trace(f"analysis {self.id}")
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        self.future = None
+
+    @property
+    def progress(self):
+        return STAGES.get(self.stage, 0.0)
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def changed(self, inputs):
+        return {k for k in set(inputs) | set(self.inputs) if inputs.get(k) != self.inputs.get(k)}
+
+    def _enter(self, stage):
+        if self.cancelled:
+            raise InterruptedError("Analysis cancelled")
+        self.stage = stage
+
+    def _rules(self):
+        # Rules need no model: run them on a copy with no ML verdicts
+        rule_df = self.timeline.copy()
+        rule_df["anomaly"] = 0
+        rule_df["flags"] = np.zeros(len(rule_df), dtype=FLAGS_DTYPE)
+        alerts = []
+        if self.full:
+            with span("rules", rows=len(rule_df), remote=self.client is not None) as s:
+                rule_df, alerts = (self.client.rules if self.client is not None else evaluate_rules)(
+                    rule_df,
+                    gps_threshold_km=self.inputs["gps_threshold_km"],
+                    max_gap_secs=self.inputs["max_gap_secs"],
+                )
+                s.meta["alerts"] = len(alerts)
+        self.partial = (rule_df, alerts)
+        self.version += 1
+
+    def _merge(self):
+        # ML and rule bits never overlap, so merging equals running the
+        # rules after the model (as train_full_model does)
+        model, scaler, features_df, anomaly, flags = self.ml
+        rule_df, alerts = self.partial
+        with span("merge", rows=len(rule_df)):
+            timeline_df = rule_df.copy()
+            timeline_df["anomaly"] = np.maximum(anomaly, rule_df["anomaly"].to_numpy())
+            timeline_df["flags"] = (flags | rule_df["flags"].to_numpy()).astype(FLAGS_DTYPE)
+            if isinstance(model, EnsembleModel):
+                timeline_df["anomaly_score"] = model.score
+        self.result = (model, scaler, timeline_df, features_df, alerts)
+        self.version += 1
+
+    def update_rules(self, inputs):
+        """
+        Take new rule thresholds and re-run only the rule and merge stages
+        on the cached timeline and ML scores (or let the worker pick them
+        up if it has not got that far yet).
+        """
+        with self._lock:
+            self.inputs = dict(inputs)
+            if self.timeline is None:
+                return self
+            self._rules()
+            if self.ml is not None:
+                self._merge()
+        return self
+
+
+def _run(job, gps_df, ipdr_df, cdr_df):
+    try:
+        job.status = "running"
+        with job.trace.activate(), span("analysis_job", model=job.inputs["model_type"]) as s:
+            job._enter("timeline")
+            timeline_df = (job.client.timeline if job.client is not None else build_timeline)(gps_df, ipdr_df, cdr_df)
+            s.rows = len(timeline_df)
+
+            job._enter("rules")
+            with job._lock:
+                job.timeline = timeline_df
+                job._rules()
+
+            job._enter("model")
+            ml = (job.client.score if job.client is not None else fit_and_score)(
+                timeline_df,
+                model_type=job.inputs["model_type"],
+                contamination=0.1 if job.full else 0.05,
+                ml_flag=ML_ANOMALY if job.full else ML_MOVEMENT,
+            )
+            job._enter("merge")
+            with job._lock:
+                job.ml = ml
+                job._merge()
+        job.stage = "done"
+        job.status = "done"
+    except InterruptedError:
+        job.status = "cancelled"
+    except Exception as e:
+        job.status = "failed"
+        job.error = str(e)
+    finally:
+        job.finished = datetime.now()
+    return job
+
+
+def start_analysis(gps_df, ipdr_df=None, cdr_df=None, evidence=None,
+                   gps_threshold_km=100, max_gap_secs=900, model_type="isolation_forest", client=None):
+    """
+    Build the timeline, run the rules and fit the model on a background
+    thread (on the analysis service if `client` is given). `evidence`
+    identifies the input data (e.g. file hashes) for change detection.
+    Takes ownership of the input frames; returns the AnalysisJob immediately.
+    """
+    full = not (ipdr_df is None or ipdr_df.empty or cdr_df is None or cdr_df.empty)
+    job = AnalysisJob({
+        "evidence": evidence,
+        "gps_threshold_km": gps_threshold_km,
+        "max_gap_secs": max_gap_secs,
+        "model_type": model_type,
+    }, full, client=client)
+    job.future = _executor.submit(_run, job, gps_df, ipdr_df, cdr_df)
+    return job
@@ -0,0 +1,367 @@
+# analysis_service.py
+
+import os
+import json
+import time
+import hashlib
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# One analysis service per host, shared by every investigator's front-end.
+# A pool of worker processes is started (and warmed: sklearn, the pipeline
+# modules, the tower index and threat feeds loaded) once, and identical
+# requests are answered once: from a bounded result cache, or by waiting on
+# the request already in flight. Binds to localhost and needs no network.
+
+HOST = os.environ.get("DIFA_SERVICE_HOST", "127.0.0.1")
+PORT = int(os.environ.get("DIFA_SERVICE_PORT", "8765"))
+WORKERS = int(os.environ.get("DIFA_SERVICE_WORKERS", str(min(4, os.cpu_count() or 1))))
+CACHE_MB = int(os.environ.get("DIFA_SERVICE_CACHE_MB", "512"))
+MAX_BODY_MB = int(os.environ.get("DIFA_SERVICE_MAX_BODY_MB", "1024"))
+
+
+# ⚙️ Worker side: every operation takes and returns JSON bytes
+def _warm_worker():
+    import sklearn.ensemble  # noqa: F401
+    import train_model_dual  # noqa: F401
+    from tower_db import get_tower_db
+    from domain_matcher import get_domain_matcher
+
+    get_tower_db()
+    get_domain_matcher()
+
+
+def _ping(delay=0.0):
+    time.sleep(delay)
+    return os.getpid()
+
+
+def _op_normalize(req):
+    from utils import normalize_columns
+    from analysis_client import encode_frame, decode_frame
+
+    df = normalize_columns(decode_frame(req["data"]), type=req.get("type", "generic"))
+    return {"data": encode_frame(df), "attrs": df.attrs}
+
+
+def _frames(req):
+    from utils import normalize_columns
+    from analysis_client import decode_frame
+
+    frames = {k: decode_frame(req.get(k)) for k in ("gps", "ipdr", "cdr")}
+    if req.get("normalize"):
+        frames = {k: normalize_columns(df, type=k) if not df.empty else df for k, df in frames.items()}
+    return frames
+
+
+def _op_timeline(req):
+    from train_model_dual import build_timeline
+    from analysis_client import encode_frame
+
+    frames = _frames(req)
+    timeline_df = build_timeline(frames["gps"], frames["ipdr"], frames["cdr"])
+    return {"timeline": encode_frame(timeline_df), "attrs": timeline_df.attrs}
+
+
+def _op_rules(req):
+    from streaming_rules import evaluate_rules
+    from analysis_client import encode_frame, decode_frame, encode_alerts
+
+    timeline_df, alerts = evaluate_rules(
+        decode_frame(req["timeline"]),
+        gps_threshold_km=req.get("gps_threshold_km", 100),
+        max_gap_secs=req.get("max_gap_secs", 900),
+    )
+    return {"timeline": encode_frame(timeline_df), "attrs": timeline_df.attrs, "alerts": encode_alerts(alerts)}
+
+
+def _op_score(req):
+    from anomaly_flags import ML_ANOMALY
+    from train_model_dual import fit_and_score
+    from analysis_client import decode_frame, encode_model
+
+    ml_flag = req.get("ml_flag")
+    model, _, _, anomaly, flags = fit_and_score(
+        decode_frame(req["timeline"]),
+        model_type=req.get("model_type", "isolation_forest"),
+        contamination=req.get("contamination", 0.1),
+        ml_flag=ML_ANOMALY if ml_flag is None else ml_flag,
+    )
+    return {"anomaly": anomaly.tolist(), "flags": flags.tolist(), "model": encode_model(model)}
+
+
+def _op_analyze(req):
+    from train_model_dual import train_anomaly_model
+    from analysis_client import encode_frame, encode_alerts, encode_model
+
+    frames = _frames(req)
+    model, _, timeline_df, _, alerts = train_anomaly_model(
+        frames["gps"], frames["ipdr"], frames["cdr"],
+        gps_threshold_km=req.get("gps_threshold_km", 100),
+        max_gap_secs=req.get("max_gap_secs", 900),
+        speed_threshold=req.get("speed_threshold", 500),
+        model_type=req.get("model_type", "isolation_forest"),
+    )
+    return {
+        "timeline": encode_frame(timeline_df),
+        "attrs": timeline_df.attrs,
+        "alerts": encode_alerts(alerts),
+        "model": encode_model(model),
+    }
+
+
+def _op_correlate(req):
+    from correlation_engine import correlate_events
+
+    return {"events": correlate_events(req["timeline"], max_time_diff_sec=req.get("max_time_diff_sec", 120))}
+
+
+OPERATIONS = {
+    "normalize": _op_normalize,
+    "timeline": _op_timeline,
+    "rules": _op_rules,
+    "score": _op_score,
+    "analyze": _op_analyze,
+    "correlate": _op_correlate,
+}
+
+
+class RequestError(ValueError):
+    pass
+
+
+def _run_operation(name, body):
+    # Bad input (missing keys, wrong types, unparsable frames) → RequestError → 400
+    try:
+        req = json.loads(body)
+    except ValueError as e:
+        raise RequestError(f"Invalid JSON: {e}")
+    if not isinstance(req, dict):
+        raise RequestError("Request body must be a JSON object")
+    try:
+        result = OPERATIONS[name](req)
+    except (KeyError, ValueError, TypeError) as e:
+        raise RequestError(f"{type(e).__name__}: {e}")
+    return json.dumps(result, default=str).encode("utf-8")
+
+
+# 🧠 Service side
+class AnalysisService:
+    """
+    Warm worker pool plus a result cache shared by all clients. call()
+    returns (HTTP status, JSON bytes). Identical requests (same operation,
+    same body) are computed once: later ones are served from the LRU cache
+    (bounded by cache_mb) or wait for the one already running.
+    """
+
+    def __init__(self, workers=WORKERS, cache_mb=CACHE_MB):
+        self.workers = workers
+        self.cache_limit = cache_mb * 2**20
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.stats = {"requests": 0, "computed": 0, "cache_hits": 0, "joined_inflight": 0, "errors": 0,
+                      "restarts": 0, "busy_secs": 0.0}
+        self.restarting = False
+        self.pool, self.worker_pids = self._new_pool()
+
+    def _new_pool(self):
+        # Spawned workers (TensorFlow does not survive fork); one ping per
+        # worker, held briefly, so every process is up and warm before
+        # the first real request. Blocks for the whole warm-up.
+        pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_warm_worker,
+        )
+        pings = [pool.submit(_ping, 0.2) for _ in range(self.workers)]
+        return pool, sorted({p.result() for p in pings})
+
+    def _restart_pool(self, broken):
+        # Replace a crashed pool once, warming the new one outside self.lock
+        # so cache hits and health checks are answered meanwhile
+        with self.lock:
+            if self.pool is not broken or self.restarting:
+                return
+            self.restarting = True
+        broken.shutdown(wait=False, cancel_futures=True)
+        try:
+            pool, pids = self._new_pool()
+        except Exception:
+            with self.lock:
+                self.restarting = False
+            raise
+        with self.lock:
+            self.pool, self.worker_pids = pool, pids
+            self.restarting = False
+            self.stats["restarts"] += 1
+
+    def _restart_in_background(self, broken):
+        threading.Thread(target=self._restart_pool, args=(broken,), daemon=True, name="pool-restart").start()
+
+    def _unavailable(self, pool):
+        self._restart_in_background(pool)
+        with self.lock:
+            self.stats["errors"] += 1
+        return 503, json.dumps({"error": "Worker pool crashed; restarting, retry the request"}).encode("utf-8")
+
+    def _cache_put(self, key, payload):
+        if len(payload) > self.cache_limit:
+            return
+        self.cache[key] = payload
+        self.cache_bytes += len(payload)
+        while self.cache_bytes > self.cache_limit:
+            _, old = self.cache.popitem(last=False)
+            self.cache_bytes -= len(old)
+
+    def clear_cache(self):
+        with self.lock:
+            self.cache.clear()
+            self.cache_bytes = 0
+
+    def call(self, name, body):
+        if name not in OPERATIONS:
+            return 404, json.dumps({"error": f"Unknown operation: {name}"}).encode("utf-8")
+        key = hashlib.sha256(name.encode("utf-8") + b"\0" + body).hexdigest()
+        with self.lock:
+            self.stats["requests"] += 1
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.stats["cache_hits"] += 1
+                return 200, self.cache[key]
+            future = self.inflight.get(key)
+            owner = future is None
+            pool = self.pool
+            if owner:
+                try:
+                    future = pool.submit(_run_operation, name, body)
+                except RuntimeError:
+                    # Broken, or already shut down by a restart in progress
+                    future = None
+                else:
+                    self.inflight[key] = future
+            else:
+                self.stats["joined_inflight"] += 1
+        if future is None:
+            return self._unavailable(pool)
+
+        started = time.perf_counter()
+        try:
+            payload = future.result()
+            status = 200
+        except RequestError as e:
+            status, payload = 400, json.dumps({"error": str(e)}).encode("utf-8")
+        except BrokenProcessPool:
+            status, payload = 503, json.dumps({"error": "Worker pool crashed; restarting, retry the request"}).encode("utf-8")
+            self._restart_in_background(pool)
+        except Exception as e:
+            status, payload = 500, json.dumps({"error": f"{type(e).__name__}: {e}"}).encode("utf-8")
+        finally:
+            if owner:
+                with self.lock:
+                    self.inflight.pop(key, None)
+
+        with self.lock:
+            if owner:
+                self.stats["busy_secs"] += time.perf_counter() - started
+                if status == 200:
+                    self.stats["computed"] += 1
+                    self._cache_put(key, payload)
+            if status != 200:
+                self.stats["errors"] += 1
+        return status, payload
+
+    def health(self):
+        with self.lock:
+            return {
+                "status": "restarting" if self.restarting else "ok",
+                "workers": self.workers,
+                "worker_pids": self.worker_pids,
+                "uptime_secs": round(time.time() - self.started, 1),
+                "inflight": len(self.inflight),
+                "cache_entries": len(self.cache),
+                "cache_mb": round(self.cache_bytes / 2**20, 2),
+                **{k: round(v, 3) if isinstance(v, float) else v for k, v in self.stats.items()},
+            }
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, status, payload):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/health":
+            self._send(200, json.dumps(self.server.service.health()).encode("utf-8"))
+        else:
+            self._send(404, b'{"error": "Not found"}')
+
+    def do_DELETE(self):
+        if self.path.rstrip("/") == "/cache":
+            self.server.service.clear_cache()
+            self._send(200, b'{"status": "cleared"}')
+        else:
+            self._send(404, b'{"error": "Not found"}')
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_MB * 2**20:
+            self.close_connection = True
+            self._send(413, json.dumps({"error": f"Request body over {MAX_BODY_MB} MB"}).encode("utf-8"))
+            return
+        body = self.rfile.read(length)
+        status, payload = self.server.service.call(self.path.strip("/"), body)
+        self._send(status, payload)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def make_server(host=HOST, port=PORT, workers=WORKERS, cache_mb=CACHE_MB, verbose=False):
+    """
+    Threaded HTTP server with a started (warm) AnalysisService attached.
+    Call serve_forever() on it; server.service.shutdown() stops the pool.
+    """
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.verbose = verbose
+    server.service = AnalysisService(workers=workers, cache_mb=cache_mb)
+    return server
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Shared local DIFA analysis service (HTTP/JSON, warm worker pool).")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--cache-mb", type=int, default=CACHE_MB, help="Result cache size")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.workers, args.cache_mb, args.verbose)
+    print(f"🛰️ DIFA analysis service on http://{args.host}:{args.port} "
+          f"({args.workers} warm worker(s): {server.service.worker_pids})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.service.shutdown()
+        server.server_close()
@@ -1,26 +1,33 @@
 # android_feature_extractor.py
 
+import numpy as np
 import pandas as pd
 from datetime import datetime
-from utils import haversine  # Include your haversine function here
+from kinematics import kinematics
+from tower_db import get_tower_db, resolve_cdr_towers
 
-def parse_logs(gps_df, ipdr_df, cdr_df):
-    # Example IP → geo mapping
-    IP_GEO_DB = {
+# Example IP → geo mapping
+IP_GEO_DB = {
     "185.220.101.1": (48.8566, 2.3522),    # TOR exit in France
     "142.250.64.78": (37.7749, -122.4194), # Google (USA)
     "104.21.23.18": (40.7128, -74.0060),   # Discord (NY)
     "198.51.100.1": (33.6844, 73.0479),    # Fake malware (Pakistan)
 }
-    ipdr_df["lat"] = ipdr_df["ip"].map(lambda x: IP_GEO_DB.get(x, (None, None))[0])
-    ipdr_df["lon"] = ipdr_df["ip"].map(lambda x: IP_GEO_DB.get(x, (None, None))[1])
-    # Example CDR cell tower → location mapping
-    CELL_TOWER_DB = {
-    "DL001": (28.6139, 77.2090),  # Delhi
-    "MH007": (19.0760, 72.8777),  # Mumbai
-}
-    cdr_df["lat"] = cdr_df["cell_id"].map(lambda x: CELL_TOWER_DB.get(x, (None, None))[0])
-    cdr_df["lon"] = cdr_df["cell_id"].map(lambda x: CELL_TOWER_DB.get(x, (None, None))[1])
+
+
+def geolocate_ipdr(ipdr_df):
+    # Unknown IPs → NaN (not None) so the columns stay numeric
+    ipdr_df["lat"] = ipdr_df["ip"].map(lambda x: IP_GEO_DB.get(x, (np.nan, np.nan))[0]).astype(float)
+    ipdr_df["lon"] = ipdr_df["ip"].map(lambda x: IP_GEO_DB.get(x, (np.nan, np.nan))[1]).astype(float)
+    return ipdr_df
+
+
+def parse_logs(gps_df, ipdr_df, cdr_df, tower_db=None):
+    geolocate_ipdr(ipdr_df)
+    # CDR cell tower → location via the offline tower index
+    if tower_db is None:
+        tower_db = get_tower_db()
+    cdr_df["lat"], cdr_df["lon"], tower_stats = resolve_cdr_towers(cdr_df, tower_db)
 
 
     gps_df['type'] = 'gps'
@@ -28,37 +35,28 @@ def parse_logs(gps_df, ipdr_df, cdr_df):
     cdr_df['type'] = 'cdr'
     all_df = pd.concat([gps_df, ipdr_df, cdr_df])
     all_df['timestamp'] = pd.to_datetime(all_df['timestamp'])
-    return all_df.sort_values('timestamp').reset_index(drop=True)
+    all_df = all_df.sort_values('timestamp').reset_index(drop=True)
+    all_df.attrs["tower_lookup"] = tower_stats
+    return all_df
 
 def extract_features(timeline_df):
-    features = []
-    last = None
-
-    for _, row in timeline_df.iterrows():
-        feature = {
-            "type_gps": 1 if row["type"].lower() == "gps" else 0,
-            "type_ipdr": 1 if row["type"].lower() == "ipdr" else 0,
-            "type_cdr": 1 if row["type"].lower() == "cdr" else 0,
-            "hour": row["timestamp"].hour,
-        }
-
-        if last is not None:
-            time_diff = (row["timestamp"] - last["timestamp"]).total_seconds()
-            dist = haversine(row["lat"], row["lon"], last["lat"], last["lon"])
-            speed = dist / (time_diff / 3600) if time_diff > 0 else 0
-        else:
-            time_diff = 0
-            dist = 0
-            speed = 0
-
-        feature["delta_sec"] = time_diff
-        feature["dist_km"] = dist
-        feature["speed_kmph"] = speed
-
-        features.append(feature)
-        last = row
-
-    return pd.DataFrame(features)
+    # Movement features come from the shared kinematics columns
+    kin = kinematics(timeline_df)
+    types = timeline_df["type"].str.lower().to_numpy()
+
+    features = pd.DataFrame({
+        "type_gps": (types == "gps").astype(int),
+        "type_ipdr": (types == "ipdr").astype(int),
+        "type_cdr": (types == "cdr").astype(int),
+        "hour": pd.to_datetime(timeline_df["timestamp"]).dt.hour.to_numpy(),
+        "delta_sec": kin["delta_sec"].to_numpy(),
+        "dist_km": kin["dist_km"].to_numpy(),
+        "speed_kmph": kin["speed_kmph"].to_numpy(),
+    })
+    # First event has nothing to move from
+    if len(features):
+        features.loc[0, ["delta_sec", "dist_km", "speed_kmph"]] = 0.0
+    return features
 
 
 
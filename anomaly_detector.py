@@ -3,42 +3,27 @@
 import pandas as pd
 import numpy as np
 from sklearn.ensemble import IsolationForest
-from utils import haversine
+from kinematics import kinematics
 
 def extract_features(timeline):
-    features = []
+    df = pd.DataFrame(timeline)
+    types = df["type"].to_numpy()
+    is_gps = types == "gps"
 
-    last_location = None
-    last_time = None
+    features = pd.DataFrame({
+        "type_gps": is_gps.astype(int),
+        "type_ipdr": (types == "ipdr").astype(int),
+        "type_cdr": (types == "cdr").astype(int),
+    })
+    for col in ("upload", "download", "duration"):
+        features[col] = pd.to_numeric(df[col], errors="coerce").fillna(0).to_numpy() if col in df.columns else 0
+    features["hour"] = pd.to_datetime(df["timestamp"]).dt.hour.to_numpy()
 
-    for event in timeline:
-        feature = {
-            "type_gps": 1 if event["type"] == "gps" else 0,
-            "type_ipdr": 1 if event["type"] == "ipdr" else 0,
-            "type_cdr": 1 if event["type"] == "cdr" else 0,
-            "upload": event.get("upload", 0),
-            "download": event.get("download", 0),
-            "duration": event.get("duration", 0),
-            "hour": event["timestamp"].hour,
-            "speed": 0  # will be filled later if GPS
-        }
-
-        if event["type"] == "gps":
-            if last_location and last_time:
-                dist = haversine(
-                    last_location[0], last_location[1],
-                    event["lat"], event["lon"]
-                )
-                time_diff = (event["timestamp"] - last_time).total_seconds() / 3600
-                if time_diff > 0:
-                    feature["speed"] = dist / time_diff  # km/h
-
-            last_location = (event["lat"], event["lon"])
-            last_time = event["timestamp"]
-
-        features.append(feature)
-
-    return pd.DataFrame(features)
+    # GPS speed vs the previous GPS fix (shared kinematics stage); 0 otherwise
+    speed = kinematics(df)["same_type_speed_kmph"].to_numpy()
+    features["speed"] = np.where(is_gps & ~np.isnan(speed), speed, 0.0)
+
+    return features
 
 
 def detect_anomalies(timeline):
@@ -51,9 +36,11 @@ def detect_anomalies(timeline):
     df["is_anomaly"] = model.predict(df)  # -1 for anomaly
 
     # Attach results back to timeline
-    for i, event in enumerate(timeline):
-        event["anomaly_score"] = round(float(df.loc[i, "anomaly_score"]), 4)
-        event["is_anomaly"] = int(df.loc[i, "is_anomaly"] == -1)
+    scores = np.round(df["anomaly_score"].to_numpy(dtype=float), 4).tolist()
+    flagged = (df["is_anomaly"].to_numpy() == -1).astype(int).tolist()
+    for event, score, is_anomaly in zip(timeline, scores, flagged):
+        event["anomaly_score"] = score
+        event["is_anomaly"] = is_anomaly
 
     return timeline
 
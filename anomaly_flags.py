@@ -0,0 +1,99 @@
+# anomaly_flags.py
+
+import numpy as np
+import pandas as pd
+
+# Reason code registry: every detector sets one bit in the `flags` column.
+# Text is only produced by render_notes() at display/report time.
+ML_ANOMALY = 1 << 0
+ML_MOVEMENT = 1 << 1
+AUTOENCODER = 1 << 2
+SIM_SPOOF_JUMP = 1 << 3
+GPS_IP_CONFLICT = 1 << 4
+IP_HOPS = 1 << 5
+TOR_SERVICE = 1 << 6
+MALWARE_DOMAIN = 1 << 7
+THREAT_DOMAIN = 1 << 8
+UNREALISTIC_SPEED = 1 << 9
+
+REASONS = {
+    ML_ANOMALY: "⚠️ Anomaly detected",
+    ML_MOVEMENT: "⚠️ Unrealistic movement",
+    AUTOENCODER: "⚠️ Autoencoder anomaly",
+    SIM_SPOOF_JUMP: "⚠️ SIM Spoof: CDR/IP jump without GPS",
+    GPS_IP_CONFLICT: "⚠️ GPS-IP conflict → SIM spoof",
+    IP_HOPS: "⚠️ Multiple IP hops",
+    TOR_SERVICE: "⚠️ TOR Hidden Service",
+    MALWARE_DOMAIN: "⚠️ Malware Domain",
+    THREAT_DOMAIN: "⚠️ Threat-intel Domain",
+    UNREALISTIC_SPEED: "⚠️ Unrealistic speed",
+}
+
+# Reason groups used by filters, summary metrics and scoring. They match what
+# the old note-substring checks matched: "jump" only the Rule-1 note, "spoof"
+# (case-sensitive) only the Rule-2 note. No detector writes a SIM-swap reason
+# of its own, so "swap" is empty.
+FLAG_GROUPS = {
+    "jump": SIM_SPOOF_JUMP,
+    "spoof": GPS_IP_CONFLICT,
+    "swap": 0,
+    "domain": TOR_SERVICE | MALWARE_DOMAIN | THREAT_DOMAIN,
+}
+
+# Anything that reads as implausible movement; map colour only
+MOVEMENT_FLAGS = SIM_SPOOF_JUMP | ML_MOVEMENT | UNREALISTIC_SPEED
+
+# Bits set by the rule engine (detect_spoofing_and_sim_swap), as opposed to models
+RULE_FLAGS = SIM_SPOOF_JUMP | GPS_IP_CONFLICT | IP_HOPS | TOR_SERVICE | MALWARE_DOMAIN | THREAT_DOMAIN
+
+FLAGS_DTYPE = np.uint32
+
+
+def empty_flags(n):
+    return np.zeros(n, dtype=FLAGS_DTYPE)
+
+
+def get_flags(df):
+    """
+    The flags column as a uint32 array (zeros if the frame has none).
+    """
+    if "flags" not in df.columns:
+        return empty_flags(len(df))
+    return df["flags"].fillna(0).to_numpy().astype(FLAGS_DTYPE)
+
+
+def has_any(flags, mask):
+    return (np.asarray(flags, dtype=FLAGS_DTYPE) & FLAGS_DTYPE(mask)) != 0
+
+
+def reason_count(flags):
+    """
+    Number of distinct reasons set per row (popcount).
+    """
+    flags = np.asarray(flags, dtype=FLAGS_DTYPE)
+    count = np.zeros(len(flags), dtype=np.int8)
+    for bit in REASONS:
+        count += (flags & FLAGS_DTYPE(bit)) != 0
+    return count
+
+
+def reason_totals(flags):
+    """
+    {label: rows with that reason} for every reason present.
+    """
+    flags = np.asarray(flags, dtype=FLAGS_DTYPE)
+    totals = {label: int(((flags & FLAGS_DTYPE(bit)) != 0).sum()) for bit, label in REASONS.items()}
+    return {label: n for label, n in totals.items() if n}
+
+
+def describe(value, sep=" | "):
+    return sep.join(label for bit, label in REASONS.items() if int(value) & bit)
+
+
+def render_notes(flags, sep=" | "):
+    """
+    Text notes for a flags array, rendered once per distinct flag value.
+    """
+    codes, uniques = pd.factorize(np.asarray(flags, dtype=FLAGS_DTYPE))
+    texts = np.array([describe(u, sep) for u in uniques] + [""], dtype=object)
+    return texts[codes]
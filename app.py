@@ -3,10 +3,15 @@ import streamlit as st
 import os
 import json
 import pandas as pd
-from utils import normalize_columns, check_required, extract_gps_from_android_image,compute_file_hash
+from utils import normalize_columns, check_required, extract_gps_from_android_image
 from train_model import train_anomaly_model, format_output_table,detect_spoofing_and_sim_swap
 from streamlit_folium import st_folium
 from map_utils import create_hybrid_movement_map_with_labels
+from evidence_hash import HashManifest, folder_evidence, hash_evidence, manifest_path_for
+from timeline_view import prepare_timeline_view, filter_mask, summarize_view
+from anomaly_flags import get_flags, render_notes, reason_totals
+from perf_trace import span, start_trace
+from ipdr_sessions import DEFAULT_IDLE_GAP_SECS, sessionize_ipdr
 import altair as alt
 
 st.set_page_config(page_title="Android Forensics")
@@ -21,6 +26,7 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 st.title("\U0001F50D Android Forensics: GPS + IPDR + CDR Analyzer")
+trace = start_trace("analysis")
 
 # Sidebar: Uploads and settings
 st.sidebar.header("\U0001F4C2 Upload Forensic Logs")
@@ -39,15 +45,25 @@ with st.sidebar.expander("\u2699\ufe0f Detection Parameters", expanded=False):
     gps_threshold_km = st.slider("\U0001F4CD GPS Distance Threshold (km)", 10, 500, value=gps_threshold_default, step=10)
     max_gap_secs = st.slider("\u23F1\ufe0f Max Time Gap Between Logs (seconds)", 60, 3600, value=max_gap_default, step=60)
     speed_threshold = st.slider("\U0001F697 High-Speed Movement Threshold (km/h)", 100, 1000, value=speed_threshold_default, step=50)
+    stitch_sessions = st.checkbox("\U0001F9F5 Stitch IPDR records into sessions", value=True)
+    ipdr_idle_gap = st.slider("\U0001F4A4 IPDR Session Idle Gap (seconds)", 30, 3600, value=DEFAULT_IDLE_GAP_SECS, step=30)
 
 # Load Data
 if use_logical_image:
     folder_path = st.sidebar.text_input("Enter folder path (e.g. extracted_logical_image/)", value="my_folder")
-    gps_df = extract_gps_from_android_image(folder_path) if os.path.exists(folder_path) else pd.DataFrame()
+    with span("extract_gps") as s:
+        gps_df = extract_gps_from_android_image(folder_path) if os.path.exists(folder_path) else pd.DataFrame()
+        s.rows = len(gps_df)
     if gps_df.empty:
         st.sidebar.error("\u274C Folder not found or empty!")
     else:
         st.sidebar.success(f"\u2705 Loaded {len(gps_df)} GPS points from folder")
+        extraction = gps_df.attrs.get("extraction")
+        if extraction:
+            st.sidebar.caption(f"🗂️ Parsed {extraction['parsed']} file(s), reused {extraction['cached']} from cache")
+        gps_dedup = gps_df.attrs.get("dedup")
+        if gps_dedup:
+            st.sidebar.caption(f"🧹 Removed {gps_dedup['removed']:,} duplicate fix(es)")
 else:
     gps_file = st.sidebar.file_uploader("Upload GPS CSV", type="csv")
     gps_df = pd.read_csv(gps_file) if gps_file else pd.DataFrame()
@@ -55,27 +71,45 @@ else:
 ipdr_file = st.sidebar.file_uploader("Upload IPDR CSV (optional)", type="csv")
 cdr_file = st.sidebar.file_uploader("Upload CDR CSV (optional)", type="csv")
 
-file_hashes = []
-if not use_logical_image :
-    if gps_file:
-        file_hashes.append(("GPS", gps_file.name, compute_file_hash(gps_file), gps_file.getbuffer().nbytes))
+evidence = []
+if use_logical_image:
+    if os.path.exists(folder_path):
+        evidence += folder_evidence(folder_path)
+elif gps_file:
+    evidence.append(("GPS", gps_file.name, gps_file))
 if ipdr_file:
-    file_hashes.append(("IPDR", ipdr_file.name, compute_file_hash(ipdr_file), ipdr_file.getbuffer().nbytes))
+    evidence.append(("IPDR", ipdr_file.name, ipdr_file))
 if cdr_file:
-    file_hashes.append(("CDR", cdr_file.name, compute_file_hash(cdr_file), cdr_file.getbuffer().nbytes))
+    evidence.append(("CDR", cdr_file.name, cdr_file))
+hash_manifest = HashManifest(manifest_path_for(folder_path)) if use_logical_image else None
+with span("hash_evidence", rows=len(evidence)):
+    file_hashes, hash_stats = hash_evidence(evidence, manifest=hash_manifest)
+if hash_stats["reused"]:
+    st.sidebar.caption(f"🔐 Hashed {hash_stats['hashed']} file(s), reused {hash_stats['reused']} unchanged from manifest")
 
 
 # Proceed if data is ready
 if not gps_df.empty and (gps_only or (ipdr_file and cdr_file)):
-    gps_df = normalize_columns(gps_df, type="gps")
-    ipdr_df = normalize_columns(pd.read_csv(ipdr_file), type="ipdr") if ipdr_file else pd.DataFrame()
-    cdr_df = normalize_columns(pd.read_csv(cdr_file), type="cdr") if cdr_file else pd.DataFrame()
+    with span("normalize") as s:
+        gps_df = normalize_columns(gps_df, type="gps")
+        ipdr_df = normalize_columns(pd.read_csv(ipdr_file), type="ipdr") if ipdr_file else pd.DataFrame()
+        cdr_df = normalize_columns(pd.read_csv(cdr_file), type="cdr") if cdr_file else pd.DataFrame()
+        s.rows = len(gps_df) + len(ipdr_df) + len(cdr_df)
+
+    ipdr_sessionization = {}
+    if stitch_sessions and not ipdr_df.empty:
+        with span("ipdr_sessions", rows=len(ipdr_df)):
+            ipdr_df = sessionize_ipdr(ipdr_df, idle_gap_secs=ipdr_idle_gap)
+            ipdr_sessionization = ipdr_df.attrs["sessionization"]
+        st.sidebar.caption(f"\U0001F9F5 {ipdr_sessionization['records']:,} IPDR records → {ipdr_sessionization['sessions']:,} sessions")
 
     check_required(gps_df, ["timestamp", "lat", "lon"], "GPS")
     check_required(ipdr_df, ["timestamp", "ip", "domain", "lat", "lon"], "IPDR")
     check_required(cdr_df, ["timestamp", "contact", "call_type", "lat", "lon"], "CDR")
 
-    model, scaler, timeline_df, features_df, alerts = train_anomaly_model(gps_df, ipdr_df, cdr_df)
+    with span("train_anomaly_model") as s:
+        model, scaler, timeline_df, features_df, alerts = train_anomaly_model(gps_df, ipdr_df, cdr_df)
+        s.rows = len(timeline_df)
     st.toast("\u2705 Model trained and timeline generated!", icon="\U0001F680")
 
     # Filters
@@ -84,48 +118,55 @@ if not gps_df.empty and (gps_only or (ipdr_file and cdr_file)):
     event_types = timeline_df['type'].dropna().unique().tolist()
     selected_types = st.sidebar.multiselect("\U0001F4CA Event Types", event_types, default=event_types)
 
-    suspicious_domains = ["telegram", "onion", "vpn", "tor"]
     with st.sidebar.expander("\u2699\ufe0f Advanced Filters", expanded=False):
         suspicious_only = st.checkbox("\U0001F575\ufe0f Suspicious domains")
         start_time = st.time_input("\U0001F551 Start Time", value=pd.to_datetime("00:00").time())
         end_time = st.time_input("\U0001F551 End Time", value=pd.to_datetime("23:59").time())
 
-    filtered_df = timeline_df.copy()
-    if anomaly_only: filtered_df = filtered_df[filtered_df['anomaly'] == 1]
-    if selected_types: filtered_df = filtered_df[filtered_df['type'].isin(selected_types)]
-    if suspicious_only and 'domain' in filtered_df.columns:
-        filtered_df = filtered_df[filtered_df['domain'].str.contains('|'.join(suspicious_domains), na=False, case=False)]
-    if 'speed_kmph' in filtered_df.columns:
-        filtered_df = filtered_df[pd.to_numeric(filtered_df['speed_kmph'], errors='coerce') > speed_threshold]
-    if long_jump_only and 'notes' in filtered_df.columns:
-        filtered_df = filtered_df[filtered_df['notes'].str.contains('jump', na=False)]
-    filtered_df['hour'] = pd.to_datetime(filtered_df['timestamp']).dt.time
-    filtered_df = filtered_df[(filtered_df['hour'] >= start_time) & (filtered_df['hour'] <= end_time)]
+    with span("filter", rows=len(timeline_df)):
+        filter_view = prepare_timeline_view(timeline_df)
+        filter_rows = filter_mask(
+            filter_view,
+            anomaly_only=anomaly_only,
+            selected_types=selected_types,
+            suspicious_only=suspicious_only,
+            long_jump_only=long_jump_only,
+            start_time=start_time,
+            end_time=end_time,
+            speed_threshold=speed_threshold,
+        )
+        filtered_df = timeline_df[filter_rows]
 
     # Investigation Summary
     st.markdown("---")
     st.markdown("## \U0001F9E0 Investigation Summary")
-    summary = {
-        "Total Events": len(filtered_df),
-        "Anomalies Detected": filtered_df['anomaly'].sum(),
-        "GPS Jumps": filtered_df['notes'].str.contains("jump", na=False).sum(),
-        "SIM Swap Events": filtered_df['notes'].str.contains("swap", na=False).sum(),
-        "Spoofing Detected": filtered_df['notes'].str.contains("spoof", na=False).sum(),
-        "Correlation Score > 3": (filtered_df['correlation_score'] > 3).sum() if 'correlation_score' in filtered_df.columns else 0
-    }
+    # app.py retrains on every rerun, so there is no result to build a
+    # rollup cube for once; summarize the filtered rows directly
+    summary = summarize_view(
+        filter_view, filter_rows,
+        correlation_score=timeline_df['correlation_score'] if 'correlation_score' in timeline_df.columns else None,
+    )
     st.table(pd.DataFrame(summary.items(), columns=["Metric", "Value"]))
 
     st.markdown("---")
     tab1, tab2, tab3 = st.tabs(["\U0001F4CB Timeline", "\U0001F4CA Chart", "\U0001F4CD Map"])
     with tab1:
-        st.dataframe(format_output_table(filtered_df).style.set_properties(**{"white-space": "pre-line"}))
+        page_size = 1000
+        page_count = max((len(filtered_df) - 1) // page_size + 1, 1)
+        page = st.number_input("\U0001F4C4 Page", min_value=1, max_value=page_count, value=1, step=1) if page_count > 1 else 1
+        page_rows = slice((page - 1) * page_size, page * page_size)
+        with span("format_output_table", rows=min(page_size, len(filtered_df))):
+            output_df = format_output_table(filtered_df, rows=page_rows, speed_threshold=speed_threshold)
+        st.dataframe(output_df.style.set_properties(**{"white-space": "pre-line"}))
     with tab2:
         counts = filtered_df[filtered_df['anomaly'] == 1]['type'].value_counts().reset_index()
         counts.columns = ['Event Type', 'Count']
         st.altair_chart(alt.Chart(counts).mark_bar().encode(x='Event Type', y='Count', color='Event Type'), use_container_width=True)
     with tab3:
         st.markdown("### \U0001F5FA\ufe0f Movement Map")
-        st_folium(create_hybrid_movement_map_with_labels(filtered_df), width=800, height=550)
+        with span("map", rows=len(filtered_df)):
+            movement_map = create_hybrid_movement_map_with_labels(filtered_df)
+        st_folium(movement_map, width=800, height=550)
 
     with st.expander("\U0001F6A8 View Alert Messages", expanded=False):
         if alerts:
@@ -133,6 +174,14 @@ if not gps_df.empty and (gps_only or (ipdr_file and cdr_file)):
         else:
             st.info("\u2705 No alerts raised based on current filters.")
 
+    with st.expander("\u23F1\ufe0f Performance", expanded=False):
+        st.dataframe(trace.summary(), hide_index=True)
+        st.download_button(
+            "⬇️ Download Chrome Trace",
+            json.dumps(trace.to_chrome_trace(), default=str),
+            file_name="difa_trace.json",
+        )
+
     st.markdown("---")
     st.header("\U0001F4C4 Forensic Report")
     st.subheader("\U0001F512 Uploaded File Hashes")
@@ -152,8 +201,14 @@ if not gps_df.empty and (gps_only or (ipdr_file and cdr_file)):
         "Time Window": f"{start_time} - {end_time}"
     })
 
+    tower_lookup = timeline_df.attrs.get("tower_lookup", {})
+    if tower_lookup:
+        st.subheader("\U0001F4E1 Cell Tower Lookup")
+        st.json(tower_lookup)
+
     st.subheader("\U0001F4AC Notable Events")
-    top_alerts = timeline_df[timeline_df['notes'].notna()].sort_values("timestamp").head(10)
+    top_alerts = timeline_df[get_flags(timeline_df) != 0].sort_values("timestamp").head(10)
+    top_alerts = top_alerts.assign(notes=render_notes(get_flags(top_alerts)))
     for _, row in top_alerts.iterrows():
         st.markdown(f"- **{row['timestamp']}** — {row['notes']}")
 
@@ -173,6 +228,10 @@ if not gps_df.empty and (gps_only or (ipdr_file and cdr_file)):
             "time_window": f"{start_time} - {end_time}"
         },
         "findings": summary,
+        "reason_counts": reason_totals(get_flags(timeline_df)),
+        "tower_lookup": tower_lookup,
+        "ipdr_sessionization": ipdr_sessionization,
+        "performance": trace.to_records(),
         "alerts": top_alerts[["timestamp", "notes"]].to_dict(orient="records")
     }
     st.download_button(
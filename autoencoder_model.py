@@ -13,8 +13,11 @@ def train_autoencoder_model(X_scaled, encoding_dim=8, epochs=50):
     autoencoder.fit(X_scaled, X_scaled, epochs=epochs, batch_size=32, shuffle=True, validation_split=0.1, verbose=0)
     return autoencoder
 
+def reconstruction_error(autoencoder, X_scaled):
+    X_pred = autoencoder.predict(X_scaled, verbose=0)
+    return np.mean(np.square(X_scaled - X_pred), axis=1)
+
 def compute_autoencoder_anomalies(autoencoder, X_scaled, threshold_quantile=0.95):
-    X_pred = autoencoder.predict(X_scaled)
-    mse = np.mean(np.square(X_scaled - X_pred), axis=1)
+    mse = reconstruction_error(autoencoder, X_scaled)
     threshold = np.quantile(mse, threshold_quantile)
     return (mse > threshold).astype(int)
@@ -0,0 +1,302 @@
+# colocation_index.py
+
+import numpy as np
+import pandas as pd
+from utils import haversine_np
+
+# Metres per degree on the same sphere haversine_np measures on (R = 6371 km),
+# so a cell is never narrower than the distances it is compared against
+M_PER_DEG = 6_371_000.0 * np.pi / 180
+# Extra cell width for the rounding of the float32 lat/lon stored in the index
+CELL_MARGIN_M = 1.0
+
+# Upper bound on candidate point pairs materialized at once
+MAX_PAIRS_PER_BATCH = 5_000_000
+
+
+class CoLocationIndex:
+    """
+    Spatio-temporal grid over (lat, lon, time) points from many devices/cases.
+
+    Each point is hashed to a (time bucket, lat cell, lon cell) key no
+    smaller than the query radius/window, so any co-located pair lies in
+    the same or an adjacent cell. Queries only compare points in
+    neighbouring cells instead of all n² pairs.
+    """
+
+    def __init__(self, radius_m=200, window_secs=600):
+        self.radius_m = float(radius_m)
+        self.window_secs = int(window_secs)
+        self._parts = []
+        self._built = False
+
+    def add_points(self, df, device_id=None, case_id=None):
+        """
+        Add a normalized GPS frame or a tower-resolved timeline (parse_logs
+        output). Rows without coordinates or timestamps are skipped. The
+        device is taken from a `device_id` column, else from `device_id=`.
+        """
+        ts = pd.to_datetime(df["timestamp"], errors="coerce")
+        lat = pd.to_numeric(df["lat"], errors="coerce")
+        lon = pd.to_numeric(df["lon"], errors="coerce")
+        ok = (ts.notna() & lat.notna() & lon.notna()).to_numpy()
+
+        if "device_id" in df.columns:
+            devices = df["device_id"].astype(str).to_numpy()[ok]
+        else:
+            devices = np.full(ok.sum(), str(device_id if device_id is not None else case_id), dtype=object)
+        if case_id is not None:
+            devices = np.char.add(f"{case_id}:", devices.astype(str)).astype(object)
+
+        self._parts.append(pd.DataFrame({
+            "device": pd.Categorical(devices),
+            "t": ts[ok].to_numpy().astype("datetime64[s]").astype(np.int64),
+            "lat": lat[ok].to_numpy(np.float32),
+            "lon": lon[ok].to_numpy(np.float32),
+        }))
+        self._built = False
+        return self
+
+    def __len__(self):
+        return len(self.t) if self._built else sum(len(p) for p in self._parts)
+
+    def build(self):
+        """
+        Compute cell keys and sort points by key. Called lazily by query().
+        """
+        if self._parts:
+            pts = pd.concat(self._parts, ignore_index=True)
+            pts["device"] = pts["device"].astype("category")
+        else:
+            pts = pd.DataFrame({"device": pd.Categorical([]), "t": np.empty(0, np.int64),
+                                "lat": np.empty(0, np.float32), "lon": np.empty(0, np.float32)})
+
+        self.devices = pts["device"].cat.categories
+        dev = pts["device"].cat.codes.to_numpy(np.int32)
+        t = pts["t"].to_numpy()
+        lat = pts["lat"].to_numpy()
+        lon = pts["lon"].to_numpy()
+
+        # Lon cell width chosen for the highest latitude present, so every cell
+        # spans at least radius_m in both directions everywhere in the data
+        max_abs_lat = min(float(np.abs(lat).max()) if len(lat) else 0.0, 85.0)
+        cell_m = self.radius_m + CELL_MARGIN_M
+        self.dlat = cell_m / M_PER_DEG
+        self.dlon = cell_m / (M_PER_DEG * np.cos(np.radians(max_abs_lat)))
+
+        ct = t // max(self.window_secs, 1)
+        cy = np.floor(lat / self.dlat).astype(np.int64)
+        cx = np.floor(lon / self.dlon).astype(np.int64)
+        self._origin = (ct.min() if len(ct) else 0, cy.min() if len(cy) else 0, cx.min() if len(cx) else 0)
+        ct, cy, cx = ct - self._origin[0], cy - self._origin[1], cx - self._origin[2]
+        # +1 so neighbour offsets never wrap into a valid key
+        self._shape = (int(ct.max()) + 2 if len(ct) else 1, int(cy.max()) + 2 if len(cy) else 1, int(cx.max()) + 2 if len(cx) else 1)
+        if self._shape[0] * self._shape[1] * self._shape[2] >= 2 ** 62:
+            raise ValueError("Grid too large for radius/window; increase the radius or split the cases")
+
+        key = (ct * self._shape[1] + cy) * self._shape[2] + cx
+        order = np.argsort(key, kind="stable")
+
+        self.key = key[order]
+        self.dev = dev[order]
+        self.t = t[order]
+        self.lat = lat[order]
+        self.lon = lon[order]
+
+        # Cell table: unique keys, start offsets, counts, single-device flag
+        self.cells, self.cell_start, self.cell_count = np.unique(self.key, return_index=True, return_counts=True)
+        if len(self.cells):
+            dmin = np.minimum.reduceat(self.dev, self.cell_start)
+            dmax = np.maximum.reduceat(self.dev, self.cell_start)
+        else:
+            dmin = dmax = np.empty(0, np.int32)
+        self.cell_device = np.where(dmin == dmax, dmin, -1)
+
+        self._parts = [pts]
+        self._built = True
+        return self
+
+    def _neighbour_offsets(self):
+        # Half of the 3x3x3 neighbourhood (plus self) so each cell pair is visited once
+        nt, ny, nx = self._shape
+        offsets = []
+        for dt in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for dx in (-1, 0, 1):
+                    if (dt, dy, dx) >= (0, 0, 0):
+                        offsets.append((dt, dy, dx, (dt * ny + dy) * nx + dx))
+        return offsets
+
+    def _cell_pairs(self):
+        nt, ny, nx = self._shape
+        cells = self.cells
+        cx = cells % nx
+        cy = (cells // nx) % ny
+        for dt, dy, dx, dkey in self._neighbour_offsets():
+            valid = (cx + dx >= 0) & (cx + dx < nx) & (cy + dy >= 0) & (cy + dy < ny)
+            a = np.flatnonzero(valid)
+            target = cells[a] + dkey
+            b = np.searchsorted(cells, target)
+            b = np.minimum(b, len(cells) - 1)
+            hit = cells[b] == target
+            a, b = a[hit], b[hit]
+
+            # Skip cell pairs holding only one and the same device
+            same = (self.cell_device[a] >= 0) & (self.cell_device[a] == self.cell_device[b])
+            yield (dt, dy, dx) == (0, 0, 0), a[~same], b[~same]
+
+    def _point_pairs(self, self_pairs, a, b):
+        ca = self.cell_count[a].astype(np.int64)
+        cb = self.cell_count[b].astype(np.int64)
+        sizes = ca * cb
+        ends = np.cumsum(sizes)
+
+        lo = 0
+        while lo < len(a):
+            # Largest run of cell pairs that stays under the batch budget
+            budget = (ends[lo - 1] if lo else 0) + MAX_PAIRS_PER_BATCH
+            hi = max(int(np.searchsorted(ends, budget, side="right")), lo + 1)
+
+            if hi == lo + 1 and sizes[lo] > MAX_PAIRS_PER_BATCH:
+                # One very dense cell pair: walk it in row blocks instead
+                sa, sb = self.cell_start[a[lo]], self.cell_start[b[lo]]
+                step = max(MAX_PAIRS_PER_BATCH // int(cb[lo]), 1)
+                for r0 in range(0, int(ca[lo]), step):
+                    rows = np.arange(r0, min(r0 + step, int(ca[lo])))
+                    i = sa + np.repeat(rows, cb[lo])
+                    j = sb + np.tile(np.arange(cb[lo]), len(rows))
+                    if self_pairs:
+                        keep = i < j
+                        i, j = i[keep], j[keep]
+                    yield i, j
+                lo = hi
+                continue
+
+            rep = sizes[lo:hi]
+            k = np.repeat(np.arange(lo, hi), rep)
+            local = np.arange(rep.sum()) - np.repeat(np.cumsum(rep) - rep, rep)
+            i = self.cell_start[a[k]] + local // cb[k]
+            j = self.cell_start[b[k]] + local % cb[k]
+            if self_pairs:
+                keep = i < j
+                i, j = i[keep], j[keep]
+            yield i, j
+            lo = hi
+
+    def query(self, radius_m=None, window_secs=None, devices=None):
+        """
+        Device pairs seen within radius_m of each other within window_secs.
+        radius_m/window_secs may be tightened below the build values, not
+        widened. Returns one row per device pair with encounter count,
+        closest distance and first/last time seen together.
+        """
+        if not self._built:
+            self.build()
+        radius_m = self.radius_m if radius_m is None else float(radius_m)
+        window_secs = self.window_secs if window_secs is None else int(window_secs)
+        if radius_m > self.radius_m or window_secs > self.window_secs:
+            raise ValueError("Query radius/window larger than the index was built for")
+
+        allowed = None
+        if devices is not None:
+            allowed = np.isin(np.arange(len(self.devices)), self.devices.get_indexer(list(map(str, devices))))
+
+        chunks = []
+        for self_pairs, a, b in self._cell_pairs():
+            if len(a) == 0:
+                continue
+            for i, j in self._point_pairs(self_pairs, a, b):
+                di, dj = self.dev[i], self.dev[j]
+                keep = (di != dj) & (np.abs(self.t[i] - self.t[j]) <= window_secs)
+                if allowed is not None:
+                    keep &= allowed[di] & allowed[dj]
+                i, j = i[keep], j[keep]
+                if len(i) == 0:
+                    continue
+                dist_m = haversine_np(self.lat[i], self.lon[i], self.lat[j], self.lon[j]) * 1000
+                near = dist_m <= radius_m
+                i, j, dist_m = i[near], j[near], dist_m[near]
+                if len(i) == 0:
+                    continue
+
+                da, db = np.minimum(self.dev[i], self.dev[j]), np.maximum(self.dev[i], self.dev[j])
+                t = np.minimum(self.t[i], self.t[j])
+                chunks.append(pd.DataFrame({
+                    "a": da, "b": db, "dist_m": dist_m, "t": t,
+                    "lat": self.lat[i], "lon": self.lon[i],
+                }).groupby(["a", "b"]).agg(
+                    encounters=("dist_m", "size"),
+                    min_distance_m=("dist_m", "min"),
+                    first_t=("t", "min"),
+                    last_t=("t", "max"),
+                    lat=("lat", "first"),
+                    lon=("lon", "first"),
+                ))
+
+        columns = ["device_a", "device_b", "encounters", "min_distance_m", "first_seen", "last_seen", "lat", "lon"]
+        if not chunks:
+            return pd.DataFrame(columns=columns)
+
+        res = pd.concat(chunks).groupby(level=["a", "b"]).agg(
+            encounters=("encounters", "sum"),
+            min_distance_m=("min_distance_m", "min"),
+            first_t=("first_t", "min"),
+            last_t=("last_t", "max"),
+            lat=("lat", "first"),
+            lon=("lon", "first"),
+        ).reset_index()
+
+        res["device_a"] = self.devices[res["a"].to_numpy()]
+        res["device_b"] = self.devices[res["b"].to_numpy()]
+        res["first_seen"] = pd.to_datetime(res["first_t"], unit="s")
+        res["last_seen"] = pd.to_datetime(res["last_t"], unit="s")
+        res["min_distance_m"] = res["min_distance_m"].round(1)
+        return res[columns].sort_values(["encounters", "min_distance_m"], ascending=[False, True]).reset_index(drop=True)
+
+
+def find_colocations(frames, radius_m=200, window_secs=600):
+    """
+    One-shot helper: frames is {device_or_case_label: DataFrame}.
+    """
+    index = CoLocationIndex(radius_m=radius_m, window_secs=window_secs)
+    for label, df in frames.items():
+        index.add_points(df, device_id=label)
+    return index.query()
+
+
+def _synthetic_tracks(n_points, n_devices=1000, seed=0):
+    # Random-walk tracks around Delhi, one fix per ~minute per device
+    rng = np.random.default_rng(seed)
+    per_dev = max(n_points // n_devices, 1)
+    dev = np.repeat(np.arange(n_devices), per_dev)
+    start_lat = rng.uniform(28.4, 28.9, n_devices)
+    start_lon = rng.uniform(76.9, 77.5, n_devices)
+    steps = rng.normal(0, 0.0005, (2, len(dev))).astype(np.float32)
+    lat = start_lat[dev] + np.cumsum(steps[0].reshape(n_devices, per_dev), axis=1).ravel()
+    lon = start_lon[dev] + np.cumsum(steps[1].reshape(n_devices, per_dev), axis=1).ravel()
+    t = np.tile(np.arange(per_dev, dtype=np.int64) * 60, n_devices) + rng.integers(0, 60, len(dev))
+    return pd.DataFrame({
+        "device_id": dev,
+        "timestamp": pd.to_datetime("2025-01-01") + pd.to_timedelta(t, unit="s"),
+        "lat": lat,
+        "lon": lon,
+    })
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    n = int(float(sys.argv[1])) if len(sys.argv) > 1 else 1_000_000
+    n_devices = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    df = _synthetic_tracks(n, n_devices)
+    t0 = time.perf_counter()
+    index = CoLocationIndex(radius_m=200, window_secs=600).add_points(df).build()
+    t1 = time.perf_counter()
+    pairs = index.query()
+    t2 = time.perf_counter()
+
+    print(f"points={len(index):,} devices={n_devices} cells={len(index.cells):,}")
+    print(f"build={t1 - t0:.2f}s query={t2 - t1:.2f}s pairs={len(pairs):,}")
+    print(pairs.head(10).to_string(index=False))
@@ -1,37 +1,211 @@
 # correlation_engine.py
 
 from datetime import timedelta
+import numpy as np
+import pandas as pd
+
+# Edge types: (earlier event type, later event type) within the time window
+EDGE_TYPES = [("gps", "ipdr"), ("cdr", "gps")]
+EDGE_NAMES = ["gps→ipdr", "cdr→gps"]
+
+# Candidate pairs materialised per batch while building edges
+MAX_PAIRS_PER_BATCH = 5_000_000
+
+
+class CorrelationGraph:
+    """
+    Sparse event-correlation graph over a timeline (row positions 0..n-1).
+
+    Edges are stored in CSR form: the out-edges of event i are
+    indices[indptr[i]:indptr[i+1]], with edge_type (index into EDGE_NAMES)
+    and delta_sec (later minus earlier timestamp). A symmetric copy backs
+    neighbour lookups, and `session` labels every event with its connected
+    component ("activity session").
+    """
+
+    def __init__(self, n, src, dst, edge_type, delta_sec):
+        self.n = n
+        order = np.lexsort((dst, src))
+        src, dst = src[order], dst[order]
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n), out=self.indptr[1:])
+        self.indices = dst.astype(np.int64)
+        self.edge_type = edge_type[order].astype(np.int8)
+        self.delta_sec = delta_sec[order].astype(np.float32)
+
+        # Undirected adjacency: every edge seen from both ends
+        both_src = np.concatenate([src, dst])
+        both_order = np.argsort(both_src, kind="stable")
+        self._nbr_indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(both_src, minlength=n), out=self._nbr_indptr[1:])
+        self._nbr_indices = np.concatenate([dst, src])[both_order]
+        self._nbr_edge = np.concatenate([self.edge_type, self.edge_type])[both_order]
+        self._nbr_delta = np.concatenate([self.delta_sec, -self.delta_sec])[both_order]
+
+        self.session = self._components()
+
+    def __len__(self):
+        return len(self.indices)
+
+    def _components(self):
+        from scipy.sparse import csr_matrix
+        from scipy.sparse.csgraph import connected_components
+
+        if self.n == 0:
+            return np.empty(0, dtype=np.int64)
+        adj = csr_matrix((np.ones(len(self.indices), dtype=np.int8), self.indices, self.indptr), shape=(self.n, self.n))
+        _, labels = connected_components(adj, directed=False)
+        return labels.astype(np.int64)
+
+    def out_edges(self, i):
+        lo, hi = self.indptr[i], self.indptr[i + 1]
+        return self.indices[lo:hi], self.edge_type[lo:hi], self.delta_sec[lo:hi]
+
+    def neighbors(self, i):
+        """
+        Events linked to event i in either direction: (positions, edge types,
+        signed time deltas in seconds, positive = later than i).
+        """
+        lo, hi = self._nbr_indptr[i], self._nbr_indptr[i + 1]
+        return self._nbr_indices[lo:hi], self._nbr_edge[lo:hi], self._nbr_delta[lo:hi]
+
+    def degree(self):
+        return np.diff(self._nbr_indptr)
+
+    def session_members(self, i):
+        return np.flatnonzero(self.session == self.session[i])
+
+    def session_sizes(self):
+        """
+        Number of events in the session of every event.
+        """
+        return np.bincount(self.session)[self.session] if self.n else np.empty(0, dtype=np.int64)
+
+    def neighbor_table(self, timeline_df, i):
+        """
+        Linked events of row position i as a DataFrame for display.
+        """
+        pos, etype, delta = self.neighbors(i)
+        linked = timeline_df.iloc[pos].copy()
+        linked.insert(0, "link", np.array(EDGE_NAMES, dtype=object)[etype])
+        linked.insert(1, "link_delta_sec", delta)
+        return linked.sort_values("link_delta_sec", key=np.abs, kind="stable")
+
+    def sessions(self, timeline_df, min_events=2):
+        """
+        One row per activity session with at least min_events events.
+        """
+        if self.n == 0:
+            return pd.DataFrame(columns=["session", "start", "end", "events", "gps", "ipdr", "cdr", "anomalies"])
+        ts = pd.to_datetime(timeline_df["timestamp"], errors="coerce").to_numpy()
+        types = timeline_df["type"].astype(str).str.lower().to_numpy()
+        df = pd.DataFrame({
+            "session": self.session,
+            "timestamp": ts,
+            "gps": types == "gps",
+            "ipdr": types == "ipdr",
+            "cdr": types == "cdr",
+            "anomalies": timeline_df["anomaly"].fillna(0).to_numpy() == 1 if "anomaly" in timeline_df.columns else False,
+        })
+        out = df.groupby("session").agg(
+            start=("timestamp", "min"),
+            end=("timestamp", "max"),
+            events=("timestamp", "size"),
+            gps=("gps", "sum"),
+            ipdr=("ipdr", "sum"),
+            cdr=("cdr", "sum"),
+            anomalies=("anomalies", "sum"),
+        ).reset_index()
+        return out[out["events"] >= min_events].sort_values("start", kind="stable").reset_index(drop=True)
+
+
+def _pairs(src_pos, src_t, dst_pos, dst_t, window_ns):
+    # For each source event: destination events after it (by position) whose
+    # timestamp is within the window. dst arrays are in timeline order.
+    lo = np.searchsorted(dst_pos, src_pos, side="right")
+    hi = np.searchsorted(dst_t, src_t + window_ns, side="right")
+    counts = np.maximum(hi - lo, 0)
+
+    # Emit in batches so dense windows never allocate everything at once
+    cum = np.cumsum(counts)
+    start = 0
+    while start < len(src_pos):
+        base = cum[start - 1] if start else 0
+        stop = int(np.searchsorted(cum, base + MAX_PAIRS_PER_BATCH, side="right"))
+        stop = max(stop, start + 1)
+        c = counts[start:stop]
+        total = int(c.sum())
+        if total:
+            rep = np.repeat(np.arange(start, stop), c)
+            offsets = np.arange(total) - np.repeat(np.cumsum(c) - c, c)
+            j = lo[rep] + offsets
+            yield src_pos[rep], dst_pos[j], dst_t[j] - src_t[rep]
+        start = stop
+
+
+def build_correlation_graph(timeline_df, max_time_diff_sec=120):
+    """
+    Link every event to later events within max_time_diff_sec according to
+    EDGE_TYPES. timeline_df must be in timestamp order (as parse_logs
+    returns it); edges refer to row positions.
+    """
+    n = len(timeline_df)
+    ts = pd.to_datetime(timeline_df["timestamp"], errors="coerce")
+    t = ts.to_numpy(dtype="datetime64[ns]").astype(np.int64)
+    valid = ts.notna().to_numpy()
+    types = timeline_df["type"].astype(str).str.lower().to_numpy()
+    window_ns = np.int64(max_time_diff_sec * 1e9)
+
+    src, dst, etype, delta = [], [], [], []
+    for k, (a, b) in enumerate(EDGE_TYPES):
+        a_pos = np.flatnonzero((types == a) & valid)
+        b_pos = np.flatnonzero((types == b) & valid)
+        if not len(a_pos) or not len(b_pos):
+            continue
+        for s, d, dt in _pairs(a_pos, t[a_pos], b_pos, t[b_pos], window_ns):
+            src.append(s)
+            dst.append(d)
+            etype.append(np.full(len(s), k, dtype=np.int8))
+            delta.append(dt / 1e9)
+
+    if src:
+        return CorrelationGraph(n, np.concatenate(src), np.concatenate(dst), np.concatenate(etype), np.concatenate(delta))
+    empty = np.empty(0, dtype=np.int64)
+    return CorrelationGraph(n, empty, empty, empty.astype(np.int8), empty.astype(np.float32))
+
 
 def correlate_events(timeline, max_time_diff_sec=120):
-    correlated = []
+    """
+    Legacy list-of-dicts output (each event with a "correlated" list),
+    built from the correlation graph.
+    """
+    if not timeline:
+        return []
+    frame = pd.DataFrame({
+        "timestamp": [e["timestamp"] for e in timeline],
+        "type": [e["type"] for e in timeline],
+    })
+    graph = build_correlation_graph(frame, max_time_diff_sec)
 
+    correlated = []
     for i, event in enumerate(timeline):
         entry = event.copy()
         entry["correlated"] = []
-
-        for j in range(i+1, len(timeline)):
+        for j, k, _ in zip(*graph.out_edges(i)):
             other = timeline[j]
-            time_diff = abs((other["timestamp"] - event["timestamp"]).total_seconds())
-
-            if time_diff > max_time_diff_sec:
-                break  # events too far apart
-
-            # Example correlation logic
-            if event["type"] == "gps" and other["type"] == "ipdr":
+            if EDGE_TYPES[k] == ("gps", "ipdr"):
                 entry["correlated"].append({
                     "type": "ipdr",
                     "upload": other.get("upload"),
                     "download": other.get("download"),
                     "app": other.get("app")
                 })
-
-            if event["type"] == "cdr" and other["type"] == "gps":
+            else:
                 entry["correlated"].append({
                     "type": "gps",
                     "lat": other.get("lat"),
                     "lon": other.get("lon")
                 })
-
         correlated.append(entry)
 
     return correlated
@@ -0,0 +1,164 @@
+# density_layer.py
+
+import numpy as np
+import pandas as pd
+
+# Where the device spends its time, for cases too long for per-point
+# markers. Located events are binned once per case into square cells at
+# several resolutions, one per zoom band. Each cell carries its event count
+# and dwell time (time until the next event, capped). The map holds one
+# layer per band and shows the band matching the current zoom, so the HTML
+# grows with the number of cells, not the number of fixes.
+
+# (min zoom, max zoom, cell size in degrees)
+DENSITY_LEVELS = [
+    (0, 5, 1.0),
+    (6, 7, 0.25),
+    (8, 9, 0.05),
+    (10, 11, 0.01),
+    (12, 18, 0.002),
+]
+MAX_DWELL_SECS = 3600
+MAX_CELLS_PER_LEVEL = 2000
+DENSITY_COLORS = ["#ffffb2", "#fed976", "#feb24c", "#fd8d3c", "#f03b20", "#bd0026"]
+
+
+def bin_cells(lat, lon, weight, cell_deg):
+    """
+    Square-cell aggregation of points: one row per occupied cell with its
+    south-west corner, point count and summed weight.
+    """
+    row = np.floor(lat / cell_deg).astype(np.int64)
+    col = np.floor(lon / cell_deg).astype(np.int64)
+    key = (row << 32) | (col & 0xFFFFFFFF)
+    cells, inverse = np.unique(key, return_inverse=True)
+    return pd.DataFrame({
+        "lat0": (cells >> 32) * cell_deg,
+        "lon0": ((cells & 0xFFFFFFFF).astype(np.int64) - ((cells & 0x80000000) << 1)) * cell_deg,
+        "points": np.bincount(inverse, minlength=len(cells)),
+        "dwell_secs": np.bincount(inverse, weights=weight, minlength=len(cells)),
+    })
+
+
+class DensityPyramid:
+    """
+    Cells for every level in `levels` as (min_zoom, max_zoom, cell_deg,
+    cells_df), plus the bounds of the binned points. `key` says which case
+    (e.g. analysis job id) it was built for.
+    """
+
+    def __init__(self, levels, bounds, rows, key=None):
+        self.levels = levels
+        self.bounds = bounds
+        self.rows = rows
+        self.key = key
+
+    def cell_count(self):
+        return sum(len(cells) for *_, cells in self.levels)
+
+
+def build_density(timeline_df, levels=DENSITY_LEVELS, max_dwell_secs=MAX_DWELL_SECS, key=None):
+    """
+    Bin every located event of timeline_df (sorted by time) at each level.
+    Dwell = seconds until the next located event, capped at max_dwell_secs.
+    """
+    lat = pd.to_numeric(timeline_df["lat"], errors="coerce").to_numpy(dtype=float) if "lat" in timeline_df.columns else np.zeros(0)
+    lon = pd.to_numeric(timeline_df["lon"], errors="coerce").to_numpy(dtype=float) if "lon" in timeline_df.columns else np.zeros(0)
+    located = ~(np.isnan(lat) | np.isnan(lon))
+    lat, lon = lat[located], lon[located]
+    t = pd.to_datetime(timeline_df["timestamp"], errors="coerce").to_numpy(dtype="datetime64[ns]")[located]
+
+    dwell = np.zeros(len(t))
+    if len(t) > 1:
+        dwell[:-1] = np.diff(t).astype("timedelta64[ns]").astype(np.int64) / 1e9
+    dwell = np.clip(np.nan_to_num(dwell), 0, max_dwell_secs)
+
+    bounds = [[float(lat.min()), float(lon.min())], [float(lat.max()), float(lon.max())]] if len(lat) else None
+    built = [(lo, hi, cell, bin_cells(lat, lon, dwell, cell)) for lo, hi, cell in levels]
+    return DensityPyramid(built, bounds, int(located.sum()), key=key)
+
+
+def _cell_features(cells, cell_deg, max_cells):
+    # Busiest cells first, capped; colour by log dwell across this level
+    cells = cells.nlargest(max_cells, "dwell_secs") if len(cells) > max_cells else cells
+    level = np.log1p(cells["dwell_secs"].to_numpy())
+    top = level.max() if len(level) and level.max() > 0 else 1.0
+    shade = np.minimum((level / top * len(DENSITY_COLORS)).astype(int), len(DENSITY_COLORS) - 1)
+    features = []
+    for (lat0, lon0, points, dwell), k in zip(cells.itertuples(index=False), shade):
+        lat1, lon1 = lat0 + cell_deg, lon0 + cell_deg
+        features.append({
+            "type": "Feature",
+            "geometry": {
+                "type": "Polygon",
+                "coordinates": [[[lon0, lat0], [lon1, lat0], [lon1, lat1], [lon0, lat1], [lon0, lat0]]],
+            },
+            "properties": {
+                "color": DENSITY_COLORS[k],
+                "events": int(points),
+                "hours": round(dwell / 3600, 2),
+            },
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+def add_density_layer(m, pyramid, max_cells=MAX_CELLS_PER_LEVEL):
+    """
+    Add one choropleth layer per level to folium map `m`, each shown only
+    within its zoom band. At most max_cells cells (the busiest) per level.
+    """
+    import folium
+    from branca.element import MacroElement
+    from jinja2 import Template
+
+    bands = []
+    for lo, hi, cell, cells in pyramid.levels:
+        group = folium.FeatureGroup(name=f"🔥 Time spent ({cell}° cells)", control=False)
+        folium.GeoJson(
+            _cell_features(cells, cell, max_cells),
+            style_function=lambda f: {
+                "fillColor": f["properties"]["color"],
+                "fillOpacity": 0.55,
+                "color": f["properties"]["color"],
+                "weight": 0.5,
+            },
+            tooltip=folium.GeoJsonTooltip(fields=["events", "hours"], aliases=["Events", "Hours"]),
+        ).add_to(group)
+        group.add_to(m)
+        bands.append((group, lo, hi))
+
+    zoom_bands = MacroElement()
+    zoom_bands._template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var map = {{ this._parent.get_name() }};
+            var bands = [{% for group, lo, hi in this.bands %}[{{ group.get_name() }}, {{ lo }}, {{ hi }}],{% endfor %}];
+            function showBand() {
+                var z = map.getZoom();
+                bands.forEach(function(b) {
+                    if (z >= b[1] && z <= b[2]) { map.addLayer(b[0]); } else { map.removeLayer(b[0]); }
+                });
+            }
+            map.on("zoomend", showBand);
+            showBand();
+        })();
+        {% endmacro %}
+    """)
+    zoom_bands.bands = bands
+    zoom_bands.add_to(m)
+    return m
+
+
+def create_density_map(pyramid, max_cells=MAX_CELLS_PER_LEVEL):
+    """
+    Folium map of the density layer, fitted to the binned points.
+    """
+    import folium
+
+    if pyramid.bounds is None:
+        return folium.Map(location=[20.5937, 78.9629], zoom_start=5)
+    (south, west), (north, east) = pyramid.bounds
+    m = folium.Map(location=[(south + north) / 2, (west + east) / 2], zoom_start=6)
+    add_density_layer(m, pyramid, max_cells=max_cells)
+    m.fit_bounds(pyramid.bounds)
+    return m
@@ -0,0 +1,193 @@
+# domain_matcher.py
+
+import os
+import re
+import numpy as np
+import pandas as pd
+
+DEFAULT_FEED_DIR = os.environ.get("DIFA_THREAT_FEEDS", "threat_feeds")
+
+# Category severity order: when a domain matches several, the first wins
+CATEGORY_PRIORITY = ["tor", "malware", "suspicious"]
+
+# Built-in rules, used when no feed files are present and merged with them otherwise
+BUILTIN_RULES = {
+    "tor": {"suffix": ["onion"]},
+    "malware": {"exact": ["malicious.com", "cnc.badsite.net", "spyapp.io", "stealer.org", "malware.fake"]},
+    "suspicious": {"keyword": ["telegram", "onion", "vpn", "tor"]},
+}
+
+_TERMINAL_EXACT = "=exact"
+_TERMINAL_SUFFIX = "=suffix"
+
+
+def normalize_domain(domain):
+    d = str(domain).strip().lower()
+    if "://" in d:
+        d = d.split("://", 1)[1]
+    d = d.split("/", 1)[0].split(":", 1)[0]
+    return d.rstrip(".")
+
+
+def parse_feed_line(line):
+    """
+    Feed line syntax:
+      example.com          domain and all subdomains (suffix)
+      =host.example.com    exact host only
+      keyword:vpn          substring anywhere in the domain
+    Blank lines and '#' comments are ignored. Returns (kind, value) or None.
+    """
+    line = line.split("#", 1)[0].strip()
+    if not line:
+        return None
+    if line.lower().startswith("keyword:"):
+        return "keyword", line[8:].strip().lower()
+    if line.startswith("="):
+        return "exact", normalize_domain(line[1:])
+    if line.startswith("*."):
+        line = line[2:]
+    return "suffix", normalize_domain(line)
+
+
+class DomainMatcher:
+    """
+    Threat-intel domain matcher. Exact and suffix rules are compiled into a
+    reversed-label trie (com → example → www); keyword rules into a single
+    regex alternation. Feed files in feed_dir (one file per category, e.g.
+    threat_feeds/malware.txt) are re-read when they change on disk.
+    """
+
+    def __init__(self, feed_dir=DEFAULT_FEED_DIR, builtin=True):
+        self.feed_dir = feed_dir
+        self.builtin = builtin
+        self._snapshot = None
+        self.reload()
+
+    def _feed_files(self):
+        if not self.feed_dir or not os.path.isdir(self.feed_dir):
+            return {}
+        return {
+            e.path: (e.stat().st_mtime_ns, e.stat().st_size)
+            for e in os.scandir(self.feed_dir)
+            if e.is_file() and e.name.endswith((".txt", ".list"))
+        }
+
+    def reload(self):
+        """
+        (Re)compile all rules from the built-ins and feed directory.
+        """
+        rules = {}
+        if self.builtin:
+            for category, kinds in BUILTIN_RULES.items():
+                for kind, values in kinds.items():
+                    rules.setdefault(category, {}).setdefault(kind, set()).update(values)
+
+        files = self._feed_files()
+        for path in sorted(files):
+            category = os.path.splitext(os.path.basename(path))[0].lower()
+            with open(path, "r", encoding="utf-8", errors="ignore") as f:
+                for line in f:
+                    parsed = parse_feed_line(line)
+                    if parsed:
+                        kind, value = parsed
+                        rules.setdefault(category, {}).setdefault(kind, set()).add(value)
+
+        self.categories = [c for c in CATEGORY_PRIORITY if c in rules] + sorted(c for c in rules if c not in CATEGORY_PRIORITY)
+        rank = {c: i for i, c in enumerate(self.categories)}
+
+        trie = {}
+        keywords = {}
+        for category, kinds in rules.items():
+            for kind in ("exact", "suffix"):
+                for domain in kinds.get(kind, ()):
+                    node = trie
+                    for label in reversed(domain.split(".")):
+                        node = node.setdefault(label, {})
+                    terminal = _TERMINAL_EXACT if kind == "exact" else _TERMINAL_SUFFIX
+                    node.setdefault(terminal, set()).add(rank[category])
+            for kw in kinds.get("keyword", ()):
+                keywords.setdefault(kw, set()).add(rank[category])
+
+        self._trie = trie
+        self._keywords = keywords
+        self._keyword_re = re.compile("|".join(sorted(map(re.escape, keywords), key=len, reverse=True))) if keywords else None
+        self.rule_count = sum(len(v) for kinds in rules.values() for v in kinds.values())
+        self._snapshot = files
+        return self
+
+    def maybe_reload(self):
+        """
+        Recompile only if a feed file was added, removed or modified.
+        """
+        if self._feed_files() != self._snapshot:
+            self.reload()
+            return True
+        return False
+
+    def _match_ranks(self, domain):
+        d = normalize_domain(domain)
+        ranks = set()
+        node = self._trie
+        labels = d.split(".")[::-1]
+        for depth, label in enumerate(labels):
+            node = node.get(label)
+            if node is None:
+                break
+            ranks.update(node.get(_TERMINAL_SUFFIX, ()))
+            if depth == len(labels) - 1:
+                ranks.update(node.get(_TERMINAL_EXACT, ()))
+        if self._keyword_re is not None:
+            for kw in self._keyword_re.findall(d):
+                ranks.update(self._keywords[kw])
+        return ranks
+
+    def match(self, domain):
+        """
+        All categories matched by one domain, most severe first.
+        """
+        return [self.categories[r] for r in sorted(self._match_ranks(domain))]
+
+    def match_column(self, domains, categories=None):
+        """
+        Most severe matching category per row (None if no match), restricted
+        to `categories` if given. Each unique domain is matched once and the
+        result broadcast back to all rows.
+        """
+        allowed = None if categories is None else {self.categories.index(c) for c in categories if c in self.categories}
+        codes, uniques = pd.factorize(pd.Series(domains), use_na_sentinel=True)
+
+        labels = np.empty(len(uniques) + 1, dtype=object)
+        labels[-1] = None  # NaN sentinel slot
+        for k, dom in enumerate(uniques):
+            ranks = self._match_ranks(dom)
+            if allowed is not None:
+                ranks &= allowed
+            labels[k] = self.categories[min(ranks)] if ranks else None
+
+        return pd.Series(labels[codes], index=getattr(domains, "index", None), dtype=object)
+
+    def flag_column(self, domains, category):
+        """
+        Boolean array: row's domain matches `category` (not just as its most severe).
+        """
+        if category not in self.categories:
+            return np.zeros(len(domains), dtype=bool)
+        rank = self.categories.index(category)
+        codes, uniques = pd.factorize(pd.Series(domains), use_na_sentinel=True)
+        hits = np.array([rank in self._match_ranks(d) for d in uniques] + [False], dtype=bool)
+        return hits[codes]
+
+
+_shared_matchers = {}
+
+
+def get_domain_matcher(feed_dir=DEFAULT_FEED_DIR):
+    """
+    Shared matcher per feed directory; picks up feed edits without a restart.
+    """
+    matcher = _shared_matchers.get(feed_dir)
+    if matcher is None:
+        matcher = _shared_matchers[feed_dir] = DomainMatcher(feed_dir)
+    else:
+        matcher.maybe_reload()
+    return matcher
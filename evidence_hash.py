@@ -0,0 +1,142 @@
+# evidence_hash.py
+
+import os
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils import compute_file_hash
+
+MANIFEST_DIR = os.environ.get("DIFA_MANIFEST_DIR", os.path.join(os.path.expanduser("~"), ".difa", "manifests"))
+MAX_WORKERS = min(8, (os.cpu_count() or 1) + 2)
+
+
+def manifest_path_for(folder):
+    """
+    Manifest location for an evidence folder. Kept outside the folder so the
+    evidence itself is never written to.
+    """
+    key = hashlib.sha256(os.path.abspath(folder).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(MANIFEST_DIR, f"{key}.json")
+
+
+class HashManifest:
+    """
+    Persisted {abs_path: {size, mtime_ns, sha256}} map. An entry is reused
+    only if the file's size and mtime are unchanged.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def lookup(self, path, stat):
+        entry = self.entries.get(os.path.abspath(path))
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return entry["sha256"]
+        return None
+
+    def record(self, path, stat, sha256):
+        with self._lock:
+            self.entries[os.path.abspath(path)] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256}
+            self.dirty = True
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+
+def _upload_size(uploaded_file):
+    size = getattr(uploaded_file, "size", None)
+    if size is None:
+        pos = uploaded_file.tell()
+        size = uploaded_file.seek(0, os.SEEK_END)
+        uploaded_file.seek(pos)
+    return size
+
+
+def folder_evidence(folder, label="IMAGE"):
+    """
+    (type, relative name, path) for every file under a logical image folder.
+    """
+    items = []
+    for root, _, files in os.walk(folder):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            items.append((label, os.path.relpath(path, folder), path))
+    return items
+
+
+def folder_fingerprint(folder):
+    """
+    (relative name, size, mtime) for every file under `folder`: a cheap
+    stat-only key that changes whenever a file is added, removed or rewritten.
+    """
+    fingerprint = []
+    for root, _, files in os.walk(folder):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            fingerprint.append((os.path.relpath(path, folder), stat.st_size, stat.st_mtime_ns))
+    return tuple(sorted(fingerprint))
+
+
+def upload_key(uploaded_file):
+    """
+    Identity of a Streamlit upload (None when nothing is uploaded).
+    """
+    return (uploaded_file.file_id, uploaded_file.name, uploaded_file.size) if uploaded_file else None
+
+
+def hash_evidence(items, manifest=None, max_workers=MAX_WORKERS):
+    """
+    Hash evidence on a thread pool. items: (type, filename, source) where
+    source is a path or an uploaded/open file. Paths found unchanged in the
+    manifest are not re-read. Returns [(type, filename, sha256, size)] in
+    input order, plus {"hashed": n, "reused": n}.
+    """
+    stats = {"hashed": 0, "reused": 0}
+    stats_lock = threading.Lock()
+
+    def one(item):
+        kind, name, source = item
+        if isinstance(source, (str, os.PathLike)):
+            st = os.stat(source)
+            sha = manifest.lookup(source, st) if manifest is not None else None
+            reused = sha is not None
+            if not reused:
+                sha = compute_file_hash(source)
+                if manifest is not None:
+                    manifest.record(source, st, sha)
+            size = st.st_size
+        else:
+            reused = False
+            sha = compute_file_hash(source)
+            size = _upload_size(source)
+        with stats_lock:
+            stats["reused" if reused else "hashed"] += 1
+        return kind, name, sha, size
+
+    if len(items) <= 1:
+        results = [one(item) for item in items]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="evidence-hash") as pool:
+            results = list(pool.map(one, items))
+
+    if manifest is not None:
+        manifest.save()
+    return results, stats
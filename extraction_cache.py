@@ -0,0 +1,115 @@
+# extraction_cache.py
+
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+CACHE_DIR = os.environ.get("DIFA_EXTRACT_CACHE", os.path.join(os.path.expanduser("~"), ".difa", "extract_cache"))
+CACHE_VERSION = 1
+
+
+class ExtractionCache:
+    """
+    Per-file cache of parsed GPS rows for one logical image folder.
+
+    Each parsed file is stored as a small columnar .npz (timestamp ns, lat,
+    lon) keyed by (relative path, size, mtime, sha256). Unchanged files
+    (same size+mtime) are served without reading them. A touched file whose
+    content hash still matches is also served without re-parsing.
+    """
+
+    def __init__(self, image_dir, cache_dir=CACHE_DIR):
+        key = hashlib.sha256(os.path.abspath(image_dir).encode("utf-8")).hexdigest()[:16]
+        self.dir = os.path.join(cache_dir, key)
+        self.index_path = os.path.join(self.dir, "index.json")
+        self.entries = {}
+        self.seen = set()
+        self.stats = {"parsed": 0, "cached": 0}
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("version") == CACHE_VERSION:
+                    self.entries = data.get("files", {})
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def _blob_path(self, relpath):
+        return os.path.join(self.dir, hashlib.sha1(relpath.encode("utf-8")).hexdigest() + ".npz")
+
+    @staticmethod
+    def _content_hash(path):
+        hasher = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    def _load(self, relpath, source):
+        with np.load(self._blob_path(relpath)) as blob:
+            return pd.DataFrame({
+                "timestamp": pd.to_datetime(blob["timestamp"], unit="ns"),
+                "lat": blob["lat"],
+                "lon": blob["lon"],
+                "source": source,
+            })
+
+    def get_or_parse(self, relpath, path, parser):
+        """
+        Cached rows for one file, or parser(path) on a miss (then stored).
+        """
+        self.seen.add(relpath)
+        st = os.stat(path)
+        entry = self.entries.get(relpath)
+        source = os.path.basename(path)
+
+        if entry and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+            try:
+                df = self._load(relpath, source)
+                self.stats["cached"] += 1
+                return df
+            except (OSError, ValueError, KeyError):
+                pass
+
+        sha = self._content_hash(path)
+        if entry and entry["sha256"] == sha:
+            try:
+                df = self._load(relpath, source)
+                entry["mtime_ns"] = st.st_mtime_ns
+                self.stats["cached"] += 1
+                return df
+            except (OSError, ValueError, KeyError):
+                pass
+
+        df = parser(path)
+        self.stats["parsed"] += 1
+        self._store(relpath, df)
+        self.entries[relpath] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": sha, "rows": len(df)}
+        return df
+
+    def _store(self, relpath, df):
+        os.makedirs(self.dir, exist_ok=True)
+        ts = pd.to_datetime(df["timestamp"], errors="coerce") if len(df) else pd.Series([], dtype="datetime64[ns]")
+        np.savez(
+            self._blob_path(relpath),
+            timestamp=ts.to_numpy(dtype="datetime64[ns]").astype(np.int64),
+            lat=pd.to_numeric(df["lat"], errors="coerce").to_numpy(np.float64) if len(df) else np.empty(0),
+            lon=pd.to_numeric(df["lon"], errors="coerce").to_numpy(np.float64) if len(df) else np.empty(0),
+        )
+
+    def save(self):
+        """
+        Drop entries for files no longer in the image and persist the index.
+        """
+        for relpath in set(self.entries) - self.seen:
+            blob = self._blob_path(relpath)
+            if os.path.exists(blob):
+                os.remove(blob)
+            del self.entries[relpath]
+        os.makedirs(self.dir, exist_ok=True)
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": CACHE_VERSION, "files": self.entries}, f)
+        os.replace(tmp, self.index_path)
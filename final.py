@@ -3,10 +3,24 @@ import os
 import pandas as pd
 import altair as alt
 import json
-from utils import (normalize_columns, check_required, extract_gps_from_android_image,convert_for_json,display_forensic_report,compute_file_hash)
-from train_model_dual import (train_anomaly_model, format_output_table, detect_spoofing_and_sim_swap)
+import time
+import numpy as np
+from utils import (normalize_columns, check_required, extract_gps_from_android_image,convert_for_json,display_forensic_report)
+from train_model_dual import format_output_table
+from analysis_jobs import start_analysis, stale_stages, STAGE_INPUTS
+from analysis_client import SERVICE_URL, get_client
+from model_ensemble import EnsembleModel
 from streamlit_folium import st_folium
 from map_utils import create_hybrid_movement_map_with_labels,display_timeline_with_playback
+from evidence_hash import HashManifest, folder_evidence, folder_fingerprint, hash_evidence, manifest_path_for, upload_key
+from timeline_view import prepare_timeline_view, filter_mask, RollupCube
+from anomaly_flags import get_flags, render_notes, reason_totals
+from report_export import EXPORT_FORMATS, start_export
+from perf_trace import span, start_trace
+from correlation_engine import build_correlation_graph
+from ipdr_sessions import DEFAULT_IDLE_GAP_SECS, sessionize_ipdr
+from gps_dedup import DEFAULT_TIME_BUCKET_SECS, DEFAULT_COORD_DECIMALS
+from density_layer import build_density, create_density_map
 
 st.set_page_config(page_title="Android Forensics")
 
@@ -20,6 +34,7 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 st.title("🔍 Android Forensics: GPS + IPDR + CDR Analyzer")
+trace = start_trace("analysis")
 
 st.sidebar.header("📂 Upload Forensic Logs")
 st.sidebar.markdown("---")
@@ -40,9 +55,30 @@ with st.sidebar.expander("⚙️ Detection Parameters", expanded=False):
     gps_threshold_km = st.slider("📍 GPS Distance Threshold (km)", 10, 500, value=gps_threshold_default, step=10)
     max_gap_secs = st.slider("⏱️ Max Time Gap Between Logs (seconds)", 60, 3600, value=max_gap_default, step=60)
     speed_threshold_tuning = st.slider("🚗 High-Speed Movement Threshold (km/h)", 100, 1000, value=speed_threshold_default, step=50)
-
-model_choice = st.sidebar.selectbox("🧠 Anomaly Detection Model", ["Isolation Forest", "Autoencoder"])
-model_type = "autoencoder" if model_choice == "Autoencoder" else "isolation_forest"
+    stitch_sessions = st.checkbox("🧵 Stitch IPDR records into sessions", value=True)
+    ipdr_idle_gap = st.slider("💤 IPDR Session Idle Gap (seconds)", 30, 3600, value=DEFAULT_IDLE_GAP_SECS, step=30)
+    dedup_time_bucket = st.slider("🧹 GPS Duplicate Window (seconds)", 0, 60, value=DEFAULT_TIME_BUCKET_SECS)
+    dedup_decimals = st.slider("🧹 GPS Duplicate Grid (coordinate decimals)", 3, 7, value=DEFAULT_COORD_DECIMALS)
+
+model_types = {
+    "Isolation Forest": "isolation_forest",
+    "Autoencoder": "autoencoder",
+    "Ensemble (Isolation Forest + Autoencoder)": "ensemble",
+}
+model_choice = st.sidebar.selectbox("🧠 Anomaly Detection Model", list(model_types))
+model_type = model_types[model_choice]
+
+# 🛰️ Shared analysis service (DIFA_SERVICE_URL): the heavy stages run there.
+# Probed once per session, not per rerun; an unreachable service is re-probed
+# at most every 30 s.
+probe = st.session_state.get("service_probe")
+if probe is None or (probe[0] is None and SERVICE_URL and time.time() - probe[1] > 30):
+    probe = st.session_state["service_probe"] = (get_client(), time.time())
+service_client = probe[0]
+if service_client is not None:
+    st.sidebar.caption(f"🛰️ Analysis runs on the shared service at {SERVICE_URL}")
+elif SERVICE_URL:
+    st.sidebar.warning(f"⚠️ Analysis service at {SERVICE_URL} is not answering — running locally.")
 
 if model_type == "autoencoder":
     with st.sidebar.expander("⚙️ Autoencoder Tuning", expanded=False):
@@ -52,50 +88,178 @@ if model_type == "autoencoder":
 else:
     encoding_dim, epochs, threshold_q = None, None, None
 
+# 📥 Input preparation (folder extraction + dedup, CSV reads, normalization,
+# IPDR sessions, evidence hashes) is cached in the session, keyed by upload
+# identity and the prep settings: tuning thresholds, the profile or the model
+# reruns none of it.
 if use_logical_image:
     folder_path = st.sidebar.text_input("Enter folder path (e.g. extracted_logical_image/)", value="my_folder")
-    if os.path.exists(folder_path):
-        gps_df = extract_gps_from_android_image(folder_path)
+    folder_found = os.path.exists(folder_path)
+    gps_key = ("folder", os.path.abspath(folder_path), folder_fingerprint(folder_path) if folder_found else None,
+               dedup_time_bucket, dedup_decimals)
+else:
+    gps_file = st.sidebar.file_uploader("Upload GPS CSV", type="csv")
+    gps_key = ("upload", upload_key(gps_file))
+
+cached_gps = st.session_state.get("gps_input")
+if cached_gps is None or cached_gps[0] != gps_key:
+    if use_logical_image and folder_found:
+        with span("extract_gps") as s:
+            gps_df = extract_gps_from_android_image(
+                folder_path, time_bucket_secs=dedup_time_bucket, coord_decimals=dedup_decimals
+            )
+            s.rows = len(gps_df)
+    elif not use_logical_image and gps_file:
+        gps_df = pd.read_csv(gps_file)
+    else:
+        gps_df = pd.DataFrame()
+    cached_gps = st.session_state["gps_input"] = (gps_key, gps_df)
+gps_df = cached_gps[1]
+
+gps_dedup = {}
+if use_logical_image:
+    if folder_found:
         st.sidebar.success(f"✅ Loaded {len(gps_df)} GPS points from folder")
+        extraction = gps_df.attrs.get("extraction")
+        if extraction:
+            st.sidebar.caption(f"🗂️ Parsed {extraction['parsed']} file(s), reused {extraction['cached']} from cache")
+        gps_dedup = gps_df.attrs.get("dedup", {})
+        if gps_dedup:
+            st.sidebar.caption(
+                f"🧹 Removed {gps_dedup['removed']:,} duplicate fix(es): "
+                f"{gps_dedup['exact_removed']:,} exact, {gps_dedup['near_removed']:,} near"
+            )
     else:
         st.sidebar.error("❌ Folder not found!")
-        gps_df = pd.DataFrame()
-else:
-    gps_file = st.sidebar.file_uploader("Upload GPS CSV", type="csv")
-    gps_df = pd.read_csv(gps_file) if gps_file else pd.DataFrame()
 
 ipdr_file = st.sidebar.file_uploader("Upload IPDR CSV (optional)", type="csv")
 cdr_file = st.sidebar.file_uploader("Upload CDR CSV (optional)", type="csv")
 
 if not gps_df.empty and (gps_only or (ipdr_file and cdr_file)):
-    raw_gps_df = gps_df.copy()
-    raw_ipdr_df = pd.read_csv(ipdr_file) if ipdr_file else pd.DataFrame()
-    raw_cdr_df = pd.read_csv(cdr_file) if cdr_file else pd.DataFrame()
-
-    gps_df = normalize_columns(raw_gps_df, type="gps")
-    ipdr_df = normalize_columns(raw_ipdr_df, type="ipdr") if not raw_ipdr_df.empty else raw_ipdr_df
-    cdr_df = normalize_columns(raw_cdr_df, type="cdr") if not raw_cdr_df.empty else raw_cdr_df
+    prep_key = (gps_key, upload_key(ipdr_file), upload_key(cdr_file), stitch_sessions, ipdr_idle_gap)
+    prepared = st.session_state.get("prepared_inputs")
+    if prepared is None or prepared["key"] != prep_key:
+        with span("read_uploads") as s:
+            raw_gps_df = gps_df.copy()
+            raw_ipdr_df = pd.read_csv(ipdr_file) if ipdr_file else pd.DataFrame()
+            raw_cdr_df = pd.read_csv(cdr_file) if cdr_file else pd.DataFrame()
+            s.rows = len(raw_gps_df) + len(raw_ipdr_df) + len(raw_cdr_df)
+
+        with span("normalize", rows=len(raw_gps_df) + len(raw_ipdr_df) + len(raw_cdr_df)):
+            gps_df = normalize_columns(raw_gps_df, type="gps")
+            ipdr_df = normalize_columns(raw_ipdr_df, type="ipdr") if not raw_ipdr_df.empty else raw_ipdr_df
+            cdr_df = normalize_columns(raw_cdr_df, type="cdr") if not raw_cdr_df.empty else raw_cdr_df
+
+        ipdr_sessionization = {}
+        if stitch_sessions and not ipdr_df.empty:
+            with span("ipdr_sessions", rows=len(ipdr_df)) as s:
+                ipdr_df = sessionize_ipdr(ipdr_df, idle_gap_secs=ipdr_idle_gap)
+                ipdr_sessionization = ipdr_df.attrs["sessionization"]
+                s.meta["sessions"] = len(ipdr_df)
+
+        evidence = []
+        if use_logical_image:
+            evidence += folder_evidence(folder_path)
+        elif gps_file:
+            evidence.append(("GPS", gps_file.name, gps_file))
+        if ipdr_file:
+            evidence.append(("IPDR", ipdr_file.name, ipdr_file))
+        if cdr_file:
+            evidence.append(("CDR", cdr_file.name, cdr_file))
+        hash_manifest = HashManifest(manifest_path_for(folder_path)) if use_logical_image else None
+        with span("hash_evidence", rows=len(evidence)):
+            file_hashes, hash_stats = hash_evidence(evidence, manifest=hash_manifest)
+
+        prepared = st.session_state["prepared_inputs"] = {
+            "key": prep_key, "gps_df": gps_df, "ipdr_df": ipdr_df, "cdr_df": cdr_df,
+            "ipdr_sessionization": ipdr_sessionization, "file_hashes": file_hashes, "hash_stats": hash_stats,
+        }
+    gps_df, ipdr_df, cdr_df = prepared["gps_df"], prepared["ipdr_df"], prepared["cdr_df"]
+    ipdr_sessionization = prepared["ipdr_sessionization"]
+    file_hashes, hash_stats = prepared["file_hashes"], prepared["hash_stats"]
+
+    normalization = {
+        source: df.attrs["normalization"]
+        for source, df in (("gps", gps_df), ("ipdr", ipdr_df), ("cdr", cdr_df))
+        if "normalization" in df.attrs
+    }
+    st.sidebar.caption("🗜️ Memory: " + ", ".join(
+        f"{source.upper()} {n['before_mb']} → {n['after_mb']} MB" for source, n in normalization.items()
+    ))
+    invalid_coords = sum(n["invalid_coords"] for n in normalization.values())
+    if invalid_coords:
+        st.warning(f"⚠️ {invalid_coords:,} out-of-range coordinate(s) were dropped during normalization.")
+    if ipdr_sessionization:
+        st.sidebar.caption(f"🧵 {ipdr_sessionization['records']:,} IPDR records → {ipdr_sessionization['sessions']:,} sessions")
 
     check_required(gps_df, ["timestamp", "lat", "lon"], "GPS")
     check_required(ipdr_df, ["timestamp", "ip", "domain", "lat", "lon"], "IPDR")
     check_required(cdr_df, ["timestamp", "contact", "call_type", "lat", "lon"], "CDR")
-    file_hashes = []
-    if not use_logical_image :
-        if gps_file:
-            file_hashes.append(("GPS", gps_file.name, compute_file_hash(gps_file), gps_file.getbuffer().nbytes))
-    if ipdr_file:
-        file_hashes.append(("IPDR", ipdr_file.name, compute_file_hash(ipdr_file), ipdr_file.getbuffer().nbytes))
-    if cdr_file:
-        file_hashes.append(("CDR", cdr_file.name, compute_file_hash(cdr_file), cdr_file.getbuffer().nbytes))
-
-    model, scaler, timeline_df, features_df, alerts = train_anomaly_model(
-        gps_df, ipdr_df, cdr_df,
-        gps_threshold_km=gps_threshold_km,
-        max_gap_secs=max_gap_secs,
-        speed_threshold=speed_threshold_tuning,
-        model_type=model_type
-    )
-    st.toast("✅ Model trained and timeline generated!", icon="🚀")
+    if hash_stats["reused"]:
+        st.sidebar.caption(f"🔐 Hashed {hash_stats['hashed']} file(s), reused {hash_stats['reused']} unchanged from manifest")
+
+    # 🧠 Analysis runs as a background job, reused across reruns. Only the
+    # stages whose inputs changed run again: new thresholds re-run just the
+    # rules on the cached timeline and ML scores; the speed threshold only
+    # affects the filters below.
+    analysis_inputs = {
+        "evidence": json.dumps([
+            [sha for _, _, sha, _ in file_hashes], len(gps_df), use_logical_image, gps_only,
+            stitch_sessions, ipdr_idle_gap, dedup_time_bucket, dedup_decimals,
+        ], default=str),
+        "gps_threshold_km": gps_threshold_km,
+        "max_gap_secs": max_gap_secs,
+        "model_type": model_type,
+    }
+    analysis_job = st.session_state.get("analysis_job")
+    stale = stale_stages(analysis_job.changed(analysis_inputs)) if analysis_job is not None else set(STAGE_INPUTS)
+    if stale & {"timeline", "model"} or (stale and analysis_job.status in ("failed", "cancelled")):
+        if analysis_job is not None:
+            analysis_job.cancel()
+        analysis_job = st.session_state["analysis_job"] = start_analysis(
+            gps_df, ipdr_df, cdr_df,
+            evidence=analysis_inputs["evidence"],
+            gps_threshold_km=gps_threshold_km,
+            max_gap_secs=max_gap_secs,
+            model_type=model_type,
+            client=service_client,
+        )
+    elif "rules" in stale:
+        analysis_job.update_rules(analysis_inputs)
+    trace.absorb(analysis_job.trace)
+    ensemble_timings = {}
+
+    if analysis_job.status == "failed":
+        st.error(f"❌ Analysis failed: {analysis_job.error}")
+        st.stop()
+    if analysis_job.status == "cancelled":
+        st.warning(f"✖️ Analysis {analysis_job.id} cancelled.")
+        if st.button("▶️ Restart Analysis"):
+            del st.session_state["analysis_job"]
+            st.rerun()
+        st.stop()
+    # Read before the result: a result published in between only costs a rebuild
+    result_version = analysis_job.version
+    if analysis_job.status != "done":
+        st.progress(analysis_job.progress, text=f"🧠 Analysis {analysis_job.id}: {analysis_job.stage}")
+        col_a, col_b = st.columns(2)
+        if col_a.button("🔄 Refresh Results"):
+            st.rerun()
+        if col_b.button("✖️ Cancel Analysis"):
+            analysis_job.cancel()
+            st.rerun()
+        if analysis_job.partial is None:
+            st.stop()
+        st.info("🚦 Rule-based alerts are ready. ML anomalies will be added when the model finishes training — press Refresh.")
+        timeline_df, alerts = analysis_job.partial
+    else:
+        model, scaler, timeline_df, features_df, alerts = analysis_job.result
+        if isinstance(model, EnsembleModel):
+            ensemble_timings = model.timings()
+            st.sidebar.caption(
+                "🧩 Ensemble: " + ", ".join(f"{k.removesuffix('_secs')} {v}s" for k, v in ensemble_timings.items())
+            )
+        st.toast("✅ Model trained and timeline generated!", icon="🚀")
 
     st.sidebar.markdown("---")
     st.sidebar.markdown("## 🎛️ Filter Controls")
@@ -111,20 +275,33 @@ if not gps_df.empty and (gps_only or (ipdr_file and cdr_file)):
         start_time = st.time_input("🕐 Start Time", value=pd.to_datetime("00:00").time())
         end_time = st.time_input("🕐 End Time", value=pd.to_datetime("23:59").time())
 
-    filtered_df = timeline_df.copy()
-    if anomaly_only:
-        filtered_df = filtered_df[filtered_df['anomaly'] == 1]
-    if selected_types:
-        filtered_df = filtered_df[filtered_df['type'].isin(selected_types)]
-    if suspicious_only and 'domain' in filtered_df.columns:
-        suspicious_domains = ["telegram", "onion", "vpn", "tor"]
-        filtered_df = filtered_df[filtered_df['domain'].str.contains('|'.join(suspicious_domains), na=False, case=False)]
-    if 'speed_kmph' in filtered_df.columns:
-        filtered_df = filtered_df[pd.to_numeric(filtered_df['speed_kmph'], errors='coerce') > speed_threshold_tuning]
-    if long_jump_only and 'notes' in filtered_df.columns:
-        filtered_df = filtered_df[filtered_df['notes'].str.contains('jump', na=False)]
-    filtered_df['hour'] = pd.to_datetime(filtered_df['timestamp']).dt.time
-    filtered_df = filtered_df[(filtered_df['hour'] >= start_time) & (filtered_df['hour'] <= end_time)]
+    # The view and rollup cube are built once per published result; every
+    # filter change after that only scans cube cells for the summary/charts
+    cube = st.session_state.get("rollup_cube")
+    if cube is None or cube.key != (analysis_job.id, result_version):
+        with span("rollup_cube", rows=len(timeline_df)) as s:
+            cube = st.session_state["rollup_cube"] = RollupCube(
+                prepare_timeline_view(timeline_df),
+                correlation_score=timeline_df['correlation_score'] if 'correlation_score' in timeline_df.columns else None,
+                key=(analysis_job.id, result_version),
+            )
+            s.meta["cells"] = len(cube)
+    filter_view = cube.view
+
+    filters = dict(
+        anomaly_only=anomaly_only,
+        selected_types=selected_types,
+        suspicious_only=suspicious_only,
+        long_jump_only=long_jump_only,
+        start_time=start_time,
+        end_time=end_time,
+        speed_threshold=speed_threshold_tuning,
+    )
+    with span("filter", rows=len(timeline_df)):
+        filter_rows = filter_mask(filter_view, **filters)
+        filtered_df = timeline_df[filter_rows]
+    with span("rollup_query", rows=len(cube)):
+        cube_cells = cube.mask(**filters)
 
 
 
@@ -132,21 +309,14 @@ if not gps_df.empty and (gps_only or (ipdr_file and cdr_file)):
     st.markdown("---")
     st.markdown("## 🧠 Investigation Summary")
     col1, col2, col3, col4 = st.columns(4)
-    col1.metric("🔢 Total Events", len(filtered_df))
-    col2.metric("🚨 Anomalies Detected", filtered_df['anomaly'].sum())
-    col3.metric("📍 GPS Jumps", filtered_df['notes'].str.contains("jump", na=False).sum())
-    col4.metric("🕵️ SIM Spoof Cases", filtered_df['notes'].str.contains("spoof", na=False).sum())
+    summary = cube.summary(cube_cells)
+    col1.metric("🔢 Total Events", summary["Total Events"])
+    col2.metric("🚨 Anomalies Detected", summary["Anomalies Detected"])
+    col3.metric("📍 GPS Jumps", summary["GPS Jumps"])
+    col4.metric("🕵️ SIM Spoof Cases", summary["Spoofing Detected"])
 
 # Investigation Summary
     st.markdown("---")
-    summary = {
-        "Total Events": len(filtered_df),
-        "Anomalies Detected": filtered_df['anomaly'].sum(),
-        "GPS Jumps": filtered_df['notes'].str.contains("jump", na=False).sum(),
-        "SIM Swap Events": filtered_df['notes'].str.contains("swap", na=False).sum(),
-        "Spoofing Detected": filtered_df['notes'].str.contains("spoof", na=False).sum(),
-        "Correlation Score > 3": (filtered_df['correlation_score'] > 3).sum() if 'correlation_score' in filtered_df.columns else 0
-    }
     st.table(pd.DataFrame(summary.items(), columns=["Metric", "Value"]))
 
     
@@ -158,6 +328,32 @@ if not gps_df.empty and (gps_only or (ipdr_file and cdr_file)):
         else:
             st.info("✅ No alerts raised based on current filters.")
 
+    # 🔗 Correlation graph: events linked to a selected anomaly, no rescans.
+    # Built once per published result and time window, like the rollup cube
+    graph_key = (analysis_job.id, result_version, max_gap_secs)
+    cached_graph = st.session_state.get("correlation_graph")
+    if cached_graph is not None and cached_graph[0] == graph_key:
+        correlation_graph = cached_graph[1]
+    else:
+        with span("correlation_graph", rows=len(timeline_df)) as s:
+            correlation_graph = build_correlation_graph(timeline_df, max_time_diff_sec=max_gap_secs)
+            s.meta["edges"] = len(correlation_graph)
+        st.session_state["correlation_graph"] = (graph_key, correlation_graph)
+    with st.expander("🔗 Linked Events", expanded=False):
+        flagged_pos = np.flatnonzero(filter_rows & ((get_flags(timeline_df) != 0) | (timeline_df["anomaly"].to_numpy() == 1)))
+        if len(flagged_pos):
+            picked = st.selectbox(
+                "Anomaly",
+                flagged_pos[:1000],
+                format_func=lambda p: f"{timeline_df['timestamp'].iloc[p]} · {timeline_df['type'].iloc[p]}",
+            )
+            linked = correlation_graph.neighbor_table(timeline_df, picked)
+            session = correlation_graph.session[picked]
+            st.caption(f"{len(linked)} linked event(s) · session #{session} with {correlation_graph.session_sizes()[picked]} event(s)")
+            st.dataframe(linked[["link", "link_delta_sec", "timestamp", "type", "lat", "lon"]], hide_index=True)
+        else:
+            st.info("No anomalies in the current filter.")
+
 
 
 
@@ -166,20 +362,54 @@ if not gps_df.empty and (gps_only or (ipdr_file and cdr_file)):
     tab1, tab2, tab3 = st.tabs(["📋 Timeline", "📊 Chart", "📍 Map"])
 
     with tab1:
-        output_df = format_output_table(filtered_df)
+        page_size = 1000
+        page_count = max((len(filtered_df) - 1) // page_size + 1, 1)
+        page = st.number_input("📄 Page", min_value=1, max_value=page_count, value=1, step=1) if page_count > 1 else 1
+        with span("format_output_table", rows=min(page_size, len(filtered_df))):
+            output_df = format_output_table(
+                filtered_df,
+                rows=slice((page - 1) * page_size, page * page_size),
+                speed_threshold=speed_threshold_tuning,
+            )
         st.dataframe(output_df.style.set_properties(**{"white-space": "pre-line"}))
 
     with tab2:
-        anomaly_counts = filtered_df[filtered_df['anomaly'] == 1]['type'].value_counts().reset_index()
-        anomaly_counts.columns = ['Event Type', 'Count']
+        anomaly_counts = cube.anomalies_by_type(cube_cells)
         bar_chart = alt.Chart(anomaly_counts).mark_bar().encode(
             x='Event Type', y='Count', color='Event Type')
         st.altair_chart(bar_chart, use_container_width=True)
 
+        st.markdown("### 🗓️ Activity by Hour and Day")
+        heat_col1, heat_col2 = st.columns(2)
+        for col, title, only_anomalies in ((heat_col1, "All events", False), (heat_col2, "Anomalies", True)):
+            activity = cube.activity(cube_cells, anomalies_only=only_anomalies)
+            col.altair_chart(alt.Chart(activity, title=title).mark_rect().encode(
+                x=alt.X('hour:O', title='Hour of day'),
+                y=alt.Y('yearmonthdate(day):O', title='Day'),
+                color=alt.Color('events:Q', title='Events'),
+                tooltip=['day:T', 'hour:O', 'events:Q'],
+            ), use_container_width=True)
+
     with tab3:
-        st.markdown("### 🗺️ Movement Map")
-        labeled_map = create_hybrid_movement_map_with_labels(filtered_df)
-        st_folium(labeled_map, width=800, height=550)
+        map_layers = ["📍 Event markers", "🔥 Time spent (density)"]
+        map_layer = st.radio("Layer", map_layers, index=int(len(filtered_df) > 5000), horizontal=True)
+        if map_layer == map_layers[0]:
+            st.markdown("### 🗺️ Movement Map")
+            with span("map", rows=len(filtered_df)):
+                labeled_map = create_hybrid_movement_map_with_labels(filtered_df)
+            st_folium(labeled_map, width=800, height=550)
+        else:
+            # Binned once per analysis job (i.e. per case), independent of the filters
+            density = st.session_state.get("density")
+            if density is None or density.key != analysis_job.id:
+                with span("density_bins", rows=len(timeline_df)) as s:
+                    density = st.session_state["density"] = build_density(timeline_df, key=analysis_job.id)
+                    s.meta["cells"] = density.cell_count()
+            st.markdown("### 🔥 Where the Device Spends Its Time")
+            st.caption(f"{density.rows:,} located events in {density.cell_count():,} cells across {len(density.levels)} zoom levels")
+            with span("density_map", rows=density.cell_count()):
+                density_map = create_density_map(density)
+            st_folium(density_map, width=800, height=550)
         if st.button("🎥 Animate Movement"):
             display_timeline_with_playback(filtered_df)
 
@@ -195,6 +425,15 @@ if not gps_df.empty and (gps_only or (ipdr_file and cdr_file)):
             """)
 
 
+    # ⏱️ Per-stage timings for this run
+    with st.expander("⏱️ Performance", expanded=False):
+        st.dataframe(trace.summary(), hide_index=True)
+        st.download_button(
+            "⬇️ Download Chrome Trace",
+            json.dumps(trace.to_chrome_trace(), default=str),
+            file_name="difa_trace.json",
+        )
+
     st.markdown("---")
     st.header("\U0001F4C4 Forensic Report")
     st.subheader("\U0001F512 Uploaded File Hashes")
@@ -214,8 +453,15 @@ if not gps_df.empty and (gps_only or (ipdr_file and cdr_file)):
         "Time Window": f"{start_time} - {end_time}"
     })
 
+    tower_lookup = timeline_df.attrs.get("tower_lookup", {})
+    if tower_lookup:
+        st.subheader("\U0001F4E1 Cell Tower Lookup")
+        st.json(tower_lookup)
+
     st.subheader("\U0001F4AC Notable Events")
-    top_alerts = timeline_df[timeline_df['notes'].notna()].sort_values("timestamp").head(10)
+    top_n = st.number_input("🔝 Top-N events in report", min_value=5, max_value=500, value=10, step=5)
+    top_alerts = timeline_df[get_flags(timeline_df) != 0].sort_values("timestamp").head(top_n)
+    top_alerts = top_alerts.assign(notes=render_notes(get_flags(top_alerts)))
     for _, row in top_alerts.iterrows():
         st.markdown(f"- **{row['timestamp']}** — {row['notes']}")
 
@@ -235,6 +481,17 @@ if not gps_df.empty and (gps_only or (ipdr_file and cdr_file)):
             "time_window": f"{start_time} - {end_time}"
         },
         "findings": summary,
+        "reason_counts": reason_totals(get_flags(timeline_df)),
+        "tower_lookup": tower_lookup,
+        "ipdr_sessionization": ipdr_sessionization,
+        "normalization": normalization,
+        "gps_dedup": gps_dedup,
+        "correlation": {
+            "edges": len(correlation_graph),
+            "sessions": int((np.bincount(correlation_graph.session) >= 2).sum()) if len(timeline_df) else 0,
+        },
+        "performance": trace.to_records(),
+        "ensemble_timings": ensemble_timings,
         "alerts": top_alerts[["timestamp", "notes"]].to_dict(orient="records")
     }
     st.download_button(
@@ -242,20 +499,48 @@ if not gps_df.empty and (gps_only or (ipdr_file and cdr_file)):
     json.dumps(report, indent=2, default=str),
     file_name="forensic_report.json"
 )
-from utils import generate_forensic_pdf_report
-
-if st.button("📝 Generate PDF Report"):
-    pdf_path = generate_forensic_pdf_report({
-        "model_used": model_choice,
-        "parameters": report["parameters"],
-        "summary": filtered_df,
-        "alerts": report["alerts"]
-    })
-    with open(pdf_path, "rb") as f:
-        st.download_button("⬇️ Download PDF Report", data=f, file_name="forensic_report.pdf", mime="application/pdf")
-  
-        
-else:
-    st.warning("⚠️ Please upload at least the GPS data. IPDR and CDR required unless GPS-only mode is selected.")
 
+    # 📦 Full export runs in the background and is written straight to disk
+    st.subheader("📦 Export Full Report")
+    export_choice = st.selectbox("Export format", list(EXPORT_FORMATS))
+    if st.button("📝 Start Export"):
+        st.session_state["export_job"] = start_export(
+            filtered_df,
+            {**report, "model_used": model_choice},
+            fmt=EXPORT_FORMATS[export_choice],
+            top_n=top_n,
+        )
+
+    export_job = st.session_state.get("export_job")
+    if export_job is not None:
+        if export_job.fmt == "pdf":
+            done_text = f"{export_job.sections_done}/{export_job.sections_total} sections"
+        else:
+            done_text = f"{export_job.rows_written:,}/{export_job.total_rows:,} events"
+        st.progress(export_job.progress, text=f"{export_job.fmt.upper()} export: {export_job.status} ({done_text})")
+        if export_job.status == "running":
+            col_a, col_b = st.columns(2)
+            if col_a.button("🔄 Refresh Progress"):
+                st.rerun()
+            if col_b.button("✖️ Cancel Export"):
+                export_job.cancel()
+        elif export_job.status == "done":
+            # The file stays on disk; it is read only for the single rerun
+            # right after "Prepare Download", which offers the download
+            size_mb = os.path.getsize(export_job.path) / 2**20
+            st.caption(f"💾 {size_mb:,.1f} MB written to `{export_job.path}`")
+            if st.session_state.pop("export_prepared", None) == export_job.id:
+                with open(export_job.path, "rb") as f:
+                    st.download_button(
+                        f"⬇️ Download {export_job.fmt.upper()} Report",
+                        data=f,
+                        file_name=os.path.basename(export_job.path),
+                    )
+            elif st.button("📦 Prepare Download"):
+                st.session_state["export_prepared"] = export_job.id
+                st.rerun()
+        elif export_job.status == "failed":
+            st.error(f"❌ Export failed: {export_job.error}")
 
+else:
+    st.warning("⚠️ Please upload at least the GPS data. IPDR and CDR required unless GPS-only mode is selected.")
@@ -0,0 +1,81 @@
+# gps_dedup.py
+
+import numpy as np
+import pandas as pd
+
+# The same fix is often logged by several sources in a logical image
+# (location.db, networklocation.db, Takeout JSON, GPX) or repeated within
+# one. Fixes are snapped to a time bucket and a coordinate grid and hashed;
+# rows sharing a hash collapse into the earliest one, and `sources` keeps
+# every source that reported it. Two fixes that straddle a bucket or grid
+# boundary are not merged, so the grid is a tolerance of "up to", not
+# "exactly", one step.
+
+DEFAULT_TIME_BUCKET_SECS = 1
+DEFAULT_COORD_DECIMALS = 5  # ~1.1 m at the equator
+
+
+def fix_keys(df, time_bucket_secs=DEFAULT_TIME_BUCKET_SECS, coord_decimals=DEFAULT_COORD_DECIMALS):
+    """
+    One uint64 hash per row of (time bucket, lat cell, lon cell).
+    time_bucket_secs=0 / coord_decimals=None match exactly instead.
+    """
+    t = pd.to_datetime(df["timestamp"], errors="coerce").to_numpy(dtype="datetime64[ns]").astype(np.int64)
+    if time_bucket_secs:
+        t = t // np.int64(time_bucket_secs * 1e9)
+    lat = pd.to_numeric(df["lat"], errors="coerce").to_numpy(dtype=np.float64)
+    lon = pd.to_numeric(df["lon"], errors="coerce").to_numpy(dtype=np.float64)
+    if coord_decimals is None:
+        lat_q, lon_q = lat.view(np.int64), lon.view(np.int64)
+    else:
+        scale = 10.0 ** coord_decimals
+        with np.errstate(invalid="ignore"):
+            lat_q = np.floor(lat * scale).astype(np.int64)
+            lon_q = np.floor(lon * scale).astype(np.int64)
+    return pd.util.hash_pandas_object(pd.DataFrame({"t": t, "lat": lat_q, "lon": lon_q}), index=False).to_numpy()
+
+
+def _provenance(group, names):
+    # One tuple of source names per group, via a per-group bitmask over the
+    # distinct sources (64 per word). Groups with the same combination share
+    # one tuple, so the column costs a pointer per row.
+    codes, labels = pd.factorize(names, sort=True)
+    n_groups = group.max() + 1 if len(group) else 0
+    masks = np.zeros((n_groups, max((len(labels) + 63) // 64, 1)), dtype=np.uint64)
+    np.bitwise_or.at(masks, (group, codes // 64), np.left_shift(np.uint64(1), (codes % 64).astype(np.uint64)))
+    combos, inverse = np.unique(masks, axis=0, return_inverse=True)
+    shared = np.empty(len(combos), dtype=object)
+    for i, row in enumerate(combos):
+        bits = np.flatnonzero(np.unpackbits(row.view(np.uint8), bitorder="little"))
+        shared[i] = tuple(labels[bits])
+    return shared[inverse.ravel()]
+
+
+def dedup_gps(df, time_bucket_secs=DEFAULT_TIME_BUCKET_SECS, coord_decimals=DEFAULT_COORD_DECIMALS):
+    """
+    Drop exact and near-duplicate fixes, keeping the earliest row of each
+    (time bucket, coordinate cell). Adds a `sources` column (tuple of every
+    source that reported the fix) and attrs["dedup"] with the counts.
+    Row order is preserved.
+    """
+    n = len(df)
+    names = df["source"].astype(str).to_numpy() if "source" in df.columns else np.full(n, "unknown", dtype=object)
+    keys = fix_keys(df, time_bucket_secs, coord_decimals)
+    # Groups are numbered by first appearance, so their first rows come out
+    # in the frame's own order
+    group = pd.factorize(keys)[0]
+    first = np.unique(group, return_index=True)[1]
+
+    exact = fix_keys(df, 0, None)
+    out = df.iloc[first].reset_index(drop=True)
+    out["sources"] = _provenance(group, names)
+    out.attrs = {**df.attrs, "dedup": {
+        "rows_in": n,
+        "rows_out": len(out),
+        "removed": n - len(out),
+        "exact_removed": n - len(pd.unique(exact)),
+        "near_removed": len(pd.unique(exact)) - len(out),
+        "time_bucket_secs": time_bucket_secs,
+        "coord_decimals": coord_decimals,
+    }}
+    return out
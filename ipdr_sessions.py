@@ -0,0 +1,175 @@
+# ipdr_sessions.py
+
+import numpy as np
+import pandas as pd
+
+# Operator IPDR exports split one data session into many interim records.
+# Records with the same (subscriber, ip, domain, app) are stitched into one
+# session while the gap between them stays within idle_gap_secs.
+
+SUBSCRIBER_COLUMNS = ["subscriber", "msisdn", "imsi", "device_id", "imei"]
+SESSION_KEYS = ["ip", "domain", "app"]
+DURATION_COLUMNS = ["session_duration", "duration"]
+DEFAULT_IDLE_GAP_SECS = 300
+CHUNK_ROWS = 200_000
+
+_RESERVED = {"timestamp", "session_end", "duration_secs", "upload", "download", "records", "_start", "_end", "_key"}
+
+
+def session_keys(columns):
+    """
+    Grouping columns present in an IPDR frame: first subscriber id column
+    found, then ip / domain / app.
+    """
+    subscriber = [c for c in SUBSCRIBER_COLUMNS if c in columns][:1]
+    return subscriber + [c for c in SESSION_KEYS if c in columns]
+
+
+class IPDRSessionizer:
+    """
+    Streaming stitcher. feed() time-sorted chunks and collect the sessions
+    it returns; flush() returns whatever is still open. Only sessions that
+    could still grow (last record within idle_gap_secs of the newest
+    timestamp seen) are kept between chunks, so state stays bounded by the
+    number of concurrently active flows, not by input size.
+    """
+
+    def __init__(self, idle_gap_secs=DEFAULT_IDLE_GAP_SECS, keys=None):
+        self.gap_ns = np.int64(idle_gap_secs * 1e9)
+        self.keys = keys
+        self.open = None
+        self.watermark = None
+        self.records_in = 0
+        self.sessions_out = 0
+
+    def _prepare(self, chunk):
+        df = chunk.copy()
+        if self.keys is None:
+            self.keys = session_keys(df.columns)
+        for col in self.keys:
+            if col not in df.columns:
+                df[col] = None
+
+        start = pd.to_datetime(df["timestamp"], errors="coerce")
+        df = df[start.notna().to_numpy()]
+        start = start[start.notna()]
+        df["_start"] = start.to_numpy(dtype="datetime64[ns]").astype(np.int64)
+
+        duration = next((c for c in DURATION_COLUMNS if c in df.columns), None)
+        extra = pd.to_numeric(df[duration], errors="coerce").fillna(0).to_numpy() if duration else 0
+        df["_end"] = df["_start"] + (np.asarray(extra, dtype=np.float64) * 1e9).astype(np.int64)
+
+        for col in ("upload", "download"):
+            df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0) if col in df.columns else 0
+        df["records"] = 1
+        return df.drop(columns=[c for c in ("timestamp", duration) if c], errors="ignore")
+
+    def _stitch(self, df):
+        # One row per session from open sessions + new records (both carry
+        # _start/_end/upload/download/records)
+        df["_key"] = df.groupby(self.keys, dropna=False, sort=False).ngroup().to_numpy()
+        df = df.sort_values(["_key", "_start"], kind="stable")
+
+        key = df["_key"].to_numpy()
+        start = df["_start"].to_numpy()
+        reach = df.groupby("_key", sort=False)["_end"].cummax().to_numpy()
+        new = np.ones(len(df), dtype=bool)
+        if len(df) > 1:
+            new[1:] = (key[1:] != key[:-1]) | (start[1:] - reach[:-1] > self.gap_ns)
+        df["_session"] = np.cumsum(new)
+
+        others = [c for c in df.columns if c not in _RESERVED and c != "_session"]
+        agg = {"_start": "min", "_end": "max", "upload": "sum", "download": "sum", "records": "sum"}
+        agg.update({c: "first" for c in others})
+        return df.groupby("_session", sort=False).agg(agg).reset_index(drop=True)
+
+    def _finish(self, sessions):
+        out = sessions.drop(columns=["_start", "_end"])
+        out.insert(0, "timestamp", pd.to_datetime(sessions["_start"].to_numpy(), unit="ns"))
+        out.insert(1, "session_end", pd.to_datetime(sessions["_end"].to_numpy(), unit="ns"))
+        out.insert(2, "duration_secs", (sessions["_end"] - sessions["_start"]).to_numpy() / 1e9)
+        self.sessions_out += len(out)
+        return out.sort_values("timestamp", kind="stable").reset_index(drop=True)
+
+    def feed(self, chunk):
+        """
+        Add the next time-sorted chunk; returns sessions that are now closed.
+        """
+        df = self._prepare(chunk)
+        self.records_in += len(df)
+        if df.empty:
+            return self._finish(df.iloc[:0].assign(_start=np.int64(0), _end=np.int64(0)))
+
+        if self.open is not None and not self.open.empty:
+            df = pd.concat([self.open, df], ignore_index=True)
+        sessions = self._stitch(df)
+
+        newest = int(df["_start"].max())
+        self.watermark = newest if self.watermark is None else max(self.watermark, newest)
+        still_open = sessions["_end"].to_numpy() >= self.watermark - self.gap_ns
+        self.open = sessions[still_open].reset_index(drop=True)
+        return self._finish(sessions[~still_open])
+
+    def flush(self):
+        """
+        Close and return every session still open.
+        """
+        if self.open is None or self.open.empty:
+            return self._finish(pd.DataFrame(columns=["_start", "_end"]).astype(np.int64))
+        sessions, self.open = self.open, None
+        return self._finish(sessions)
+
+
+def sessionize_ipdr(ipdr_df, idle_gap_secs=DEFAULT_IDLE_GAP_SECS, chunk_rows=CHUNK_ROWS):
+    """
+    Stitch an in-memory (normalized) IPDR frame into sessions.
+    """
+    if ipdr_df is None or ipdr_df.empty:
+        return ipdr_df
+    ipdr_df = ipdr_df.sort_values("timestamp", kind="stable")
+    return sessionize_chunks(
+        (ipdr_df.iloc[i:i + chunk_rows] for i in range(0, len(ipdr_df), chunk_rows)),
+        idle_gap_secs=idle_gap_secs,
+    )
+
+
+def sessionize_chunks(chunks, idle_gap_secs=DEFAULT_IDLE_GAP_SECS, normalize=None):
+    """
+    Stitch an iterable of time-sorted IPDR chunks (e.g. pd.read_csv with
+    chunksize). normalize, if given, is applied to each chunk first.
+    Returns one sessions DataFrame with stats in attrs["sessionization"].
+    """
+    stitcher = IPDRSessionizer(idle_gap_secs=idle_gap_secs)
+    parts = []
+    for chunk in chunks:
+        if normalize is not None:
+            chunk = normalize(chunk)
+        parts.append(stitcher.feed(chunk))
+    parts.append(stitcher.flush())
+    parts = [p for p in parts if not p.empty]
+    sessions = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+    sessions.attrs["sessionization"] = {
+        "records": stitcher.records_in,
+        "sessions": stitcher.sessions_out,
+        "ratio": round(stitcher.records_in / stitcher.sessions_out, 2) if stitcher.sessions_out else 0.0,
+        "idle_gap_secs": idle_gap_secs,
+    }
+    return sessions
+
+
+if __name__ == "__main__":
+    import sys
+    from utils import normalize_columns
+
+    if len(sys.argv) < 3:
+        print("Usage: python ipdr_sessions.py <ipdr.csv (time-sorted)> <sessions.csv> [idle_gap_secs]")
+        sys.exit(1)
+
+    gap = float(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_IDLE_GAP_SECS
+    sessions = sessionize_chunks(
+        pd.read_csv(sys.argv[1], chunksize=CHUNK_ROWS),
+        idle_gap_secs=gap,
+        normalize=lambda c: normalize_columns(c, type="ipdr"),
+    )
+    sessions.to_csv(sys.argv[2], index=False)
+    print(sessions.attrs["sessionization"])
@@ -0,0 +1,74 @@
+# kinematics.py
+
+import numpy as np
+import pandas as pd
+from utils import haversine_np
+
+# Movement columns attached to the timeline once, right after it is built.
+# Features, rules and the display table read these instead of recomputing.
+#   delta_sec / dist_km / speed_kmph                      vs the previous row
+#   same_type_delta_sec / same_type_dist_km / same_type_speed_kmph
+#                                                         vs the previous row of the same type
+# The first row (of the timeline, or of its type) has no previous → NaN.
+# Speed is 0 when no time has passed, NaN when a position is missing.
+KINEMATIC_COLUMNS = [
+    "delta_sec", "dist_km", "speed_kmph",
+    "same_type_delta_sec", "same_type_dist_km", "same_type_speed_kmph",
+]
+
+
+def _speed(dist, delta):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(delta > 0, dist / (delta / 3600), np.where(np.isnan(delta), np.nan, 0.0))
+
+
+def _against(prev, t, lat, lon):
+    # delta/dist/speed of every row against row `prev` (-1 = none)
+    has_prev = prev >= 0
+    p = np.where(has_prev, prev, 0)
+    delta = np.where(has_prev, (t - t[p]) / 1e9, np.nan)
+    dist = np.where(has_prev, haversine_np(lat, lon, lat[p], lon[p]), np.nan)
+    return delta, dist, _speed(dist, delta)
+
+
+def kinematics(timeline_df):
+    """
+    The kinematic columns for timeline_df as a new DataFrame (same index).
+    Columns already present on timeline_df are reused, not recomputed.
+    """
+    if set(KINEMATIC_COLUMNS).issubset(timeline_df.columns):
+        return timeline_df[KINEMATIC_COLUMNS]
+
+    n = len(timeline_df)
+    ts = pd.to_datetime(timeline_df["timestamp"], errors="coerce")
+    t = ts.to_numpy(dtype="datetime64[ns]").astype(np.int64).astype(np.float64)
+    t[ts.isna().to_numpy()] = np.nan
+    lat = pd.to_numeric(timeline_df["lat"], errors="coerce").to_numpy(dtype=float) if "lat" in timeline_df.columns else np.full(n, np.nan)
+    lon = pd.to_numeric(timeline_df["lon"], errors="coerce").to_numpy(dtype=float) if "lon" in timeline_df.columns else np.full(n, np.nan)
+
+    prev = np.arange(n) - 1
+    delta, dist, speed = _against(prev, t, lat, lon)
+
+    # Previous row of the same type: shift positions within each type group
+    types = timeline_df["type"].astype(str).str.lower() if "type" in timeline_df.columns else pd.Series("", index=timeline_df.index)
+    same_prev = pd.Series(np.arange(n)).groupby(types.to_numpy()).shift(1).fillna(-1).to_numpy(dtype=np.int64)
+    st_delta, st_dist, st_speed = _against(same_prev, t, lat, lon)
+
+    return pd.DataFrame({
+        "delta_sec": delta,
+        "dist_km": dist,
+        "speed_kmph": speed,
+        "same_type_delta_sec": st_delta,
+        "same_type_dist_km": st_dist,
+        "same_type_speed_kmph": st_speed,
+    }, index=timeline_df.index)
+
+
+def add_kinematics(timeline_df):
+    """
+    Attach (or refresh) the kinematic columns on timeline_df in place.
+    """
+    kin = kinematics(timeline_df.drop(columns=KINEMATIC_COLUMNS, errors="ignore"))
+    for col in KINEMATIC_COLUMNS:
+        timeline_df[col] = kin[col].to_numpy()
+    return timeline_df
@@ -0,0 +1,345 @@
+# live_watch.py
+
+import os
+import glob
+import time
+import hashlib
+import tempfile
+import numpy as np
+import pandas as pd
+from utils import normalize_columns
+from android_feature_extractor import geolocate_ipdr, extract_features
+from tower_db import get_tower_db, resolve_cdr_towers
+from kinematics import KINEMATIC_COLUMNS, kinematics
+from train_model import detect_spoofing_and_sim_swap
+from anomaly_flags import FLAGS_DTYPE, ML_ANOMALY, RULE_FLAGS, REASONS, get_flags
+
+# Live interception: the operator drops new IPDR/CDR (or GPS) CSVs into a
+# directory every few minutes. Only new files are read; their rows are
+# merged into the already-sorted timeline and rules / the persisted model
+# run on the new tail plus just enough earlier rows for context. Rule
+# verdicts wait until max_gap_secs of later events have arrived, since a GPS
+# fix in the next drop can still be the nearest one (Rule 2).
+
+# Root of the per-case state directories (one per watched directory)
+STATE_DIR = os.environ.get("DIFA_LIVE_STATE", os.path.join(tempfile.gettempdir(), "difa_live"))
+MODEL_FILE = "live_model.joblib"
+FILE_TYPES = ("ipdr", "cdr", "gps")
+MIN_FIT_ROWS = 200
+SETTLE_SECS = 1.0
+
+
+def drop_type(path):
+    """
+    Log type of a dropped file from its name ("ipdr" / "cdr" / "gps"), else None.
+    """
+    name = os.path.basename(path).lower()
+    return next((t for t in FILE_TYPES if t in name), None)
+
+
+def merge_sorted(timeline_df, tail_df):
+    """
+    Merge a timestamp-sorted tail into a timestamp-sorted timeline without
+    re-sorting (existing rows first on ties). Returns (merged, new_positions).
+    """
+    n, m = len(timeline_df), len(tail_df)
+    if n == 0:
+        return tail_df.reset_index(drop=True), np.arange(m)
+    old_t = timeline_df["timestamp"].to_numpy(dtype="datetime64[ns]")
+    new_t = tail_df["timestamp"].to_numpy(dtype="datetime64[ns]")
+    new_pos = np.searchsorted(old_t, new_t, side="right") + np.arange(m)
+
+    combined = pd.concat([timeline_df, tail_df], ignore_index=True)
+    if new_pos[0] == n:
+        return combined, new_pos
+    order = np.empty(n + m, dtype=np.int64)
+    is_new = np.zeros(n + m, dtype=bool)
+    is_new[new_pos] = True
+    order[new_pos] = n + np.arange(m)
+    order[~is_new] = np.arange(n)
+    return combined.iloc[order].reset_index(drop=True), new_pos
+
+
+def case_state_dir(watch_dir, root=STATE_DIR):
+    """
+    State directory for one watched directory, so a model fitted on one case
+    is never picked up by another.
+    """
+    path = os.path.abspath(watch_dir)
+    name = os.path.basename(path.rstrip(os.sep)) or "root"
+    return os.path.join(root, f"{name}-{hashlib.sha256(path.encode('utf-8')).hexdigest()[:12]}")
+
+
+def _type_context_start(types, lo):
+    # Earliest position needed so every type seen from lo on has its
+    # previous same-type row included (for the same_type_* kinematics)
+    need = set(types[lo:])
+    seen = set()
+    start, step = lo, 64
+    while start > 0 and not need <= seen:
+        new_start = max(start - step, 0)
+        seen.update(types[new_start:start])
+        start, step = new_start, step * 2
+    return max(min(start, lo - 1), 0)
+
+
+class LiveWatcher:
+    """
+    Tails watch_dir for new *.csv drops. poll() ingests whatever has landed
+    since the last call and returns the new alerts as (timestamp, message).
+    The model is fitted once (when MIN_FIT_ROWS rows are in) and persisted
+    under state_dir (default: case_state_dir(watch_dir)); later drops are
+    only scored, never refitted. Rule alerts for the newest max_gap_secs of
+    events are held back until later drops (or flush()) settle them.
+    """
+
+    def __init__(self, watch_dir, state_dir=None, gps_threshold_km=100, max_gap_secs=900,
+                 timeline_df=None, tower_db=None):
+        self.watch_dir = watch_dir
+        self.state_dir = state_dir or case_state_dir(watch_dir)
+        self.gps_threshold_km = gps_threshold_km
+        self.max_gap_secs = max_gap_secs
+        self.tower_db = tower_db if tower_db is not None else get_tower_db()
+        self.timeline = timeline_df.reset_index(drop=True) if timeline_df is not None else pd.DataFrame()
+        self.seen = set()
+        self.model = self.scaler = None
+        self.history = []
+        self.errors = []
+        self.pending_t = None  # earliest timestamp whose rule verdict is still open
+        self._load_model()
+
+    # 🧠 Persisted model
+    @property
+    def model_path(self):
+        return os.path.join(self.state_dir, MODEL_FILE)
+
+    def _load_model(self):
+        if os.path.exists(self.model_path):
+            import joblib
+            state = joblib.load(self.model_path)
+            self.model, self.scaler = state["model"], state["scaler"]
+
+    def _save_model(self):
+        import joblib
+        os.makedirs(self.state_dir, exist_ok=True)
+        joblib.dump({"model": self.model, "scaler": self.scaler}, self.model_path)
+
+    def _fit(self):
+        from sklearn.ensemble import IsolationForest
+        from sklearn.preprocessing import StandardScaler
+
+        features = extract_features(self.timeline)
+        self.scaler = StandardScaler().fit(features)
+        self.model = IsolationForest(contamination=0.1, random_state=42).fit(self.scaler.transform(features))
+        self._save_model()
+
+    # 📥 New files
+    def pending_files(self):
+        """
+        Unseen CSVs whose last write is at least SETTLE_SECS old.
+        """
+        now = time.time()
+        files = []
+        for path in sorted(glob.glob(os.path.join(self.watch_dir, "*.csv"))):
+            if path in self.seen or drop_type(path) is None:
+                continue
+            try:
+                if now - os.path.getmtime(path) >= SETTLE_SECS:
+                    files.append(path)
+            except OSError:
+                continue
+        return files
+
+    def read_drop(self, path):
+        """
+        One dropped file as normalized, located timeline rows.
+        """
+        kind = drop_type(path)
+        df = normalize_columns(pd.read_csv(path), type=kind)
+        if kind == "ipdr":
+            geolocate_ipdr(df)
+        elif kind == "cdr":
+            df["lat"], df["lon"], _ = resolve_cdr_towers(df, self.tower_db)
+        df["type"] = kind
+        df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce").astype("datetime64[ns]")
+        return df[df["timestamp"].notna()]
+
+    # ⚙️ Incremental analysis
+    def _refresh_kinematics(self, lo):
+        types = self.timeline["type"].astype(str).str.lower().to_numpy()
+        k0 = _type_context_start(types, lo)
+        window = self.timeline.iloc[k0:].drop(columns=KINEMATIC_COLUMNS, errors="ignore")
+        kin = kinematics(window)
+        for col in KINEMATIC_COLUMNS:
+            if col not in self.timeline.columns:
+                self.timeline[col] = np.nan
+            values = self.timeline[col].to_numpy(dtype=float, copy=True)
+            values[lo:] = kin[col].to_numpy()[lo - k0:]
+            self.timeline[col] = values
+
+    def _score(self, lo, flags):
+        # Model verdicts for rows whose movement features changed (lo onward);
+        # one earlier row keeps extract_features' first-row zeroing off them
+        start = max(lo - 1, 0)
+        features = extract_features(self.timeline.iloc[start:].reset_index(drop=True))
+        preds = self.model.predict(self.scaler.transform(features))[lo - start:]
+        tail = flags[lo:]
+        was = (tail & FLAGS_DTYPE(ML_ANOMALY)) != 0
+        flags[lo:] = np.where(preds == -1, tail | FLAGS_DTYPE(ML_ANOMALY), tail & ~FLAGS_DTYPE(ML_ANOMALY))
+        newly = np.flatnonzero((preds == -1) & ~was) + lo
+        ts = self.timeline["timestamp"].to_numpy()
+        return [(pd.Timestamp(ts[i]), REASONS[ML_ANOMALY]) for i in newly]
+
+    def _rules(self, lo, flags, final=False):
+        # Rows from `first` on are re-checked with full context: the previous
+        # event and GPS fixes within max_gap_secs on either side. Guard rows
+        # before them only provide that context and get every rule bit preset
+        # so they raise nothing and are not written back. Rows within
+        # max_gap_secs of the newest event stay open (unless final): a later
+        # drop may still bring their nearest GPS fix.
+        t = self.timeline["timestamp"].to_numpy(dtype="datetime64[ns]")
+        gap = np.timedelta64(int(self.max_gap_secs * 1e9), "ns")
+        start_t = t[lo] - gap if self.pending_t is None else min(t[lo] - gap, self.pending_t)
+        first = int(np.searchsorted(t, start_t, side="left"))
+        guard = min(int(np.searchsorted(t, t[first] - gap, side="left")), max(first - 1, 0))
+        end = len(t) if final else max(int(np.searchsorted(t, t[-1] - gap, side="left")), first)
+        self.pending_t = t[end] if end < len(t) else None
+        if end == first:
+            return []
+
+        window = self.timeline.iloc[guard:].copy()
+        window_flags = flags[guard:].copy()
+        window_flags[:first - guard] |= FLAGS_DTYPE(RULE_FLAGS)
+        window["flags"] = window_flags
+        window, alerts = detect_spoofing_and_sim_swap(
+            window,
+            gps_threshold_km=self.gps_threshold_km,
+            max_gap_secs=self.max_gap_secs,
+        )
+        flags[first:end] = get_flags(window)[first - guard:end - guard]
+        if end < len(t):
+            alerts = [a for a in alerts if a[0] < t[end]]
+        return alerts
+
+    def ingest(self, tail_df):
+        """
+        Merge new rows into the timeline and evaluate them. Returns new alerts.
+        """
+        if tail_df.empty:
+            return []
+        tail_df = tail_df.sort_values("timestamp", kind="stable").reset_index(drop=True)
+        tail_df["flags"] = np.zeros(len(tail_df), dtype=FLAGS_DTYPE)
+        tail_df["anomaly"] = 0
+        self.timeline, new_pos = merge_sorted(self.timeline, tail_df)
+        lo = int(new_pos[0])
+
+        self._refresh_kinematics(lo)
+        flags = get_flags(self.timeline)
+        alerts = []
+        if self.model is None and len(self.timeline) >= MIN_FIT_ROWS:
+            self._fit()
+            lo_ml = 0
+        else:
+            lo_ml = lo
+        if self.model is not None:
+            alerts += self._score(lo_ml, flags)
+        alerts += self._rules(lo, flags)
+
+        self.timeline["flags"] = flags
+        self.timeline["anomaly"] = (flags != 0).astype(int)
+        return sorted(alerts, key=lambda a: a[0])
+
+    def flush(self):
+        """
+        Settle the rule verdicts still held back (no more drops expected).
+        Returns their alerts.
+        """
+        if self.pending_t is None or self.timeline.empty:
+            return []
+        t = self.timeline["timestamp"].to_numpy(dtype="datetime64[ns]")
+        flags = get_flags(self.timeline)
+        alerts = self._rules(int(np.searchsorted(t, self.pending_t, side="left")), flags, final=True)
+        self.timeline["flags"] = flags
+        self.timeline["anomaly"] = (flags != 0).astype(int)
+        return sorted(alerts, key=lambda a: a[0])
+
+    def poll(self):
+        """
+        Ingest every settled new file in watch_dir. Returns new alerts.
+        A file that cannot be read is recorded in `errors` and skipped for
+        good (it is marked seen), so one bad drop does not stop the watch.
+        """
+        files = self.pending_files()
+        if not files:
+            return []
+        started = time.time()
+        frames = []
+        for path in files:
+            try:
+                frames.append(self.read_drop(path))
+            except Exception as e:
+                self.errors.append({"file": path, "error": f"{type(e).__name__}: {e}"})
+        self.seen.update(files)
+        tail = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        alerts = self.ingest(tail)
+        self.history.append({
+            "files": len(files),
+            "rows": len(tail),
+            "alerts": len(alerts),
+            "timeline_rows": len(self.timeline),
+            "seconds": round(time.time() - started, 3),
+            "latency_secs": round(time.time() - min(os.path.getmtime(p) for p in files), 3),
+        })
+        return alerts
+
+    def run(self, interval=2.0, on_alert=None, on_batch=None, on_error=None):
+        """
+        Poll forever (Ctrl+C to stop), calling on_alert(timestamp, message)
+        for every new alert, on_batch(stats) after each ingested batch and
+        on_error(error) for every unreadable file. Held-back rule alerts are
+        settled and reported on the way out.
+        """
+        try:
+            while True:
+                batches, errors = len(self.history), len(self.errors)
+                alerts = self.poll()
+                if on_error is not None:
+                    for error in self.errors[errors:]:
+                        on_error(error)
+                if on_alert is not None:
+                    for ts, message in alerts:
+                        on_alert(ts, message)
+                if on_batch is not None and len(self.history) > batches:
+                    on_batch(self.history[-1])
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+        if on_alert is not None:
+            for ts, message in self.flush():
+                on_alert(ts, message)
+        else:
+            self.flush()
+        return self.timeline
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Watch a directory for new IPDR/CDR/GPS CSV drops and raise alerts live.")
+    parser.add_argument("watch_dir")
+    parser.add_argument("--interval", type=float, default=2.0, help="Seconds between directory scans")
+    parser.add_argument("--gps-threshold-km", type=float, default=100)
+    parser.add_argument("--max-gap-secs", type=float, default=900)
+    parser.add_argument("--state-dir", default=None, help="Where the fitted model is persisted (default: one directory per watch_dir under DIFA_LIVE_STATE)")
+    args = parser.parse_args()
+
+    watcher = LiveWatcher(args.watch_dir, state_dir=args.state_dir,
+                          gps_threshold_km=args.gps_threshold_km, max_gap_secs=args.max_gap_secs)
+    print(f"👀 Watching {args.watch_dir} (every {args.interval}s, Ctrl+C to stop)")
+    watcher.run(
+        interval=args.interval,
+        on_alert=lambda ts, msg: print(f"🚨 {ts} ➜ {msg}"),
+        on_error=lambda e: print(f"❌ Skipped {e['file']}: {e['error']}"),
+        on_batch=lambda b: print(f"📥 {b['files']} file(s), {b['rows']:,} rows → {b['alerts']} alert(s) "
+                                 f"in {b['seconds']}s ({b['timeline_rows']:,} rows total)"),
+    )
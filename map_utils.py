@@ -11,6 +11,24 @@ import folium
 from folium.plugins import AntPath
 from utils import haversine
 from streamlit_folium import st_folium
+import numpy as np
+from anomaly_flags import FLAG_GROUPS, MOVEMENT_FLAGS, get_flags, has_any, reason_count, render_notes
+
+
+def marker_colors(timeline_df):
+    """
+    Map colour per row: jump or unrealistic movement → yellow, spoof →
+    orange, suspicious domain → purple, anomaly with 2+ reasons → red,
+    otherwise blue.
+    """
+    flags = get_flags(timeline_df)
+    anomaly = timeline_df["anomaly"].fillna(0).to_numpy() if "anomaly" in timeline_df.columns else np.zeros(len(flags))
+    colors = np.full(len(flags), "blue", dtype=object)
+    colors[has_any(flags, FLAG_GROUPS["domain"])] = "purple"
+    colors[has_any(flags, FLAG_GROUPS["spoof"]) & ~has_any(flags, MOVEMENT_FLAGS)] = "orange"
+    colors[has_any(flags, MOVEMENT_FLAGS)] = "yellow"
+    colors[(anomaly == 1) & (reason_count(flags) >= 2)] = "red"
+    return colors
 
 
 def create_hybrid_movement_map_with_labels(timeline_df):
@@ -20,27 +38,21 @@ def create_hybrid_movement_map_with_labels(timeline_df):
     m = folium.Map(location=[timeline_df['lat'].mean(), timeline_df['lon'].mean()], zoom_start=6)
     last_point = None
 
-    for i, row in timeline_df.iterrows():
+    # Marker colours straight from the reason bitmask
+    colors = marker_colors(timeline_df)
+    notes = render_notes(get_flags(timeline_df), sep="<br>")
+
+    for k, (i, row) in enumerate(timeline_df.iterrows()):
         lat, lon = row['lat'], row['lon']
         if pd.isna(lat) or pd.isna(lon):
             continue
 
-        notes = row.get("notes", "").lower()
-        color = "blue"
+        color = colors[k]
         icon = "info-sign"
 
-        if "unrealistic" in notes or "jump" in notes:
-            color = "yellow"
-        elif "spoof" in notes:
-            color = "orange"
-        elif "vpn" in notes or "tor" in notes or "suspicious domain" in notes:
-            color = "purple"
-        if row.get("anomaly", 0) == 1 and notes.count("⚠️") >= 2:
-            color = "red"
-
         folium.Marker(
             [lat, lon],
-            popup=f"{row['timestamp']}<br>{row.get('notes', '')}",
+            popup=f"{row['timestamp']}<br>{notes[k]}",
             icon=folium.Icon(color=color, icon=icon)
         ).add_to(m)
 
@@ -97,8 +109,9 @@ def display_timeline_with_playback(timeline_df):
 
     # 3️⃣ Prepare GeoJSON Features for TimestampedGeoJson
     features = []
-    for _, row in filtered_df.iterrows():
-        notes = row.get("notes", "")
+    all_notes = render_notes(get_flags(filtered_df), sep="<br>")
+    for k, (_, row) in enumerate(filtered_df.iterrows()):
+        notes = all_notes[k]
         anomaly = int(row.get("anomaly", 0))
         color = "red" if anomaly else "blue"
 
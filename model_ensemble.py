@@ -0,0 +1,129 @@
+# model_ensemble.py
+
+import os
+import time
+import shutil
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+
+# Ensemble mode: Isolation Forest and the autoencoder are fitted at the same
+# time in separate worker processes. The scaled feature matrix is written
+# once as a float32 .npy and every worker memory-maps it read-only, so no
+# worker receives (or pickles) its own copy.
+
+ENSEMBLE_MODELS = ["isolation_forest", "autoencoder"]
+
+_pool = None
+
+
+def _get_pool():
+    # Spawned (not forked) workers: TensorFlow does not survive fork, and the
+    # pool stays warm between runs so imports are paid once
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=len(ENSEMBLE_MODELS), mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def _drop_pool(broken):
+    # A worker died (e.g. TensorFlow out of memory): forget the broken pool
+    # so the next run spawns a fresh one
+    global _pool
+    if _pool is broken:
+        _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def _score_isolation_forest(matrix_path, contamination):
+    from sklearn.ensemble import IsolationForest
+
+    started = time.perf_counter()
+    X = np.load(matrix_path, mmap_mode="r")
+    model = IsolationForest(contamination=contamination, random_state=42).fit(X)
+    scores = -model.decision_function(X)  # higher = more anomalous
+    return scores, time.perf_counter() - started
+
+
+def _score_autoencoder(matrix_path, contamination):
+    from autoencoder_model import train_autoencoder_model, reconstruction_error
+
+    started = time.perf_counter()
+    X = np.load(matrix_path, mmap_mode="r")
+    model = train_autoencoder_model(X)
+    scores = reconstruction_error(model, X)
+    return scores, time.perf_counter() - started
+
+
+_SCORERS = {
+    "isolation_forest": _score_isolation_forest,
+    "autoencoder": _score_autoencoder,
+}
+
+
+def rank_scores(scores):
+    """
+    Scores → percentile ranks in (0, 1] (ties share their average rank).
+    """
+    from scipy.stats import rankdata
+
+    scores = np.asarray(scores, dtype=float)
+    return rankdata(scores) / len(scores) if len(scores) else scores
+
+
+class EnsembleModel:
+    """
+    Result of fit_ensemble: per-model raw scores, the combined rank score
+    (`score`, mean percentile rank, higher = more anomalous) and timings.
+    """
+
+    def __init__(self, scores, seconds, wall_secs):
+        self.scores = scores
+        self.seconds = seconds
+        self.wall_secs = wall_secs
+        self.score = np.mean([rank_scores(s) for s in scores.values()], axis=0)
+
+    def timings(self):
+        return {
+            **{f"{name}_secs": round(secs, 3) for name, secs in self.seconds.items()},
+            "total_wall_secs": round(self.wall_secs, 3),
+            "sum_of_models_secs": round(sum(self.seconds.values()), 3),
+        }
+
+
+def fit_ensemble(X_scaled, contamination=0.1, models=None):
+    """
+    Fit every model in `models` (default ENSEMBLE_MODELS) concurrently on a
+    shared memory-mapped copy of X_scaled (NaN → 0). Returns
+    (EnsembleModel, anomaly), anomaly = 1 for the top `contamination` share
+    of the combined score.
+    """
+    models = models or ENSEMBLE_MODELS
+    started = time.perf_counter()
+    tmp = tempfile.mkdtemp(prefix="difa_ensemble_")
+    try:
+        matrix_path = os.path.join(tmp, "features.npy")
+        shared = np.lib.format.open_memmap(matrix_path, mode="w+", dtype=np.float32, shape=np.shape(X_scaled))
+        # Missing features (e.g. IPDR rows without a location) → the scaled mean
+        shared[:] = np.nan_to_num(X_scaled, nan=0.0)
+        shared.flush()
+        del shared
+
+        pool = _get_pool()
+        try:
+            futures = {name: pool.submit(_SCORERS[name], matrix_path, contamination) for name in models}
+            scores, seconds = {}, {}
+            for name, future in futures.items():
+                scores[name], seconds[name] = future.result()
+        except BrokenProcessPool:
+            _drop_pool(pool)
+            raise
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    model = EnsembleModel(scores, seconds, time.perf_counter() - started)
+    threshold = np.quantile(model.score, 1 - contamination) if len(model.score) else 0.0
+    anomaly = (model.score > threshold).astype(int)
+    return model, anomaly
@@ -0,0 +1,210 @@
+# perf_trace.py
+
+import os
+import sys
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Lightweight pipeline spans: wall time, CPU time, memory and row counts.
+# A span costs two clock reads, one /proc read and one getrusage call at
+# each end, so tracing stays on in normal runs.
+
+_active_trace = contextvars.ContextVar("difa_active_trace", default=None)
+
+try:
+    import resource
+
+    def _maxrss_bytes():
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == "darwin" else rss * 1024
+except ImportError:  # Windows
+    def _maxrss_bytes():
+        return 0
+
+
+def _rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return _maxrss_bytes()
+
+
+class Span:
+    """
+    One timed stage. Set `rows` (or any key in `meta`) inside the block.
+    """
+
+    __slots__ = ("name", "parent", "depth", "tid", "rows", "meta",
+                 "start_ns", "wall_ns", "cpu_ns", "rss_start", "rss_end", "peak_rss")
+
+    def __init__(self, name, parent, depth, rows=None, meta=None):
+        self.name = name
+        self.parent = parent
+        self.depth = depth
+        self.tid = threading.get_ident()
+        self.rows = rows
+        self.meta = meta or {}
+        self.wall_ns = self.cpu_ns = 0
+        self.rss_start = self.rss_end = self.peak_rss = 0
+
+    def to_dict(self, origin_ns=0):
+        return {
+            "name": self.name,
+            "parent": self.parent,
+            "depth": self.depth,
+            "start_ms": round((self.start_ns - origin_ns) / 1e6, 3),
+            "wall_ms": round(self.wall_ns / 1e6, 3),
+            "cpu_ms": round(self.cpu_ns / 1e6, 3),
+            "rows": self.rows,
+            "rss_mb": round(self.rss_end / 2**20, 1),
+            "mem_delta_mb": round((self.rss_end - self.rss_start) / 2**20, 1),
+            "peak_rss_mb": round(self.peak_rss / 2**20, 1),
+            **self.meta,
+        }
+
+
+class _NullSpan:
+    # Stand-in when no trace is active; attribute writes are accepted and dropped
+    __slots__ = ("rows", "meta")
+
+    def __init__(self):
+        self.rows = None
+        self.meta = {}
+
+
+class Trace:
+    """
+    Collects spans for one analysis run. Nested spans record their parent.
+    Export with to_records() / summary() / to_chrome_trace().
+    """
+
+    def __init__(self, name="analysis"):
+        self.name = name
+        self.spans = []
+        self.origin_ns = time.perf_counter_ns()
+        self._stack = threading.local()
+        self._lock = threading.Lock()
+
+    def _parents(self):
+        stack = getattr(self._stack, "spans", None)
+        if stack is None:
+            stack = self._stack.spans = []
+        return stack
+
+    @contextmanager
+    def span(self, name, rows=None, **meta):
+        stack = self._parents()
+        s = Span(name, stack[-1].name if stack else None, len(stack), rows, meta)
+        stack.append(s)
+        maxrss_start = _maxrss_bytes()
+        s.rss_start = _rss_bytes()
+        cpu0 = time.process_time_ns()
+        s.start_ns = time.perf_counter_ns()
+        try:
+            yield s
+        finally:
+            s.wall_ns = time.perf_counter_ns() - s.start_ns
+            s.cpu_ns = time.process_time_ns() - cpu0
+            s.rss_end = _rss_bytes()
+            # The process high-water mark only moves if this span set a new peak;
+            # otherwise the best cheap bound is the larger of start/end RSS.
+            maxrss_end = _maxrss_bytes()
+            s.peak_rss = maxrss_end if maxrss_end > maxrss_start else max(s.rss_start, s.rss_end)
+            stack.pop()
+            with self._lock:
+                self.spans.append(s)
+
+    @contextmanager
+    def activate(self):
+        """
+        Make this the trace that module-level span() records into.
+        """
+        token = _active_trace.set(self)
+        try:
+            yield self
+        finally:
+            _active_trace.reset(token)
+
+    def absorb(self, other):
+        """
+        Add the spans recorded so far by another trace (e.g. a background job).
+        """
+        with other._lock:
+            spans = list(other.spans)
+        with self._lock:
+            self.spans.extend(spans)
+        return self
+
+    def to_records(self):
+        return [s.to_dict(self.origin_ns) for s in sorted(self.spans, key=lambda s: s.start_ns)]
+
+    def summary(self):
+        """
+        Per-span table (in start order) for display.
+        """
+        import pandas as pd
+
+        records = self.to_records()
+        for r in records:
+            r["stage"] = "  " * r["depth"] + r["name"]
+        cols = ["stage", "wall_ms", "cpu_ms", "rows", "mem_delta_mb", "peak_rss_mb"]
+        table = pd.DataFrame(records, columns=cols)
+        table["rows"] = table["rows"].astype("Int64")
+        return table
+
+    def to_chrome_trace(self):
+        """
+        Chrome trace-event JSON (load in chrome://tracing or Perfetto).
+        """
+        pid = os.getpid()
+        events = [{"name": "process_name", "ph": "M", "pid": pid, "args": {"name": f"DIFA {self.name}"}}]
+        for s in sorted(self.spans, key=lambda s: s.start_ns):
+            d = s.to_dict(self.origin_ns)
+            events.append({
+                "name": s.name,
+                "cat": "stage",
+                "ph": "X",
+                "ts": (s.start_ns - self.origin_ns) / 1e3,
+                "dur": s.wall_ns / 1e3,
+                "pid": pid,
+                "tid": s.tid,
+                "args": {k: v for k, v in d.items() if k not in ("name", "start_ms", "wall_ms", "depth", "parent")},
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save_chrome_trace(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_chrome_trace(), f, default=str)
+        return path
+
+
+def current_trace():
+    return _active_trace.get()
+
+
+@contextmanager
+def span(name, rows=None, **meta):
+    """
+    Record a span into the active trace, or do nothing if none is active.
+    """
+    trace = _active_trace.get()
+    if trace is None:
+        yield _NullSpan()
+        return
+    with trace.span(name, rows, **meta) as s:
+        yield s
+
+
+def start_trace(name="analysis"):
+    """
+    New trace made active for the rest of the current context, for scripts
+    (e.g. one Streamlit run) that can't wrap everything in activate().
+    """
+    trace = Trace(name)
+    _active_trace.set(trace)
+    return trace
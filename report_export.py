@@ -0,0 +1,153 @@
+# report_export.py
+
+import os
+import csv
+import json
+import uuid
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from anomaly_flags import get_flags, render_notes
+
+EXPORT_DIR = os.environ.get("DIFA_EXPORT_DIR", os.path.join(tempfile.gettempdir(), "difa_exports"))
+CHUNK_ROWS = 50_000
+
+EXPORT_FORMATS = {
+    "JSON Lines": "jsonl",
+    "CSV": "csv",
+    "PDF": "pdf",
+}
+
+EVENT_COLUMNS = ["timestamp", "type", "lat", "lon", "ip", "domain", "contact", "call_type", "anomaly", "flags", "anomaly_score"]
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="report-export")
+
+
+class ExportJob:
+    """
+    One background export. The UI polls progress/status and offers the file
+    at `path` for download once status == "done". Event formats count
+    rows_written; PDF, which never lists every event, counts its sections.
+    """
+
+    def __init__(self, fmt, total_rows):
+        self.id = uuid.uuid4().hex[:12]
+        self.fmt = fmt
+        self.total_rows = total_rows
+        self.rows_written = 0
+        self.sections_done = 0
+        self.sections_total = 0
+        self.status = "running"
+        self.error = None
+        self.started = datetime.now()
+        self.finished = None
+        self.path = os.path.join(EXPORT_DIR, f"forensic_report_{self.started:%Y%m%d_%H%M%S}_{self.id}.{fmt}")
+        self._cancel = threading.Event()
+        self.future = None
+
+    @property
+    def progress(self):
+        if self.status == "done":
+            return 1.0
+        if self.fmt == "pdf":
+            return self.sections_done / self.sections_total if self.sections_total else 0.0
+        return min(self.rows_written / self.total_rows, 1.0) if self.total_rows else 0.0
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+
+def _event_chunks(events_df, job):
+    # Rendered, display-ready slices of the event table
+    from utils import COORD_DECIMALS
+
+    cols = [c for c in EVENT_COLUMNS if c in events_df.columns]
+    for start in range(0, len(events_df), CHUNK_ROWS):
+        if job.cancelled:
+            raise InterruptedError("Export cancelled")
+        chunk = events_df.iloc[start:start + CHUNK_ROWS]
+        out = chunk[cols].copy()
+        for col in ("lat", "lon"):
+            if col in out.columns:
+                out[col] = out[col].astype(float).round(COORD_DECIMALS)
+        out["notes"] = render_notes(get_flags(chunk))
+        yield out
+
+
+def _write_jsonl(job, events_df, report):
+    with open(job.path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"record": "report", **report}, default=str) + "\n")
+        for chunk in _event_chunks(events_df, job):
+            chunk = chunk.assign(record="event")
+            # lines=True already terminates every record with "\n"
+            f.write(chunk.to_json(orient="records", lines=True, date_format="iso"))
+            job.rows_written += len(chunk)
+
+
+def _write_csv(job, events_df, report):
+    header = True
+    with open(job.path, "w", encoding="utf-8", newline="") as f:
+        for chunk in _event_chunks(events_df, job):
+            chunk.to_csv(f, index=False, header=header, quoting=csv.QUOTE_MINIMAL)
+            header = False
+            job.rows_written += len(chunk)
+
+
+def _write_pdf(job, events_df, report, top_n):
+    from utils import generate_forensic_pdf_report
+
+    # The PDF only carries the summary and top-N sections, never every event
+    flagged = np.flatnonzero(get_flags(events_df) != 0)[:top_n]
+    top = events_df.iloc[flagged]
+    alerts = pd.DataFrame({
+        "timestamp": top["timestamp"].astype(str).to_numpy(),
+        "notes": render_notes(get_flags(top)),
+    }).to_dict(orient="records")
+
+    def progress(done, total):
+        if job.cancelled:
+            raise InterruptedError("Export cancelled")
+        job.sections_done, job.sections_total = done, total
+
+    generate_forensic_pdf_report({**report, "alerts": alerts}, output_path=job.path, top_n=top_n, progress=progress)
+
+
+def _run(job, events_df, report, top_n):
+    try:
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        if job.fmt == "jsonl":
+            _write_jsonl(job, events_df, report)
+        elif job.fmt == "csv":
+            _write_csv(job, events_df, report)
+        elif job.fmt == "pdf":
+            _write_pdf(job, events_df, report, top_n)
+        else:
+            raise ValueError(f"Unknown export format: {job.fmt}")
+        job.status = "done"
+    except InterruptedError:
+        job.status = "cancelled"
+        if os.path.exists(job.path):
+            os.remove(job.path)
+    except Exception as e:
+        job.status = "failed"
+        job.error = str(e)
+    finally:
+        job.finished = datetime.now()
+    return job
+
+
+def start_export(events_df, report, fmt="jsonl", top_n=10):
+    """
+    Write report metadata + events to disk on a background thread.
+    events_df is read, never modified; returns the ExportJob immediately.
+    """
+    job = ExportJob(fmt, len(events_df))
+    job.future = _executor.submit(_run, job, events_df, report, top_n)
+    return job
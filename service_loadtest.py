@@ -0,0 +1,130 @@
+# service_loadtest.py
+
+import sys
+import json
+import time
+import threading
+import numpy as np
+import pandas as pd
+
+# Load test for analysis_service.py: N simulated investigators, each sending
+# R analyze requests for a synthetic case, all at once. Reports latency
+# percentiles, throughput and the service's own counters (computed vs
+# answered from the shared cache / an identical in-flight request).
+# Without --url a service is started in-process on a free port.
+
+
+def _user(client, case, requests, params, latencies, errors, nonce=None):
+    for k in range(requests):
+        # An unused "nonce" key makes every request distinct, defeating the cache
+        extra = {"nonce": f"{nonce}-{k}"} if nonce is not None else {}
+        started = time.perf_counter()
+        try:
+            client.analyze(case["gps"], case["ipdr"], case["cdr"], normalize=True, **params, **extra)
+            latencies.append(time.perf_counter() - started)
+        except Exception as e:
+            errors.append(str(e))
+
+
+def run_load_test(url=None, users=4, requests=3, rows=5000, distinct_cases=1, workers=None,
+                  model_type="isolation_forest", seed=0, uncached=False):
+    """
+    Run the load test; returns a result dict. distinct_cases spreads the
+    users over that many different synthetic cases (1 = everyone analyses
+    the same case, which the service should compute once). uncached makes
+    every request unique so each one is computed.
+    """
+    from synthetic_data import generate_case
+    from analysis_client import AnalysisClient
+
+    server = None
+    if url is None:
+        from analysis_service import make_server, WORKERS
+        started = time.perf_counter()
+        server = make_server(port=0, workers=workers or WORKERS)
+        warmup_secs = time.perf_counter() - started
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+    else:
+        warmup_secs = None
+
+    try:
+        client = AnalysisClient(url)
+        before = client.health()
+        cases = [generate_case(rows, seed=seed + k) for k in range(distinct_cases)]
+        params = {"model_type": model_type}
+        latencies, errors = [], []
+        threads = [
+            threading.Thread(target=_user, args=(client, cases[u % distinct_cases], requests, params, latencies, errors,
+                                                 f"{time.time()}-{u}" if uncached else None))
+            for u in range(users)
+        ]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall = time.perf_counter() - started
+        after = client.health()
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.service.shutdown()
+            server.server_close()
+
+    lat = np.asarray(latencies) if latencies else np.full(1, np.nan)
+    return {
+        "url": url,
+        "users": users,
+        "requests_per_user": requests,
+        "rows_per_case": rows,
+        "distinct_cases": distinct_cases,
+        "uncached": uncached,
+        "workers": after["workers"],
+        "warmup_secs": round(warmup_secs, 2) if warmup_secs is not None else None,
+        "ok": len(latencies),
+        "errors": len(errors),
+        "wall_secs": round(wall, 3),
+        "requests_per_sec": round(len(latencies) / wall, 2) if wall > 0 else None,
+        "latency_p50_secs": round(float(np.nanpercentile(lat, 50)), 3),
+        "latency_p95_secs": round(float(np.nanpercentile(lat, 95)), 3),
+        "latency_max_secs": round(float(np.nanmax(lat)), 3),
+        "computed": after["computed"] - before["computed"],
+        "cache_hits": after["cache_hits"] - before["cache_hits"],
+        "joined_inflight": after["joined_inflight"] - before["joined_inflight"],
+        "first_error": errors[0] if errors else None,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Concurrent-user load test for the DIFA analysis service")
+    parser.add_argument("--url", help="running service (default: start one in-process)")
+    parser.add_argument("--users", type=int, nargs="*", default=[1, 4, 8], help="concurrent users, one run per value")
+    parser.add_argument("--requests", type=int, default=3, help="requests per user")
+    parser.add_argument("--rows", type=int, default=5000, help="rows per synthetic case")
+    parser.add_argument("--distinct-cases", type=int, default=None, help="different cases across users (default: one per user)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes for the in-process service")
+    parser.add_argument("--model-type", default="isolation_forest")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--uncached", action="store_true", help="make every request unique (measure compute, not the cache)")
+    parser.add_argument("--json", help="write all results to this file")
+    args = parser.parse_args()
+
+    results = []
+    for n_users in args.users:
+        result = run_load_test(
+            url=args.url, users=n_users, requests=args.requests, rows=args.rows,
+            distinct_cases=args.distinct_cases or n_users, workers=args.workers,
+            model_type=args.model_type, seed=args.seed, uncached=args.uncached,
+        )
+        results.append(result)
+        print(pd.DataFrame([result]).drop(columns=["url", "first_error"]).to_string(index=False))
+        if result["first_error"]:
+            print(f"  first error: {result['first_error']}")
+        sys.stdout.flush()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,184 @@
+# stage_benchmark.py
+
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+
+# Row counts above which a stage is skipped by default: these stages still
+# walk rows in Python (or render one marker per row) and would dominate a
+# large-scale run. Pass --no-limits to time them anyway.
+STAGE_ROW_LIMITS = {
+    "detect_spoofing_and_sim_swap": 50_000,
+    "correlate_events": 2_000_000,
+    "map": 20_000,
+}
+
+STAGES = [
+    "normalize", "parse_logs", "kinematics", "extract_features", "model",
+    "detect_spoofing_and_sim_swap", "correlate_events", "format_output_table", "map",
+]
+
+
+def _rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _PeakRSS:
+    """
+    Samples resident memory on a background thread while a stage runs, so
+    memory is measured without slowing the stage down (unlike tracemalloc).
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.base = self.peak = 0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _rss_bytes())
+
+    def __enter__(self):
+        self.base = self.peak = _rss_bytes()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rss_bytes())
+
+
+def _time_stage(results, name, rows, fn, limits):
+    limit = limits.get(name) if limits else None
+    if limit is not None and rows > limit:
+        results.append({"stage": name, "rows": rows, "status": f"skipped (> {limit:,} rows)"})
+        return None
+    with _PeakRSS() as mem:
+        t0 = time.perf_counter()
+        out = fn()
+        secs = time.perf_counter() - t0
+    results.append({
+        "stage": name,
+        "rows": rows,
+        "status": "ok",
+        "seconds": round(secs, 4),
+        "rows_per_sec": int(rows / secs) if secs > 0 else None,
+        "peak_rss_growth_mb": round((mem.peak - mem.base) / 2**20, 1),
+    })
+    return out
+
+
+def run_pipeline_benchmark(n_rows, seed=0, stages=None, limits=STAGE_ROW_LIMITS):
+    """
+    Generate a synthetic case of n_rows and time each analysis stage on it,
+    in pipeline order. Returns a list of per-stage result dicts.
+    """
+    from synthetic_data import generate_case
+    from tower_db import build_tower_index, TowerDB
+    from utils import normalize_columns
+    from android_feature_extractor import parse_logs, extract_features
+    from kinematics import add_kinematics
+    from train_model import detect_spoofing_and_sim_swap, format_output_table
+    from correlation_engine import correlate_events
+    from sklearn.ensemble import IsolationForest
+
+    stages = set(stages or STAGES)
+    results = []
+    case = generate_case(n_rows, seed=seed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        towers_csv = os.path.join(tmp, "towers.csv")
+        case["towers"].to_csv(towers_csv, index=False)
+        build_tower_index(towers_csv, os.path.join(tmp, "towers.idx"))
+        tower_db = TowerDB(os.path.join(tmp, "towers.idx"))
+
+        raw_rows = sum(len(case[k]) for k in ("gps", "ipdr", "cdr"))
+        frames = _time_stage(results, "normalize", raw_rows, lambda: (
+            normalize_columns(case["gps"], type="gps"),
+            normalize_columns(case["ipdr"], type="ipdr"),
+            normalize_columns(case["cdr"], type="cdr"),
+        ), None)
+        gps_df, ipdr_df, cdr_df = frames
+
+        timeline_df = _time_stage(results, "parse_logs", raw_rows,
+                                  lambda: parse_logs(gps_df, ipdr_df, cdr_df, tower_db=tower_db), None)
+        n = len(timeline_df)
+
+        if "kinematics" in stages:
+            _time_stage(results, "kinematics", n, lambda: add_kinematics(timeline_df), limits)
+
+        features_df = None
+        if "extract_features" in stages:
+            features_df = _time_stage(results, "extract_features", n, lambda: extract_features(timeline_df), limits)
+
+        timeline_df["anomaly"] = 0
+        if "model" in stages and features_df is not None:
+            def fit_score():
+                model = IsolationForest(contamination=0.1, random_state=42)
+                model.fit(features_df)
+                return model.predict(features_df)
+            preds = _time_stage(results, "model", n, fit_score, limits)
+            timeline_df["anomaly"] = (preds == -1).astype(int)
+
+        if "detect_spoofing_and_sim_swap" in stages:
+            _time_stage(results, "detect_spoofing_and_sim_swap", n,
+                        lambda: detect_spoofing_and_sim_swap(timeline_df), limits)
+
+        if "correlate_events" in stages:
+            _time_stage(results, "correlate_events", n,
+                        lambda: correlate_events(timeline_df.to_dict("records")), limits)
+
+        if "format_output_table" in stages:
+            _time_stage(results, "format_output_table", n, lambda: format_output_table(timeline_df), limits)
+
+        if "map" in stages:
+            from map_utils import create_hybrid_movement_map_with_labels
+            _time_stage(results, "map", n, lambda: create_hybrid_movement_map_with_labels(timeline_df), limits)
+
+    return results
+
+
+def print_results(results):
+    table = pd.DataFrame(results)
+    for col in ("seconds", "rows_per_sec", "peak_rss_growth_mb"):
+        if col not in table.columns:
+            table[col] = np.nan
+    print(table[["stage", "rows", "status", "seconds", "rows_per_sec", "peak_rss_growth_mb"]].to_string(index=False))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Time and memory-profile each DIFA stage on synthetic cases")
+    parser.add_argument("scales", nargs="*", default=["1e3", "1e4", "1e5"], help="row counts, e.g. 1e3 1e5 1e6")
+    parser.add_argument("--stages", nargs="*", default=None, choices=STAGES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-limits", action="store_true", help="run row-wise stages at every scale")
+    parser.add_argument("--json", help="write all results to this file")
+    args = parser.parse_args()
+
+    all_results = []
+    for scale in args.scales:
+        n = int(float(scale))
+        print(f"\n== {n:,} rows ==")
+        results = run_pipeline_benchmark(n, seed=args.seed, stages=args.stages,
+                                         limits=None if args.no_limits else STAGE_ROW_LIMITS)
+        print_results(results)
+        all_results += [{"scale": n, **r} for r in results]
+        sys.stdout.flush()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(all_results, f, indent=2)
@@ -0,0 +1,302 @@
+# streaming_rules.py
+
+import numpy as np
+import pandas as pd
+from utils import haversine_np
+from domain_matcher import get_domain_matcher
+from train_model import RULE_ALERTS
+from anomaly_flags import (
+    FLAGS_DTYPE, SIM_SPOOF_JUMP, GPS_IP_CONFLICT, IP_HOPS,
+    TOR_SERVICE, MALWARE_DOMAIN, THREAT_DOMAIN, get_flags,
+)
+
+# Rule-only triage of time-ordered event chunks in constant memory.
+# Gives the same flags and alerts as detect_spoofing_and_sim_swap on the
+# whole (per-subscriber) timeline. Carried state per subscriber: the
+# previous event, the last GPS fix and the events still waiting for a
+# GPS fix up to max_gap_secs ahead (Rule 2 looks both ways).
+
+CHUNK_ROWS = 200_000
+EVENT_TYPES = ["ipdr", "cdr"]
+HOP_KM = 50
+HOP_SECS = 300
+_NO_TIME = np.iinfo(np.int64).min
+
+
+class _State:
+    __slots__ = ("prev", "last_fix", "last_gps_t", "buffer")
+
+    def __init__(self):
+        self.prev = None            # (t, type, lat, lon) of the last emitted row
+        self.last_fix = None        # (t, lat, lon) of the last emitted GPS fix
+        self.last_gps_t = _NO_TIME  # latest GPS row timestamp emitted
+        self.buffer = None          # rows not yet decided (re-evaluated next chunk)
+
+
+class StreamingRuleEvaluator:
+    """
+    feed() time-ordered chunks, then flush(). Each call returns
+    (rows, alerts): the rows whose verdicts are final, with anomaly/flags
+    set, and their alerts as (timestamp, message) in batch order.
+    With `key` (e.g. "subscriber") every key value is evaluated on its own.
+    """
+
+    def __init__(self, gps_threshold_km=100, max_gap_secs=900, key=None, matcher=None):
+        self.gps_threshold_km = gps_threshold_km
+        self.gap_ns = np.int64(max_gap_secs * 1e9)
+        self.key = key
+        self.matcher = matcher or get_domain_matcher()
+        self.states = {}
+        self.rows_in = 0
+        self.max_buffered = 0
+
+    @property
+    def buffered(self):
+        return sum(len(s.buffer) for s in self.states.values() if s.buffer is not None)
+
+    def _evaluate(self, frame, state, final):
+        # Flags/anomaly/new alert bits for frame given the carried state, and
+        # which rows are decided (no later row can change their verdict)
+        n = len(frame)
+        ts = pd.to_datetime(frame["timestamp"], errors="coerce")
+        valid = ts.notna().to_numpy()
+        t = np.where(valid, ts.to_numpy(dtype="datetime64[ns]").astype(np.int64), _NO_TIME)
+        types = frame["type"].to_numpy(dtype=object)
+        lat = pd.to_numeric(frame["lat"], errors="coerce").to_numpy(dtype=float)
+        lon = pd.to_numeric(frame["lon"], errors="coerce").to_numpy(dtype=float)
+        flags_in = get_flags(frame)
+        anomaly = frame["anomaly"].fillna(0).to_numpy().astype(int) if "anomaly" in frame.columns else np.zeros(n, dtype=int)
+
+        # Previous row (the carried one for row 0; none → row 0 is its own prev)
+        if state.prev is not None:
+            p_t0, p_type0, p_lat0, p_lon0 = state.prev
+        else:
+            p_t0, p_type0, p_lat0, p_lon0 = t[0], types[0], np.nan, np.nan
+        p_t = np.r_[p_t0, t[:-1]]
+        p_types = np.r_[np.array([p_type0], dtype=object), types[:-1]]
+        dist = haversine_np(lat, lon, np.r_[p_lat0, lat[:-1]], np.r_[p_lon0, lon[:-1]])
+        p_valid = p_t != _NO_TIME
+        both_valid = valid & p_valid
+
+        is_event = np.isin(types, EVENT_TYPES)
+        p_is_event = np.isin(p_types, EVENT_TYPES)
+        is_ipdr = types == "ipdr"
+
+        # Rule 1 needs no GPS row strictly between prev and curr
+        gps_t = np.where((types == "gps") & valid, t, _NO_TIME)
+        last_gps = np.maximum.accumulate(np.r_[state.last_gps_t, gps_t])[:-1]
+        gps_between = both_valid & (last_gps > p_t) & (last_gps < t)
+        rule1 = is_event & p_is_event & (dist > self.gps_threshold_km) & ~gps_between
+
+        # Rule 3: IPDR tower hops
+        with np.errstate(invalid="ignore"):
+            time_diff = np.where(both_valid, (t - p_t) / 1e9, np.nan)
+            rule3 = is_ipdr & (p_types == "ipdr") & (time_diff < HOP_SECS) & (dist > HOP_KM)
+
+        # Rule 2: nearest GPS fix (before or after, backward wins ties) within the gap
+        is_fix = (types == "gps") & ~np.isnan(lat) & valid
+        fix_t, fix_lat, fix_lon = t[is_fix], lat[is_fix], lon[is_fix]
+        if state.last_fix is not None:
+            fix_t = np.r_[state.last_fix[0], fix_t]
+            fix_lat = np.r_[state.last_fix[1], fix_lat]
+            fix_lon = np.r_[state.last_fix[2], fix_lon]
+        order = np.argsort(fix_t, kind="stable")
+        fix_t, fix_lat, fix_lon = fix_t[order], fix_lat[order], fix_lon[order]
+
+        ev = np.flatnonzero(is_event & valid)
+        gps_dist = np.full(n, np.nan)
+        waiting = np.zeros(n, dtype=bool)
+        if len(ev):
+            te = t[ev]
+            b = np.searchsorted(fix_t, te, side="right") - 1
+            f = np.searchsorted(fix_t, te, side="left")
+            has_b = b >= 0
+            has_f = f < len(fix_t)
+            far = np.iinfo(np.int64).max
+            padded = np.r_[fix_t, 0]
+            bdiff = np.where(has_b, te - padded[np.where(has_b, b, -1)], far)
+            fdiff = np.where(has_f, padded[f] - te, far)
+            use_b = (bdiff <= self.gap_ns) & (bdiff <= fdiff)
+            use_f = ~use_b & (fdiff <= self.gap_ns)
+            pick = np.where(use_b, b, f)
+            hit = use_b | use_f
+            k = ev[hit]
+            gps_dist[k] = haversine_np(lat[k], lon[k], fix_lat[pick[hit]], fix_lon[pick[hit]])
+
+            # Later rows (timestamps >= the newest seen) can still add a fix at
+            # the same instant, or the first fix ahead within the gap
+            if not final and valid.any():
+                newest = t[valid].max()
+                need = ~np.isnan(lat[ev]) & ((newest <= te) | (~has_f & (newest <= te + self.gap_ns)))
+                waiting[ev[need]] = True
+        with np.errstate(invalid="ignore"):
+            rule2 = gps_dist > self.gps_threshold_km
+
+        # Rule 4: threat-intel domains on IPDR rows
+        if "domain" in frame.columns:
+            category = self.matcher.match_column(
+                frame["domain"],
+                categories=[c for c in self.matcher.categories if c != "suspicious"],
+            ).to_numpy()
+        else:
+            category = np.full(n, None, dtype=object)
+        rule4 = is_ipdr & pd.notna(category)
+        domain_bit = np.where(category == "tor", TOR_SERVICE,
+                              np.where(category == "malware", MALWARE_DOMAIN, THREAT_DOMAIN)).astype(FLAGS_DTYPE)
+
+        rule_bits = (
+            np.where(rule1, SIM_SPOOF_JUMP, 0)
+            | np.where(rule2, GPS_IP_CONFLICT, 0)
+            | np.where(rule3, IP_HOPS, 0)
+            | np.where(rule4, domain_bit, 0)
+        ).astype(FLAGS_DTYPE)
+        new_bits = rule_bits & ~flags_in
+        anomaly = np.where(rule_bits != 0, 1, anomaly)
+        return {
+            "flags": flags_in | rule_bits,
+            "anomaly": anomaly,
+            "new_bits": new_bits,
+            "category": category,
+            "timestamp": ts,
+            "t": t,
+            "types": types,
+            "lat": lat,
+            "lon": lon,
+            "is_fix": is_fix,
+            "decided": ~waiting,
+        }
+
+    def _alerts(self, frame, r, upto):
+        alerts = []
+        new_bits = r["new_bits"][:upto]
+        domains = frame["domain"] if "domain" in frame.columns else pd.Series("", index=frame.index)
+        for i in np.flatnonzero(new_bits):
+            bits = new_bits[i]
+            ts = r["timestamp"].iloc[i]
+            for bit in (SIM_SPOOF_JUMP, GPS_IP_CONFLICT, IP_HOPS, TOR_SERVICE, MALWARE_DOMAIN, THREAT_DOMAIN):
+                if bits & bit:
+                    domain = str(domains.iloc[i]).lower()
+                    alerts.append((ts, RULE_ALERTS[bit].format(domain=domain, category=r["category"][i])))
+        return alerts
+
+    def _advance(self, state, frame, final):
+        if state.buffer is not None and not state.buffer.empty:
+            frame = pd.concat([state.buffer, frame], ignore_index=True) if not frame.empty else state.buffer
+        if frame.empty:
+            state.buffer = None
+            return frame, []
+        r = self._evaluate(frame, state, final)
+
+        undecided = np.flatnonzero(~r["decided"])
+        cut = int(undecided[0]) if len(undecided) else len(frame)
+        done = frame.iloc[:cut].copy()
+        done["timestamp"] = r["timestamp"].iloc[:cut].to_numpy()
+        done["anomaly"] = r["anomaly"][:cut]
+        done["flags"] = r["flags"][:cut]
+        alerts = self._alerts(frame, r, cut)
+
+        # Carry forward what the next rows need from the emitted ones
+        if cut:
+            j = cut - 1
+            state.prev = (r["t"][j], r["types"][j], r["lat"][j], r["lon"][j])
+            fixes = np.flatnonzero(r["is_fix"][:cut])
+            if len(fixes):
+                k = fixes[np.argsort(r["t"][fixes], kind="stable")[-1]]
+                state.last_fix = (r["t"][k], r["lat"][k], r["lon"][k])
+            gps = (r["types"][:cut] == "gps") & (r["t"][:cut] != _NO_TIME)
+            if gps.any():
+                state.last_gps_t = max(state.last_gps_t, int(r["t"][:cut][gps].max()))
+        state.buffer = frame.iloc[cut:].reset_index(drop=True)
+        return done, alerts
+
+    def _run(self, chunk, final):
+        parts, alerts = [], []
+        if self.key is None:
+            groups = [(None, chunk)]
+        else:
+            groups = list(chunk.groupby(self.key, sort=False, dropna=False)) if not chunk.empty else []
+            if final:
+                seen = {k for k, _ in groups}
+                groups += [(k, chunk.iloc[:0]) for k in self.states if k not in seen]
+        for k, group in groups:
+            state = self.states.setdefault(k, _State())
+            done, group_alerts = self._advance(state, group.reset_index(drop=True), final)
+            parts.append(done)
+            alerts += [(a, b, k) for a, b in group_alerts] if self.key is not None else group_alerts
+
+        rows = pd.concat([p for p in parts if not p.empty], ignore_index=True) if any(not p.empty for p in parts) else chunk.iloc[:0]
+        if self.key is not None and not rows.empty:
+            rows = rows.sort_values("_seq", kind="stable").reset_index(drop=True)
+        self.max_buffered = max(self.max_buffered, self.buffered)
+        return rows.drop(columns="_seq", errors="ignore"), alerts
+
+    def feed(self, chunk):
+        """
+        Evaluate the next time-ordered chunk. Returns (decided rows, alerts).
+        """
+        chunk = chunk.reset_index(drop=True)
+        if self.key is not None:
+            chunk["_seq"] = np.arange(self.rows_in, self.rows_in + len(chunk))
+        self.rows_in += len(chunk)
+        return self._run(chunk, final=False)
+
+    def flush(self):
+        """
+        Decide every buffered row (no more input). Returns (rows, alerts).
+        """
+        empty = pd.DataFrame(columns=["timestamp", "type", "lat", "lon"])
+        if self.key is not None:
+            empty[self.key] = []
+            empty["_seq"] = []
+        return self._run(empty, final=True)
+
+
+def evaluate_rules(timeline_df, gps_threshold_km=100, max_gap_secs=900):
+    """
+    Rules over a whole in-memory timeline in one vectorised pass.
+    Same result as detect_spoofing_and_sim_swap: (timeline_df, alerts).
+    """
+    evaluator = StreamingRuleEvaluator(gps_threshold_km=gps_threshold_km, max_gap_secs=max_gap_secs)
+    rows, alerts = evaluator.feed(timeline_df)
+    rest, more = evaluator.flush()
+    if not rest.empty:
+        rows = pd.concat([rows, rest], ignore_index=True)
+    rows.attrs = timeline_df.attrs
+    return rows, alerts + more
+
+
+def stream_rules(chunks, gps_threshold_km=100, max_gap_secs=900, key=None):
+    """
+    Run the rules over an iterable of time-ordered chunks (e.g.
+    pd.read_csv(..., chunksize=...)); yields (rows, alerts) per chunk.
+    With `key`, alerts are (timestamp, message, key).
+    """
+    evaluator = StreamingRuleEvaluator(gps_threshold_km=gps_threshold_km, max_gap_secs=max_gap_secs, key=key)
+    for chunk in chunks:
+        yield evaluator.feed(chunk)
+    yield evaluator.flush()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Rule-only triage of a time-ordered timeline CSV in constant memory.")
+    parser.add_argument("timeline_csv", help="Time-ordered events with timestamp, type, lat, lon (and domain)")
+    parser.add_argument("--key", default=None, help="Evaluate each value of this column (e.g. subscriber) separately")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--gps-threshold-km", type=float, default=100)
+    parser.add_argument("--max-gap-secs", type=float, default=900)
+    args = parser.parse_args()
+
+    rows = alerts = 0
+    for done, chunk_alerts in stream_rules(
+        pd.read_csv(args.timeline_csv, chunksize=args.chunk_rows),
+        gps_threshold_km=args.gps_threshold_km,
+        max_gap_secs=args.max_gap_secs,
+        key=args.key,
+    ):
+        rows += len(done)
+        alerts += len(chunk_alerts)
+        for alert in chunk_alerts:
+            print(" ➜ ".join(str(x) for x in alert))
+    print(f"✅ {rows:,} rows, {alerts:,} alerts")
@@ -0,0 +1,231 @@
+# synthetic_data.py
+
+import os
+import json
+import numpy as np
+import pandas as pd
+
+# Synthetic case: one suspect handset moving around Delhi, with GPS fixes,
+# IPDR sessions and CDR calls in the raw column names investigators upload
+# (normalize_columns maps them). Injected events carry ground truth.
+
+DEFAULT_MIX = {"gps": 0.6, "ipdr": 0.3, "cdr": 0.1}
+GPS_INTERVAL_SECS = 30
+
+# Tower grid covering the home area; CDR rows use the tower nearest the handset
+HOME_BOX = (28.40, 28.90, 76.90, 77.50)  # lat_min, lat_max, lon_min, lon_max
+TOWER_STEP_DEG = 0.01
+MCC, MNC = 404, 10
+# A far-away cluster used for SIM-swap calls (Mumbai)
+FAR_TOWER = (19.0760, 72.8777)
+FAR_CELL_ID = 9_000_001
+FAR_LAC = 9000
+
+BENIGN_DOMAINS = [
+    "google.com", "www.youtube.com", "api.whatsapp.net", "graph.facebook.com",
+    "instagram.com", "mail.yahoo.com", "cdn.jsdelivr.net", "play.googleapis.com",
+    "netflix.com", "paytm.com", "amazon.in", "hotstar.com",
+]
+TOR_EXIT_IP = "185.220.101.1"  # geolocates to France in parse_logs
+INJECTED_KINDS = ["impossible_travel", "sim_swap", "tor"]
+
+
+def _tower_grid():
+    lat_min, lat_max, lon_min, lon_max = HOME_BOX
+    lats = np.arange(lat_min, lat_max + 1e-9, TOWER_STEP_DEG)
+    lons = np.arange(lon_min, lon_max + 1e-9, TOWER_STEP_DEG)
+    return lats, lons
+
+
+def generate_towers():
+    """
+    OpenCellID-style tower table (mcc, net, area, cell, lat, lon) for the
+    home grid plus the far SIM-swap cell; feed it to tower_db.build_tower_index.
+    """
+    lats, lons = _tower_grid()
+    glat, glon = np.meshgrid(lats, lons, indexing="ij")
+    n = glat.size
+    cells = np.arange(n, dtype=np.int64) + 1
+    towers = pd.DataFrame({
+        "mcc": MCC,
+        "net": MNC,
+        "area": 100 + cells // 1000,
+        "cell": cells,
+        "lat": glat.ravel().round(5),
+        "lon": glon.ravel().round(5),
+    })
+    far = pd.DataFrame({"mcc": [MCC], "net": [MNC], "area": [FAR_LAC], "cell": [FAR_CELL_ID],
+                        "lat": [FAR_TOWER[0]], "lon": [FAR_TOWER[1]]})
+    return pd.concat([towers, far], ignore_index=True)
+
+
+def _nearest_cell(lat, lon):
+    # Cell id / LAC of the grid tower nearest each position
+    lats, lons = _tower_grid()
+    i = np.clip(np.rint((lat - HOME_BOX[0]) / TOWER_STEP_DEG), 0, len(lats) - 1).astype(np.int64)
+    j = np.clip(np.rint((lon - HOME_BOX[2]) / TOWER_STEP_DEG), 0, len(lons) - 1).astype(np.int64)
+    cells = i * len(lons) + j + 1
+    return cells, 100 + cells // 1000
+
+
+def _carrier_ips(rng, n):
+    # CGNAT addresses (100.64.0.0/10): no geolocation, like most mobile sessions
+    octets = rng.integers(1, 255, (2, n)).astype(str)
+    return np.char.add(np.char.add("100.64.", octets[0]), np.char.add(".", octets[1])).astype(object)
+
+
+class CaseGenerator:
+    """
+    Streams a synthetic case in chunks so very large cases (1e8 rows) can be
+    written to disk without holding them in memory. Each chunk continues the
+    previous one's track and clock.
+    """
+
+    def __init__(self, seed=0, mix=None, inject_rate=0.001, start="2025-06-29 00:00:00"):
+        self.rng = np.random.default_rng(seed)
+        self.mix = mix or DEFAULT_MIX
+        self.inject_rate = inject_rate
+        self.t0 = pd.Timestamp(start).value // 10**9
+        lat_min, lat_max, lon_min, lon_max = HOME_BOX
+        self.lat = (lat_min + lat_max) / 2
+        self.lon = (lon_min + lon_max) / 2
+        self.truth = {kind: [] for kind in INJECTED_KINDS}
+
+    def _split(self, n_rows):
+        n_gps = max(int(n_rows * self.mix["gps"]), 1)
+        n_ipdr = int(n_rows * self.mix["ipdr"])
+        n_cdr = max(n_rows - n_gps - n_ipdr, 0)
+        return n_gps, n_ipdr, n_cdr
+
+    def _track(self, n):
+        # Random walk (~walking / city traffic speeds) reflected into the home box
+        steps = self.rng.normal(0, 0.0004, (2, n))
+        lat = self.lat + np.cumsum(steps[0])
+        lon = self.lon + np.cumsum(steps[1])
+        lat_min, lat_max, lon_min, lon_max = HOME_BOX
+        span_lat, span_lon = lat_max - lat_min, lon_max - lon_min
+        lat = lat_min + np.abs((lat - lat_min + span_lat) % (2 * span_lat) - span_lat)
+        lon = lon_min + np.abs((lon - lon_min + span_lon) % (2 * span_lon) - span_lon)
+        self.lat, self.lon = lat[-1], lon[-1]
+        return lat, lon
+
+    def _pick(self, n, rate):
+        k = self.rng.binomial(n, rate) if n else 0
+        return self.rng.choice(n, size=min(k, n), replace=False) if k else np.empty(0, dtype=np.int64)
+
+    def chunk(self, n_rows):
+        """
+        Next (gps, ipdr, cdr) DataFrames with about n_rows rows in total.
+        """
+        n_gps, n_ipdr, n_cdr = self._split(n_rows)
+        rng = self.rng
+
+        gps_t = self.t0 + np.arange(n_gps, dtype=np.int64) * GPS_INTERVAL_SECS + rng.integers(0, 5, n_gps)
+        gps_lat, gps_lon = self._track(n_gps)
+        span_end = self.t0 + n_gps * GPS_INTERVAL_SECS
+        self.t0 = span_end
+
+        # 🚀 Impossible travel: single GPS fix teleported to the far city
+        jump = self._pick(n_gps, self.inject_rate)
+        gps_lat_out, gps_lon_out = gps_lat.copy(), gps_lon.copy()
+        gps_lat_out[jump] = FAR_TOWER[0] + rng.normal(0, 0.01, len(jump))
+        gps_lon_out[jump] = FAR_TOWER[1] + rng.normal(0, 0.01, len(jump))
+
+        # Where the handset really is at any instant (last GPS fix before t)
+        def position_at(t):
+            k = np.clip(np.searchsorted(gps_t, t, side="right") - 1, 0, n_gps - 1)
+            return gps_lat[k], gps_lon[k]
+
+        ipdr_t = np.sort(rng.integers(gps_t[0], span_end, n_ipdr))
+        ipdr = pd.DataFrame({
+            "timestamp": pd.to_datetime(ipdr_t, unit="s"),
+            "src_ip": _carrier_ips(rng, n_ipdr),
+            "hostname": np.array(BENIGN_DOMAINS, dtype=object)[rng.integers(0, len(BENIGN_DOMAINS), n_ipdr)],
+            "upload": rng.lognormal(7, 1.5, n_ipdr).astype(np.int64),
+            "download": rng.lognormal(9, 1.5, n_ipdr).astype(np.int64),
+        })
+
+        # 🧅 TOR: .onion session through a known exit
+        tor = self._pick(n_ipdr, self.inject_rate)
+        if len(tor):
+            letters = np.array(list("abcdefghijklmnopqrstuvwxyz234567"))
+            ipdr.loc[tor, "hostname"] = ["".join(rng.choice(letters, 16)) + ".onion" for _ in tor]
+            ipdr.loc[tor, "src_ip"] = TOR_EXIT_IP
+
+        cdr_t = np.sort(rng.integers(gps_t[0], span_end, n_cdr))
+        cdr_lat, cdr_lon = position_at(cdr_t)
+        cells, lacs = _nearest_cell(cdr_lat, cdr_lon)
+        cdr = pd.DataFrame({
+            "timestamp": pd.to_datetime(cdr_t, unit="s"),
+            "caller": np.char.add("+9198", rng.integers(10_000_000, 99_999_999, n_cdr).astype(str)),
+            "call_type": np.where(rng.random(n_cdr) < 0.5, "incoming", "outgoing"),
+            "duration": rng.exponential(120, n_cdr).astype(np.int64),
+            "mcc": MCC,
+            "mnc": MNC,
+            "lac": lacs,
+            "cell_id": cells,
+        })
+
+        # 📶 SIM swap: call served by a far tower while GPS stays at home
+        swap = self._pick(n_cdr, self.inject_rate)
+        cdr.loc[swap, "lac"] = FAR_LAC
+        cdr.loc[swap, "cell_id"] = FAR_CELL_ID
+
+        gps = pd.DataFrame({
+            "timestamp": pd.to_datetime(gps_t, unit="s"),
+            "latitude": gps_lat_out.round(6),
+            "longitude": gps_lon_out.round(6),
+        })
+
+        self.truth["impossible_travel"].extend(gps["timestamp"].iloc[np.sort(jump)].astype(str))
+        self.truth["tor"].extend(ipdr["timestamp"].iloc[np.sort(tor)].astype(str))
+        self.truth["sim_swap"].extend(cdr["timestamp"].iloc[np.sort(swap)].astype(str))
+        return gps, ipdr, cdr
+
+
+def generate_case(n_rows, seed=0, mix=None, inject_rate=0.001):
+    """
+    In-memory synthetic case. Returns {"gps", "ipdr", "cdr", "towers", "truth"}
+    where truth lists the timestamps of every injected event by kind.
+    """
+    gen = CaseGenerator(seed=seed, mix=mix, inject_rate=inject_rate)
+    gps, ipdr, cdr = gen.chunk(int(n_rows))
+    return {"gps": gps, "ipdr": ipdr, "cdr": cdr, "towers": generate_towers(), "truth": gen.truth}
+
+
+def write_case(out_dir, n_rows, seed=0, mix=None, inject_rate=0.001, chunk_rows=1_000_000):
+    """
+    Write a synthetic case as gps.csv / ipdr.csv / cdr.csv / towers.csv and
+    truth.json, generated chunk by chunk. Returns the per-file row counts.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    gen = CaseGenerator(seed=seed, mix=mix, inject_rate=inject_rate)
+    paths = {name: os.path.join(out_dir, f"{name}.csv") for name in ("gps", "ipdr", "cdr")}
+    counts = {name: 0 for name in paths}
+
+    remaining = int(n_rows)
+    first = True
+    while remaining > 0:
+        frames = dict(zip(("gps", "ipdr", "cdr"), gen.chunk(min(chunk_rows, remaining))))
+        for name, df in frames.items():
+            df.to_csv(paths[name], mode="w" if first else "a", header=first, index=False)
+            counts[name] += len(df)
+        remaining -= min(chunk_rows, remaining)
+        first = False
+
+    generate_towers().to_csv(os.path.join(out_dir, "towers.csv"), index=False)
+    with open(os.path.join(out_dir, "truth.json"), "w") as f:
+        json.dump({"rows": counts, "counts": {k: len(v) for k, v in gen.truth.items()}, "events": gen.truth}, f)
+    return counts
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 3:
+        print("Usage: python synthetic_data.py <rows, e.g. 1e6> <out_dir> [seed]")
+        sys.exit(1)
+
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    counts = write_case(sys.argv[2], int(float(sys.argv[1])), seed=seed)
+    print(f"Wrote {sum(counts.values()):,} rows → {sys.argv[2]} {counts}")
@@ -0,0 +1,211 @@
+# timeline_view.py
+
+import numpy as np
+import pandas as pd
+from domain_matcher import get_domain_matcher
+from anomaly_flags import FLAG_GROUPS, get_flags, has_any
+
+
+def prepare_timeline_view(timeline_df):
+    """
+    Precompute the columns the filter panel and summary read, once per analysis.
+    Returns a frame aligned to timeline_df's index with:
+      type, domain       categoricals
+      day                calendar day (NaT if the timestamp is missing)
+      sod                seconds of day (int32)
+      anomaly            int8
+      speed_kmph         float, from the kinematics stage (NaN if not present)
+      flag_<group>       one bool column per FLAG_GROUPS entry
+      flag_suspicious_domain
+    """
+    n = len(timeline_df)
+    index = timeline_df.index
+    view = pd.DataFrame(index=index)
+
+    view["type"] = timeline_df["type"].astype("category") if "type" in timeline_df.columns else pd.Categorical([None] * n)
+    domain = timeline_df["domain"] if "domain" in timeline_df.columns else pd.Series([None] * n, index=index)
+    view["domain"] = domain.astype("category")
+
+    ts = pd.to_datetime(timeline_df["timestamp"], errors="coerce")
+    view["day"] = ts.dt.normalize()
+    sod = ts.dt.hour * 3600 + ts.dt.minute * 60 + ts.dt.second
+    view["sod"] = sod.fillna(-1).astype(np.int32)
+
+    anomaly = timeline_df["anomaly"] if "anomaly" in timeline_df.columns else pd.Series(0, index=index)
+    view["anomaly"] = anomaly.fillna(0).astype(np.int8)
+
+    if "speed_kmph" in timeline_df.columns:
+        view["speed_kmph"] = pd.to_numeric(timeline_df["speed_kmph"], errors="coerce")
+    else:
+        view["speed_kmph"] = np.nan
+
+    flags = get_flags(timeline_df)
+    for name, mask in FLAG_GROUPS.items():
+        view[f"flag_{name}"] = has_any(flags, mask)
+
+    view["flag_suspicious_domain"] = get_domain_matcher().flag_column(domain, "suspicious")
+
+    return view
+
+
+def _minute_of_day(t):
+    return t.hour * 60 + t.minute
+
+
+def filter_mask(view, anomaly_only=False, selected_types=None, suspicious_only=False,
+                long_jump_only=False, start_time=None, end_time=None, speed_threshold=None):
+    """
+    Boolean mask over the view for the sidebar filter settings. The time
+    window is compared in whole minutes, end minute included.
+    """
+    mask = np.ones(len(view), dtype=bool)
+    if anomaly_only:
+        mask &= view["anomaly"].to_numpy() == 1
+    if selected_types:
+        mask &= view["type"].isin(selected_types).to_numpy()
+    if suspicious_only:
+        mask &= view["flag_suspicious_domain"].to_numpy()
+    if long_jump_only:
+        # Flagged jumps, plus any hop faster than the speed threshold
+        jump = view["flag_jump"].to_numpy()
+        if speed_threshold is not None:
+            jump = jump | (view["speed_kmph"].to_numpy() > speed_threshold)
+        mask &= jump
+    if start_time is not None and end_time is not None:
+        minute = view["sod"].to_numpy() // 60
+        mask &= (minute >= _minute_of_day(start_time)) & (minute <= _minute_of_day(end_time))
+    return mask
+
+
+def summarize_view(view, mask, correlation_score=None):
+    """
+    Investigation summary metrics for the rows selected by mask.
+    """
+    sel = view[mask]
+    return {
+        "Total Events": int(mask.sum()),
+        "Anomalies Detected": int(sel["anomaly"].sum()),
+        "GPS Jumps": int(sel["flag_jump"].sum()),
+        "SIM Swap Events": int(sel["flag_swap"].sum()),
+        "Spoofing Detected": int(sel["flag_spoof"].sum()),
+        "Correlation Score > 3": int((np.asarray(correlation_score)[mask] > 3).sum()) if correlation_score is not None else 0,
+    }
+
+
+# Speeds the sidebar's high-speed slider can be set to (km/h)
+ROLLUP_SPEED_STEPS = np.arange(100, 1001, 50)
+
+
+class RollupCube:
+    """
+    Event counts per occupied cell of (type, day, minute of day, anomaly,
+    flag groups, suspicious domain, correlation score > 3, speed step),
+    built once per analysis from the prepared view. Summary metrics, the
+    anomaly chart and the activity heatmaps read cells, not events, and give
+    the same numbers as filter_mask + summarize_view for any filter whose
+    speed threshold is one of speed_steps. The view itself is kept as
+    `view` for row-level filtering.
+    """
+
+    def __init__(self, view, correlation_score=None, speed_steps=ROLLUP_SPEED_STEPS, key=None):
+        self.view = view
+        self.types = list(view["type"].cat.categories)
+        day_codes, self.days = pd.factorize(view["day"])
+        self.speed_steps = np.asarray(speed_steps)
+        self.key = key
+
+        speed = view["speed_kmph"].to_numpy(dtype=float)
+        speed_step = np.searchsorted(self.speed_steps, speed, side="left")  # steps strictly below speed
+        speed_step[np.isnan(speed)] = 0
+        groups = np.zeros(len(view), dtype=np.int8)
+        for bit, name in enumerate(FLAG_GROUPS):
+            groups |= view[f"flag_{name}"].to_numpy().astype(np.int8) << bit
+        corr_high = np.asarray(correlation_score) > 3 if correlation_score is not None else np.zeros(len(view), dtype=bool)
+
+        self.cells = pd.DataFrame({
+            "type": view["type"].cat.codes.to_numpy(),
+            "day": day_codes,
+            "minute": view["sod"].to_numpy() // 60,
+            "anomaly": view["anomaly"].to_numpy(),
+            "groups": groups,
+            "suspicious": view["flag_suspicious_domain"].to_numpy(),
+            "corr_high": corr_high,
+            "speed_step": speed_step,
+        }).groupby(
+            ["type", "day", "minute", "anomaly", "groups", "suspicious", "corr_high", "speed_step"], sort=False
+        ).size().rename("events").reset_index()
+
+    def __len__(self):
+        return len(self.cells)
+
+    def _group(self, name):
+        bit = list(FLAG_GROUPS).index(name)
+        return (self.cells["groups"].to_numpy() >> bit) & 1 == 1
+
+    def mask(self, anomaly_only=False, selected_types=None, suspicious_only=False,
+             long_jump_only=False, start_time=None, end_time=None, speed_threshold=None):
+        """
+        Boolean mask over cells; same arguments as filter_mask.
+        """
+        c = self.cells
+        mask = np.ones(len(c), dtype=bool)
+        if anomaly_only:
+            mask &= c["anomaly"].to_numpy() == 1
+        if selected_types:
+            codes = [i for i, t in enumerate(self.types) if t in set(selected_types)]
+            mask &= np.isin(c["type"].to_numpy(), codes)
+        if suspicious_only:
+            mask &= c["suspicious"].to_numpy()
+        if long_jump_only:
+            jump = self._group("jump")
+            if speed_threshold is not None:
+                step = np.flatnonzero(self.speed_steps == speed_threshold)
+                if not len(step):
+                    raise ValueError(f"Speed threshold {speed_threshold} is not one of the cube's speed steps")
+                jump = jump | (c["speed_step"].to_numpy() > step[0])
+            mask &= jump
+        if start_time is not None and end_time is not None:
+            minute = c["minute"].to_numpy()
+            mask &= (minute >= _minute_of_day(start_time)) & (minute <= _minute_of_day(end_time))
+        return mask
+
+    def summary(self, mask):
+        """
+        summarize_view's metrics for the cells selected by mask.
+        """
+        c = self.cells[mask]
+        events = c["events"].to_numpy()
+        return {
+            "Total Events": int(events.sum()),
+            "Anomalies Detected": int((events * c["anomaly"].to_numpy()).sum()),
+            "GPS Jumps": int(events[self._group("jump")[mask]].sum()),
+            "SIM Swap Events": int(events[self._group("swap")[mask]].sum()),
+            "Spoofing Detected": int(events[self._group("spoof")[mask]].sum()),
+            "Correlation Score > 3": int(events[c["corr_high"].to_numpy()].sum()),
+        }
+
+    def anomalies_by_type(self, mask):
+        """
+        Anomalous events per type, most first (columns Event Type, Count).
+        """
+        c = self.cells[mask & (self.cells["anomaly"].to_numpy() == 1) & (self.cells["type"].to_numpy() >= 0)]
+        counts = c.groupby("type")["events"].sum().sort_values(ascending=False, kind="stable")
+        return pd.DataFrame({
+            "Event Type": [self.types[i] for i in counts.index],
+            "Count": counts.to_numpy(),
+        })
+
+    def activity(self, mask, anomalies_only=False):
+        """
+        Events per (day, hour of day) for a heatmap (columns day, hour, events).
+        """
+        mask = mask & (self.cells["day"].to_numpy() >= 0)
+        if anomalies_only:
+            mask = mask & (self.cells["anomaly"].to_numpy() == 1)
+        c = self.cells[mask]
+        counts = c.groupby([c["day"], c["minute"] // 60])["events"].sum()
+        return pd.DataFrame({
+            "day": self.days[counts.index.get_level_values(0)],
+            "hour": counts.index.get_level_values(1),
+            "events": counts.to_numpy(),
+        })
@@ -0,0 +1,221 @@
+# tower_db.py
+
+import os
+import numpy as np
+import pandas as pd
+
+# Binary index layout (little endian):
+#   8 bytes  magic  b"DIFATWR1"
+#   8 bytes  uint64 number of towers (n)
+#   n * 8    uint64 packed keys, sorted ascending
+#   n * 4    float32 latitudes
+#   n * 4    float32 longitudes
+INDEX_MAGIC = b"DIFATWR1"
+HEADER_SIZE = 16
+
+DEFAULT_INDEX_PATH = os.environ.get("DIFA_TOWER_DB", os.path.join("data", "cell_towers.idx"))
+
+# Named demo cells from the original sample data, kept so old CDR exports
+# with free-text cell labels still resolve.
+LEGACY_CELL_NAMES = {
+    "DL001": (28.6139, 77.2090),  # Delhi
+    "MH007": (19.0760, 72.8777),  # Mumbai
+}
+
+# OpenCellID column names → our names
+OPENCELLID_COLUMNS = {"mcc": "mcc", "net": "mnc", "area": "lac", "cell": "cid", "lat": "lat", "lon": "lon"}
+
+
+# Packed key layout, most significant field first: (field, bits)
+KEY_FIELDS = [("mcc", 10), ("mnc", 10), ("lac", 16), ("cid", 28)]
+
+
+def packable(mcc, mnc, lac, cid):
+    """
+    Mask of rows whose MCC/MNC/LAC/CID are whole numbers that fit their
+    field of the packed key. Anything else (e.g. 5G TACs above 16 bits or
+    NR cell ids above 28 bits) would collide with another tower's key.
+    """
+    ok = None
+    for (_, bits), values in zip(KEY_FIELDS, (mcc, mnc, lac, cid)):
+        values = np.asarray(values, dtype=float)
+        with np.errstate(invalid="ignore"):
+            fits = (values >= 0) & (values < 2 ** bits) & (values == np.floor(values))
+        ok = fits if ok is None else ok & fits
+    return ok
+
+
+def pack_keys(mcc, mnc, lac, cid):
+    """
+    Pack MCC/MNC/LAC/CID arrays into one uint64 key per tower.
+    Bits: mcc 10 | mnc 10 | lac 16 | cid 28 (covers GSM/UMTS/LTE cell ids).
+    Raises ValueError if any row does not fit (see packable).
+    """
+    bad = ~packable(mcc, mnc, lac, cid)
+    if bad.any():
+        raise ValueError(f"{int(bad.sum())} tower id(s) out of range for the packed key")
+    key = np.zeros(len(bad), dtype=np.uint64)
+    for (_, bits), values in zip(KEY_FIELDS, (mcc, mnc, lac, cid)):
+        key = (key << np.uint64(bits)) | np.asarray(values, dtype=np.uint64)
+    return key
+
+
+def build_tower_index(csv_path, index_path=DEFAULT_INDEX_PATH, chunksize=1_000_000):
+    """
+    Build the binary tower index from an OpenCellID-style CSV.
+    Runs once per tower dump; the result is loaded memory-mapped afterwards.
+    Towers whose ids do not fit the packed key are left out rather than
+    indexed under a colliding key. Returns (towers indexed, towers skipped).
+    """
+    keys, lats, lons = [], [], []
+    skipped = 0
+    for chunk in pd.read_csv(csv_path, usecols=list(OPENCELLID_COLUMNS), chunksize=chunksize):
+        chunk = chunk.rename(columns=OPENCELLID_COLUMNS)
+        chunk = chunk.apply(pd.to_numeric, errors="coerce").dropna()
+        fits = packable(chunk["mcc"], chunk["mnc"], chunk["lac"], chunk["cid"])
+        skipped += int((~fits).sum())
+        chunk = chunk[fits]
+        keys.append(pack_keys(chunk["mcc"], chunk["mnc"], chunk["lac"], chunk["cid"]))
+        lats.append(chunk["lat"].to_numpy(np.float32))
+        lons.append(chunk["lon"].to_numpy(np.float32))
+
+    keys = np.concatenate(keys) if keys else np.empty(0, np.uint64)
+    lats = np.concatenate(lats) if lats else np.empty(0, np.float32)
+    lons = np.concatenate(lons) if lons else np.empty(0, np.float32)
+
+    # Sort by key; on duplicate keys the last row of the dump wins
+    order = np.argsort(keys, kind="stable")
+    keys, lats, lons = keys[order], lats[order], lons[order]
+    last = np.ones(len(keys), dtype=bool)
+    last[:-1] = keys[1:] != keys[:-1]
+    keys, lats, lons = keys[last], lats[last], lons[last]
+
+    os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+    with open(index_path, "wb") as f:
+        f.write(INDEX_MAGIC)
+        f.write(np.uint64(len(keys)).tobytes())
+        f.write(keys.astype("<u8").tobytes())
+        f.write(lats.astype("<f4").tobytes())
+        f.write(lons.astype("<f4").tobytes())
+    return len(keys), skipped
+
+
+class TowerDB:
+    """
+    Memory-mapped cell tower index. Loading only maps the file; lookups are
+    a vectorized binary search over the sorted key array.
+    """
+
+    def __init__(self, index_path=DEFAULT_INDEX_PATH):
+        self.path = index_path
+        with open(index_path, "rb") as f:
+            header = f.read(HEADER_SIZE)
+        if len(header) < HEADER_SIZE or header[:8] != INDEX_MAGIC:
+            raise ValueError(f"Not a tower index file: {index_path}")
+        n = int(np.frombuffer(header[8:], dtype="<u8")[0])
+
+        self.keys = np.memmap(index_path, dtype="<u8", mode="r", offset=HEADER_SIZE, shape=(n,)) if n else np.empty(0, "<u8")
+        self.lat = np.memmap(index_path, dtype="<f4", mode="r", offset=HEADER_SIZE + 8 * n, shape=(n,)) if n else np.empty(0, "<f4")
+        self.lon = np.memmap(index_path, dtype="<f4", mode="r", offset=HEADER_SIZE + 12 * n, shape=(n,)) if n else np.empty(0, "<f4")
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, keys):
+        """
+        Resolve an array of packed keys. Returns (lat, lon, found) arrays;
+        misses get NaN coordinates.
+        """
+        keys = np.asarray(keys, dtype=np.uint64)
+        lat = np.full(len(keys), np.nan)
+        lon = np.full(len(keys), np.nan)
+        if len(self.keys) == 0 or len(keys) == 0:
+            return lat, lon, np.zeros(len(keys), dtype=bool)
+
+        pos = np.searchsorted(self.keys, keys)
+        pos = np.minimum(pos, len(self.keys) - 1)
+        found = self.keys[pos] == keys
+        lat[found] = self.lat[pos[found]]
+        lon[found] = self.lon[pos[found]]
+        return lat, lon, found
+
+
+_tower_db_cache = {}
+
+
+def get_tower_db(index_path=DEFAULT_INDEX_PATH):
+    """
+    Shared TowerDB per index path, or None if no index has been built.
+    """
+    if index_path not in _tower_db_cache:
+        _tower_db_cache[index_path] = TowerDB(index_path) if os.path.exists(index_path) else None
+    return _tower_db_cache[index_path]
+
+
+def resolve_cdr_towers(cdr_df, tower_db=None):
+    """
+    Resolve CDR rows to tower coordinates in one pass over the whole column.
+
+    Rows carrying numeric mcc/mnc/lac/cell_id are looked up in the tower
+    index; free-text cell labels fall back to LEGACY_CELL_NAMES. Numeric
+    ids too large for the packed key cannot be in the index and count as
+    misses (stats["out_of_range"]).
+    Returns (lat, lon, stats).
+    """
+    n = len(cdr_df)
+    lat = np.full(n, np.nan)
+    lon = np.full(n, np.nan)
+    found = np.zeros(n, dtype=bool)
+
+    cell = cdr_df["cell_id"] if "cell_id" in cdr_df.columns else pd.Series([None] * n, index=cdr_df.index)
+
+    numeric = np.zeros(n, dtype=bool)
+    out_of_range = 0
+    if tower_db is not None and {"mcc", "mnc", "lac"}.issubset(cdr_df.columns):
+        parts = pd.DataFrame({
+            "mcc": pd.to_numeric(cdr_df["mcc"], errors="coerce"),
+            "mnc": pd.to_numeric(cdr_df["mnc"], errors="coerce"),
+            "lac": pd.to_numeric(cdr_df["lac"], errors="coerce"),
+            "cid": pd.to_numeric(cell, errors="coerce"),
+        })
+        numeric = parts.notna().all(axis=1).to_numpy()
+        fits = numeric & packable(parts["mcc"], parts["mnc"], parts["lac"], parts["cid"])
+        out_of_range = int(numeric.sum() - fits.sum())
+        if fits.any():
+            p = parts[fits]
+            keys = pack_keys(p["mcc"], p["mnc"], p["lac"], p["cid"])
+            lat[fits], lon[fits], found[fits] = tower_db.lookup(keys)
+
+    # Legacy named cells: map unique labels once, then broadcast
+    named = ~numeric & cell.notna().to_numpy()
+    if named.any():
+        codes, uniques = pd.factorize(cell[named].astype(str))
+        coords = np.array([LEGACY_CELL_NAMES.get(u, (np.nan, np.nan)) for u in uniques], dtype=float).reshape(-1, 2)
+        lat[named] = coords[codes, 0]
+        lon[named] = coords[codes, 1]
+        found[named] = ~np.isnan(lat[named])
+
+    stats = {
+        "index": tower_db.path if tower_db is not None else None,
+        "towers_indexed": len(tower_db) if tower_db is not None else 0,
+        "cdr_rows": int(n),
+        "hits": int(found.sum()),
+        "misses": int(n - found.sum()),
+        "out_of_range": out_of_range,
+        "hit_rate": round(float(found.mean()), 4) if n else 0.0,
+    }
+    return lat, lon, stats
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 2:
+        print("Usage: python tower_db.py <cell_towers.csv> [index_path]")
+        sys.exit(1)
+
+    out_path = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_INDEX_PATH
+    count, skipped = build_tower_index(sys.argv[1], out_path)
+    print(f"Indexed {count} towers → {out_path}")
+    if skipped:
+        print(f"Skipped {skipped} towers with ids too large for the index key")
@@ -1,51 +1,77 @@
+import re
 import pandas as pd
+import numpy as np
 from sklearn.ensemble import IsolationForest
 from sklearn.preprocessing import StandardScaler
 from android_feature_extractor import parse_logs, extract_features
-from utils import haversine
+from utils import haversine_np, COORD_DECIMALS
+from domain_matcher import get_domain_matcher
+from perf_trace import span
+from kinematics import add_kinematics, kinematics
+from anomaly_flags import (
+    FLAGS_DTYPE, FLAG_GROUPS, ML_ANOMALY, ML_MOVEMENT, SIM_SPOOF_JUMP, GPS_IP_CONFLICT,
+    IP_HOPS, TOR_SERVICE, MALWARE_DOMAIN, THREAT_DOMAIN, UNREALISTIC_SPEED,
+    get_flags, has_any, render_notes,
+)
 
 # 1️⃣ GPS-only training
 def train_gps_only_model(gps_df):
-    gps_df["timestamp"] = pd.to_datetime(gps_df["timestamp"])
-    gps_df["type"] = "gps"
+    with span("build_timeline", rows=len(gps_df)):
+        gps_df["timestamp"] = pd.to_datetime(gps_df["timestamp"])
+        gps_df["type"] = "gps"
+        timeline_df = gps_df.sort_values("timestamp").reset_index(drop=True)
 
-    timeline_df = gps_df.sort_values("timestamp").reset_index(drop=True)
-    features_df = extract_features(timeline_df)
+    with span("kinematics", rows=len(timeline_df)):
+        add_kinematics(timeline_df)
 
-    model = IsolationForest(contamination=0.05, random_state=42)
-    model.fit(features_df)
+    with span("extract_features", rows=len(timeline_df)):
+        features_df = extract_features(timeline_df)
 
-    preds = model.predict(features_df)
+    with span("model_fit", rows=len(features_df), model="isolation_forest"):
+        model = IsolationForest(contamination=0.05, random_state=42)
+        model.fit(features_df)
+
+    with span("model_score", rows=len(features_df)):
+        preds = model.predict(features_df)
     timeline_df["anomaly"] = (preds == -1).astype(int)
-    timeline_df["notes"] = timeline_df["anomaly"].apply(lambda x: "⚠️ Unrealistic movement" if x == 1 else "")
+    timeline_df["flags"] = np.where(timeline_df["anomaly"] == 1, ML_MOVEMENT, 0).astype(FLAGS_DTYPE)
 
     return model, None, timeline_df, features_df, []  # Return empty alerts
 
 
 # 2️⃣ Full-model with GPS + IPDR + CDR
 def train_full_model(gps_df, ipdr_df, cdr_df,gps_threshold_km=100, max_gap_secs=900, speed_threshold=500):
-    gps_df["timestamp"] = pd.to_datetime(gps_df["timestamp"])
-    ipdr_df["timestamp"] = pd.to_datetime(ipdr_df["timestamp"])
-    cdr_df["timestamp"] = pd.to_datetime(cdr_df["timestamp"])
+    with span("parse_logs", rows=len(gps_df) + len(ipdr_df) + len(cdr_df)):
+        gps_df["timestamp"] = pd.to_datetime(gps_df["timestamp"])
+        ipdr_df["timestamp"] = pd.to_datetime(ipdr_df["timestamp"])
+        cdr_df["timestamp"] = pd.to_datetime(cdr_df["timestamp"])
+        timeline_df = parse_logs(gps_df, ipdr_df, cdr_df)
+
+    with span("kinematics", rows=len(timeline_df)):
+        add_kinematics(timeline_df)
 
-    timeline_df = parse_logs(gps_df, ipdr_df, cdr_df)
-    features_df = extract_features(timeline_df)
+    with span("extract_features", rows=len(timeline_df)):
+        features_df = extract_features(timeline_df)
 
-    model = IsolationForest(contamination=0.1, random_state=42)
-    model.fit(features_df)
+    with span("model_fit", rows=len(features_df), model="isolation_forest"):
+        model = IsolationForest(contamination=0.1, random_state=42)
+        model.fit(features_df)
 
-    preds = model.predict(features_df)
+    with span("model_score", rows=len(features_df)):
+        preds = model.predict(features_df)
     timeline_df["anomaly"] = (preds == -1).astype(int)
-    timeline_df["notes"] = timeline_df["anomaly"].apply(lambda x: "⚠️ Anomaly detected" if x == 1 else "")
+    timeline_df["flags"] = np.where(timeline_df["anomaly"] == 1, ML_ANOMALY, 0).astype(FLAGS_DTYPE)
 
     # 🚨 Apply rule-based detection
     from train_model import detect_spoofing_and_sim_swap
       # 🚨 Pass rule tuning params here
-    timeline_df, rule_alerts = detect_spoofing_and_sim_swap(
-        timeline_df,
-        gps_threshold_km=gps_threshold_km,
-        max_gap_secs=max_gap_secs,
-    )
+    with span("rules", rows=len(timeline_df)) as s:
+        timeline_df, rule_alerts = detect_spoofing_and_sim_swap(
+            timeline_df,
+            gps_threshold_km=gps_threshold_km,
+            max_gap_secs=max_gap_secs,
+        )
+        s.meta["alerts"] = len(rule_alerts)
 
     return model, None, timeline_df, features_df, rule_alerts
 
@@ -67,144 +93,164 @@ def train_anomaly_model(gps_df, ipdr_df=None, cdr_df=None,gps_threshold_km=100,
 
 
 # 🧾 Table formatter
-def format_output_table(timeline_df):
-    from utils import haversine
-    import re
-
-    last = None
-    timeline_df["Time"] = pd.to_datetime(timeline_df["timestamp"]).dt.strftime("%H:%M")
-    timeline_df["duration"] = "—"
-    timeline_df["speed_kmph"] = "—"
-
-    if "anomaly" not in timeline_df.columns:
-        timeline_df["anomaly"] = 0
-
-    timeline_df["notes"] = timeline_df.get("notes", "").fillna("").astype(str)
-    timeline_df["lat"] = pd.to_numeric(timeline_df.get("lat", None), errors='coerce')
-    timeline_df["lon"] = pd.to_numeric(timeline_df.get("lon", None), errors='coerce')
-    timeline_df["type"] = timeline_df.get("type", "unknown").astype(str).str.upper()
-    timeline_df["domain"] = timeline_df.get("domain", pd.Series(["—"] * len(timeline_df))).fillna("—")
-    timeline_df["correlation_score"] = (
-        timeline_df["anomaly"].fillna(0)
-        + timeline_df["notes"].str.contains("spoof", na=False).astype(int)
-        + timeline_df["notes"].str.contains("jump", na=False).astype(int)
-        + timeline_df["domain"].str.contains("vpn|tor|telegram", case=False, na=False).astype(int)
-        if "domain" in timeline_df.columns else 0
+_HHMM = np.array([f"{m // 60:02d}:{m % 60:02d}" for m in range(1440)], dtype=object)
+
+
+def _format_notes(notes):
+    """
+    "a | 2. b" → "1. a\n2. b"; empty → "1. Normal".
+    """
+    notes = notes.strip()
+    if notes == "":
+        notes = "Normal"
+    note_list = [re.sub(r'^\d+\.\s*', '', n.strip()) for n in notes.split("|") if n.strip()]
+    return "\n".join([f"{j+1}. {n}" for j, n in enumerate(note_list)])
+
+
+def format_output_table(timeline_df, rows=None, speed_threshold=500):
+    """
+    Build the display table for timeline_df without modifying it.
+
+    rows: optional slice or array of row positions to format (e.g. one page).
+    Duration/speed come from the timeline's kinematics columns, i.e. they are
+    measured against the previous event of the full timeline.
+    """
+    n = len(timeline_df)
+    if rows is None:
+        pos = np.arange(n)
+    elif isinstance(rows, slice):
+        pos = np.arange(n)[rows]
+    else:
+        pos = np.asarray(rows, dtype=np.int64)
+
+    out = timeline_df.iloc[pos].copy()
+    if "anomaly" not in out.columns:
+        out["anomaly"] = 0
+    out["anomaly"] = out["anomaly"].fillna(0).astype(int)
+
+    lat = pd.to_numeric(timeline_df["lat"], errors="coerce").to_numpy() if "lat" in timeline_df.columns else np.full(n, np.nan)
+    lon = pd.to_numeric(timeline_df["lon"], errors="coerce").to_numpy() if "lon" in timeline_df.columns else np.full(n, np.nan)
+
+    # HH:MM via a 1440-entry lookup instead of strftime per row
+    sel_ts = pd.to_datetime(timeline_df["timestamp"].iloc[pos], errors="coerce")
+    minute_of_day = (sel_ts.dt.hour * 60 + sel_ts.dt.minute).fillna(-1).astype(int).to_numpy()
+    out["Time"] = np.where(minute_of_day >= 0, _HHMM[minute_of_day], None)
+    out["lat"] = np.round(lat[pos].astype(float), COORD_DECIMALS)
+    out["lon"] = np.round(lon[pos].astype(float), COORD_DECIMALS)
+    out["type"] = (out["type"] if "type" in out.columns else pd.Series("unknown", index=out.index)).astype(str).str.upper()
+    out["domain"] = (out["domain"] if "domain" in out.columns else pd.Series("—", index=out.index)).astype(object).fillna("—")
+    flags = get_flags(out)
+
+    # Duration + Speed from the shared kinematics stage
+    kin = kinematics(timeline_df)
+    duration = kin["delta_sec"].to_numpy()[pos]
+    speed = kin["speed_kmph"].to_numpy()[pos]
+    valid = ~np.isnan(kin["dist_km"].to_numpy()[pos])
+
+    duration_txt = np.full(len(pos), "—", dtype=object)
+    speed_txt = np.full(len(pos), "—", dtype=object)
+    duration_txt[valid] = [f"{int(d)}s" for d in duration[valid]]
+    speed_txt[valid] = [f"{v:.2f}" for v in speed[valid]]
+    out["duration"] = duration_txt
+    out["speed_kmph"] = speed_txt
+
+    suspicious = get_domain_matcher().flag_column(out["domain"], "suspicious")
+    out["correlation_score"] = (
+        out["anomaly"].to_numpy()
+        + has_any(flags, FLAG_GROUPS["spoof"]).astype(int)
+        + has_any(flags, FLAG_GROUPS["jump"]).astype(int)
+        + suspicious.astype(int)
     )
 
-    for i, row in timeline_df.iterrows():
-        notes = row.get("notes", "").strip()
-
-        # Duration + Speed logic
-        if last is not None and pd.notna(row["lat"]) and pd.notna(last["lat"]):
-            duration = (row["timestamp"] - last["timestamp"]).total_seconds()
-            dist = haversine(row["lat"], row["lon"], last["lat"], last["lon"])
-            speed = (dist / (duration / 3600)) if duration > 0 else 0
-
-            timeline_df.at[i, "duration"] = f"{int(duration)}s"
-            timeline_df.at[i, "speed_kmph"] = f"{speed:.2f}"
-
-            if speed > 500:
-                extra_note = "⚠️ Unrealistic speed"
-                if extra_note not in notes:
-                    notes += " | " + extra_note
-                timeline_df.at[i, 'anomaly'] = 1
-
-        if notes.strip() == "":
-            notes = "Normal"
-
-        # Clean & format
-        note_list = [re.sub(r'^\d+\.\s*', '', n.strip()) for n in notes.split("|") if n.strip()]
-        formatted_notes = "\n".join([f"{j+1}. {n}" for j, n in enumerate(note_list)])
-        timeline_df.at[i, "notes"] = formatted_notes
-
-        last = row
+    fast = valid & (speed > speed_threshold)
+    flags[fast] |= UNREALISTIC_SPEED
+    out.loc[fast, "anomaly"] = 1
+    out["flags"] = flags
+
+    # Render reason codes to text, keeping any free-text notes from the input
+    notes = render_notes(flags)
+    if "notes" in out.columns:
+        extra = out["notes"].fillna("").astype(str).str.strip().to_numpy()
+        notes = np.where(extra != "", extra + " | " + notes, notes)
+
+    # Clean & format once per distinct note string
+    codes, uniques = pd.factorize(notes)
+    formatted = np.array([_format_notes(u) for u in uniques], dtype=object)
+    out["notes"] = formatted[codes] if len(uniques) else notes
+
+    return out
+
+
+# 📍 Nearest-in-time GPS fix for every IPDR/CDR event
+def nearest_gps_distance(timeline_df, max_gap_secs=900):
+    """
+    Pair each IPDR/CDR row with its closest GPS fix (before or after)
+    within max_gap_secs and return the distance in km, aligned to
+    timeline_df rows. Rows without a fix in range get NaN.
+    """
+    dist = np.full(len(timeline_df), np.nan)
+    if timeline_df.empty:
+        return dist
+
+    ts = pd.to_datetime(timeline_df["timestamp"], errors="coerce")
+    lat = pd.to_numeric(timeline_df["lat"], errors="coerce")
+    lon = pd.to_numeric(timeline_df["lon"], errors="coerce")
+    is_gps = (timeline_df["type"] == "gps") & lat.notna() & ts.notna()
+    is_event = timeline_df["type"].isin(["ipdr", "cdr"]) & ts.notna()
+    if not is_gps.any() or not is_event.any():
+        return dist
+
+    events = pd.DataFrame({
+        "pos": np.flatnonzero(is_event.to_numpy()),
+        "timestamp": ts[is_event].to_numpy(),
+    }).sort_values("timestamp", kind="stable")
+    fixes = pd.DataFrame({
+        "timestamp": ts[is_gps].to_numpy(),
+        "gps_lat": lat[is_gps].to_numpy(),
+        "gps_lon": lon[is_gps].to_numpy(),
+    }).sort_values("timestamp", kind="stable")
+
+    joined = pd.merge_asof(
+        events, fixes, on="timestamp",
+        direction="nearest",
+        tolerance=pd.Timedelta(seconds=max_gap_secs),
+    )
 
-    return timeline_df
+    pos = joined["pos"].to_numpy()
+    dist[pos] = haversine_np(
+        lat.to_numpy()[pos], lon.to_numpy()[pos],
+        joined["gps_lat"].to_numpy(), joined["gps_lon"].to_numpy(),
+    )
+    return dist
 
 
 # 🧠 Rule-based anomaly detection
+# Alert text per rule bit (formatted with domain / category where used)
+RULE_ALERTS = {
+    SIM_SPOOF_JUMP: "SIM Spoof: IP/CDR jump >100km with no GPS",
+    GPS_IP_CONFLICT: "GPS-IP/CDR mismatch ➜ Possible spoof/SIM misuse",
+    IP_HOPS: "Multiple IPDR tower hops in short time",
+    TOR_SERVICE: "TOR Hidden Service accessed",
+    MALWARE_DOMAIN: "Malware Domain Detected: {domain}",
+    THREAT_DOMAIN: "Threat-intel {category} domain: {domain}",
+}
+
 def detect_spoofing_and_sim_swap(timeline_df, gps_threshold_km=100, max_gap_secs=900):
-    alerts = []
-    last_gps = None
+    """
+    Rules 1-4 (CDR/IP jumps without GPS, GPS vs IP/CDR mismatch, IPDR
+    tower hops, threat-intel domains) over a time-ordered timeline.
+    Sets `anomaly` and `flags` in place; returns (timeline_df, alerts).
+    """
+    # Mask-based evaluation in one pass (the streaming evaluator fed the
+    # whole frame at once); imported lazily, it imports RULE_ALERTS from here
+    from streaming_rules import evaluate_rules
 
     timeline_df['timestamp'] = pd.to_datetime(timeline_df['timestamp'], errors='coerce')
     if 'anomaly' not in timeline_df.columns:
         timeline_df['anomaly'] = 0
-    if 'notes' not in timeline_df.columns:
-        timeline_df['notes'] = ""
-
-    MALICIOUS_DOMAINS = {
-        "malicious.com", "cnc.badsite.net", "spyapp.io", "stealer.org", "malware.fake"
-    }
-
-    for i in range(1, len(timeline_df)):
-        curr = timeline_df.iloc[i]
-        prev = timeline_df.iloc[i - 1]
-        time_diff = (curr['timestamp'] - prev['timestamp']).total_seconds()
-        notes = str(curr.get("notes", "")).strip()
-
-        # Rule 1: CDR/IPDR jump > 100km with no GPS
-        if curr['type'] in ['ipdr', 'cdr'] and prev['type'] in ['ipdr', 'cdr']:
-            if pd.notna(curr["lat"]) and pd.notna(prev["lat"]):
-                dist = haversine(curr["lat"], curr["lon"], prev["lat"], prev["lon"])
-                gps_between = timeline_df[
-                    (timeline_df['type'] == 'gps') &
-                    (timeline_df['timestamp'] > prev['timestamp']) &
-                    (timeline_df['timestamp'] < curr['timestamp'])
-                ]
-                if dist > gps_threshold_km and gps_between.empty:
-                    if "SIM Spoof: CDR/IP jump without GPS" not in notes:
-                        notes += " | ⚠️ SIM Spoof: CDR/IP jump without GPS"
-                        alerts.append((curr['timestamp'], "SIM Spoof: IP/CDR jump >100km with no GPS"))
-                    timeline_df.at[i, 'anomaly'] = 1
-
-        # Rule 2: GPS vs IP/CDR mismatch
-        if curr['type'] in ['ipdr', 'cdr'] and last_gps is not None:
-            gps_time_diff = abs((curr['timestamp'] - last_gps['timestamp']).total_seconds())
-            gps_dist = haversine(curr.get("lat", 0), curr.get("lon", 0), last_gps['lat'], last_gps['lon'])
-            if gps_time_diff <= max_gap_secs and gps_dist > gps_threshold_km:
-                if "GPS-IP conflict → SIM spoof" not in notes:
-                    notes += " | ⚠️ GPS-IP conflict → SIM spoof"
-                    alerts.append((curr['timestamp'], "GPS-IP/CDR mismatch ➜ Possible spoof/SIM misuse"))
-                timeline_df.at[i, 'anomaly'] = 1
-
-        # Rule 3: Tower hops (IPDRs < 5min apart and far apart)
-        if curr['type'] == 'ipdr' and prev['type'] == 'ipdr':
-            if time_diff < 300 and pd.notna(curr["lat"]) and pd.notna(prev["lat"]):
-                dist = haversine(curr["lat"], curr["lon"], prev["lat"], prev["lon"])
-                if dist > 50:
-                    if "Multiple IP hops" not in notes:
-                        notes += " | ⚠️ Multiple IP hops"
-                        alerts.append((curr['timestamp'], "Multiple IPDR tower hops in short time"))
-                    timeline_df.at[i, 'anomaly'] = 1
-
-        # Rule 4: Malicious domains or .onion
-        domain = str(curr.get("domain", "")).lower()
-        if curr["type"] == "ipdr":
-            if ".onion" in domain:
-                if "TOR Hidden Service" not in notes:
-                    notes += " | ⚠️ TOR Hidden Service"
-                    alerts.append((curr['timestamp'], "TOR Hidden Service accessed"))
-                timeline_df.at[i, 'anomaly'] = 1
-            elif domain in MALICIOUS_DOMAINS:
-                if "Malware Domain" not in notes:
-                    notes += " | ⚠️ Malware Domain"
-                    alerts.append((curr['timestamp'], f"Malware Domain Detected: {domain}"))
-                timeline_df.at[i, 'anomaly'] = 1
-
-        timeline_df.at[i, "notes"] = notes.strip(" |")
-
-        if curr["type"] == "gps" and pd.notna(curr.get("lat")):
-            last_gps = curr
-
-    return timeline_df, alerts
-
-
-
-
-
-
-
+    rows, alerts = evaluate_rules(timeline_df, gps_threshold_km=gps_threshold_km, max_gap_secs=max_gap_secs)
 
+    timeline_df['anomaly'] = rows['anomaly'].to_numpy().astype(int)
+    timeline_df['flags'] = rows['flags'].to_numpy().astype(FLAGS_DTYPE)
 
+    return timeline_df, alerts
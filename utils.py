@@ -7,9 +7,11 @@ import sqlite3
 import json
 import xml.etree.ElementTree as ET
 import pandas as pd
+import numpy as np
 import folium
 import pandas as pd
 from folium.plugins import TimestampedGeoJson
+from gps_dedup import dedup_gps, DEFAULT_TIME_BUCKET_SECS, DEFAULT_COORD_DECIMALS
 import streamlit as st
 from datetime import timedelta
 
@@ -45,6 +47,23 @@ def haversine(lat1, lon1, lat2, lon2):
     return R * c  # in kilometers
 
 
+def haversine_np(lat1, lon1, lat2, lon2):
+    """
+    Vectorized haversine over numpy arrays / Series. NaN in → NaN out.
+    """
+    R = 6371.0
+
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(x, dtype=float)) for x in (lat1, lon1, lat2, lon2))
+
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+
+    a = np.sin(dlat / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2)**2
+    c = 2 * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+    return R * c  # in kilometers
+
+
 def time_diff_seconds(t1, t2):
     return abs((t1 - t2).total_seconds())
 
@@ -52,18 +71,53 @@ def time_diff_seconds(t1, t2):
 
 import pandas as pd
 
+# Compact dtype per standard column, applied after renaming
+COLUMN_SCHEMA = {
+    "timestamp": "datetime",
+    "lat": "coord",
+    "lon": "coord",
+    "type": "category",
+    "app": "category",
+    "domain": "category",
+    "call_type": "category",
+    "contact": "category",
+    "upload": "integer",
+    "download": "integer",
+    "duration": "integer",
+    "session_duration": "integer",
+    "mcc": "integer",
+    "mnc": "integer",
+    "lac": "integer",
+    "cell_id": "integer",
+}
+COORD_LIMITS = {"lat": 90.0, "lon": 180.0}
+# float32 keeps ~7 significant digits; coordinates are shown/exported at this many decimals
+COORD_DECIMALS = 6
+
+
 def normalize_columns(df, type="generic"):
     """
     Generic column normalization dispatcher for GPS, CDR, IPDR.
+    Memory before/after lands in attrs["normalization"].
     """
+    before = int(df.memory_usage(deep=True).sum())
     if type == "ipdr":
-        return normalize_ipdr(df)
+        out = normalize_ipdr(df)
     elif type == "cdr":
-        return normalize_cdr(df)
+        out = normalize_cdr(df)
     elif type == "gps":
-        return normalize_gps(df)
+        out = normalize_gps(df)
     else:
         return df
+    after = int(out.memory_usage(deep=True).sum())
+    out.attrs["normalization"] = {
+        "rows": len(out),
+        "before_mb": round(before / 2**20, 2),
+        "after_mb": round(after / 2**20, 2),
+        "ratio": round(before / after, 2) if after else 0.0,
+        "invalid_coords": out.attrs.pop("invalid_coords", 0),
+    }
+    return out
 
 
 def normalize_ipdr(df):
@@ -115,6 +169,24 @@ def normalize_gps(df):
     return df
 
 
+def _compact(series, kind):
+    # One column cast to its COLUMN_SCHEMA kind; returns (series, invalid count)
+    if kind == "datetime":
+        return pd.to_datetime(series, errors="coerce").dt.as_unit("ns"), 0
+    if kind == "category":
+        return series.astype("category"), 0
+    values = pd.to_numeric(series, errors="coerce")
+    if kind == "coord":
+        limit = COORD_LIMITS[series.name]
+        bad = values.abs() > limit
+        return values.mask(bad).astype(np.float32), int(bad.sum())
+    # integer: smallest type that holds it if whole and complete; text
+    # (e.g. legacy cell names) is left alone
+    if len(values) and values.notna().all() and (values % 1 == 0).all():
+        return pd.to_numeric(values, downcast="unsigned" if (values >= 0).all() else "integer"), 0
+    return (values if values.notna().sum() == series.notna().sum() else series), 0
+
+
 def _rename_and_patch(df, column_map, required):
     # Rename known variants to standard names
     df = df.rename(columns={col: column_map.get(col.lower(), col) for col in df.columns})
@@ -122,11 +194,15 @@ def _rename_and_patch(df, column_map, required):
     # Ensure all required columns exist
     for col in required:
         if col not in df.columns:
-            df[col] = None
+            df[col] = np.nan if COLUMN_SCHEMA.get(col) == "coord" else None
 
-    # Parse timestamp column
-    if "timestamp" in df.columns:
-        df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
+    # Compact dtypes; out-of-range coordinates become NaN
+    invalid = 0
+    for col, kind in COLUMN_SCHEMA.items():
+        if col in df.columns:
+            df[col], bad = _compact(df[col], kind)
+            invalid += bad
+    df.attrs["invalid_coords"] = invalid
 
     return df
 
@@ -137,92 +213,163 @@ def check_required(df, cols, label):
         st.warning(f"⚠️ Missing in {label}: {', '.join(missing)}")
 
 
-def extract_gps_from_android_image(image_dir):
+def _gps_frame(entries):
+    df = pd.DataFrame(entries, columns=["timestamp", "lat", "lon", "source"])
+    ts = pd.to_datetime(df["timestamp"], errors="coerce", utc=True)
+    df["timestamp"] = ts.dt.tz_convert(None)  # naive UTC, comparable across sources
+    return df
+
+
+def parse_location_db(path):
+    gps_entries = []
+    file = os.path.basename(path)
+    try:
+        conn = sqlite3.connect(path)
+        cursor = conn.cursor()
+        tables = [r[0] for r in cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+        for table in tables:
+            try:
+                rows = cursor.execute(f"SELECT * FROM {table}").fetchall()
+                cols = [desc[0] for desc in cursor.description]
+                if {'latitude', 'longitude', 'timestamp'}.issubset(set(cols)):
+                    t = pd.DataFrame(rows, columns=cols)
+                    gps_entries.append(pd.DataFrame({
+                        "timestamp": pd.to_datetime(pd.to_numeric(t["timestamp"], errors="coerce"), unit="s", errors='coerce'),
+                        "lat": t["latitude"],
+                        "lon": t["longitude"],
+                        "source": file
+                    }))
+            except:
+                continue
+        conn.close()
+    except:
+        pass
+    if not gps_entries:
+        return _gps_frame([])
+    return _gps_frame(pd.concat(gps_entries, ignore_index=True))
+
+
+def parse_location_json(path):
     gps_entries = []
+    file = os.path.basename(path)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+            for loc in data.get("locations", []):
+                gps_entries.append({
+                    "timestamp": pd.to_datetime(int(loc.get("timestampMs", 0)) // 1000, unit='s'),
+                    "lat": loc.get("latitudeE7", 0) / 1e7,
+                    "lon": loc.get("longitudeE7", 0) / 1e7,
+                    "source": file
+                })
+    except:
+        pass
+    return _gps_frame(gps_entries)
+
+
+def parse_gpx(path):
+    gps_entries = []
+    file = os.path.basename(path)
+    try:
+        tree = ET.parse(path)
+        root_xml = tree.getroot()
+        ns = {'default': 'http://www.topografix.com/GPX/1/1'}
+        for trkpt in root_xml.findall(".//default:trkpt", ns):
+            lat = float(trkpt.attrib["lat"])
+            lon = float(trkpt.attrib["lon"])
+            time_tag = trkpt.find("default:time", ns)
+            timestamp = time_tag.text if time_tag is not None else None
+            gps_entries.append({
+                "timestamp": timestamp,
+                "lat": lat,
+                "lon": lon,
+                "source": file
+            })
+    except:
+        pass
+    return _gps_frame(gps_entries)
+
+
+def gps_parser_for(file):
+    """
+    Parser for a file inside a logical image, or None if it carries no GPS.
+    """
+    name = file.lower()
+    if name in ["location.db", "networklocation.db"]:
+        return parse_location_db
+    if file.endswith(".json") and "location" in name:
+        return parse_location_json
+    if file.endswith(".gpx") or file.endswith(".xml"):
+        return parse_gpx
+    return None
+
+
+def extract_gps_from_android_image(image_dir, use_cache=True, dedup=True,
+                                   time_bucket_secs=DEFAULT_TIME_BUCKET_SECS, coord_decimals=DEFAULT_COORD_DECIMALS):
+    """
+    GPS fixes from location DBs, Google location JSON and GPX/XML files in a
+    logical image. With use_cache, only new or changed files are parsed;
+    the rest come from the per-file extraction cache. With dedup, fixes
+    reported by several sources (or repeated) are merged (see gps_dedup).
+    """
+    cache = None
+    if use_cache:
+        from extraction_cache import ExtractionCache
+        cache = ExtractionCache(image_dir)
 
-    # SQLite DBs
-    for root, _, files in os.walk(image_dir):
-        for file in files:
-            if file.lower() in ["location.db", "networklocation.db"]:
-                try:
-                    conn = sqlite3.connect(os.path.join(root, file))
-                    cursor = conn.cursor()
-                    tables = [r[0] for r in cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")]
-                    for table in tables:
-                        try:
-                            rows = cursor.execute(f"SELECT * FROM {table}").fetchall()
-                            cols = [desc[0] for desc in cursor.description]
-                            if {'latitude', 'longitude', 'timestamp'}.issubset(set(cols)):
-                                for row in rows:
-                                    r = dict(zip(cols, row))
-                                    gps_entries.append({
-                                        "timestamp": pd.to_datetime(r["timestamp"], unit="s", errors='coerce'),
-                                        "lat": r["latitude"],
-                                        "lon": r["longitude"],
-                                        "source": file
-                                    })
-                        except:
-                            continue
-                    conn.close()
-                except:
-                    continue
-
-    # Google JSON
-    for root, _, files in os.walk(image_dir):
-        for file in files:
-            if file.endswith(".json") and "location" in file.lower():
-                try:
-                    with open(os.path.join(root, file), "r", encoding="utf-8") as f:
-                        data = json.load(f)
-                        for loc in data.get("locations", []):
-                            gps_entries.append({
-                                "timestamp": pd.to_datetime(int(loc.get("timestampMs", 0)) // 1000, unit='s'),
-                                "lat": loc.get("latitudeE7", 0) / 1e7,
-                                "lon": loc.get("longitudeE7", 0) / 1e7,
-                                "source": file
-                            })
-                except:
-                    continue
-
-    # GPX/XML
+    frames = []
     for root, _, files in os.walk(image_dir):
-        for file in files:
-            if file.endswith(".gpx") or file.endswith(".xml"):
-                try:
-                    tree = ET.parse(os.path.join(root, file))
-                    root_xml = tree.getroot()
-                    ns = {'default': 'http://www.topografix.com/GPX/1/1'}
-                    for trkpt in root_xml.findall(".//default:trkpt", ns):
-                        lat = float(trkpt.attrib["lat"])
-                        lon = float(trkpt.attrib["lon"])
-                        time_tag = trkpt.find("default:time", ns)
-                        timestamp = pd.to_datetime(time_tag.text) if time_tag is not None else None
-                        gps_entries.append({
-                            "timestamp": timestamp,
-                            "lat": lat,
-                            "lon": lon,
-                            "source": file
-                        })
-                except:
-                    continue
-
-    if gps_entries:
-        df = pd.DataFrame(gps_entries)
+        for file in sorted(files):
+            parser = gps_parser_for(file)
+            if parser is None:
+                continue
+            path = os.path.join(root, file)
+            relpath = os.path.relpath(path, image_dir)
+            try:
+                frames.append(cache.get_or_parse(relpath, path, parser) if cache else parser(path))
+            except OSError:
+                continue
+
+    if cache is not None:
+        cache.save()
+
+    frames = [f for f in frames if not f.empty]
+    if frames:
+        df = pd.concat(frames, ignore_index=True)
+        df["timestamp"] = df["timestamp"].astype("datetime64[ns]")
         df = df.dropna(subset=["timestamp", "lat", "lon"])
-        df = df.sort_values("timestamp").reset_index(drop=True)
+        df = df.sort_values("timestamp", kind="stable").reset_index(drop=True)
+        df.attrs["extraction"] = cache.stats if cache is not None else {"parsed": len(frames), "cached": 0}
+        if dedup:
+            df = dedup_gps(df, time_bucket_secs=time_bucket_secs, coord_decimals=coord_decimals)
         return df
     return pd.DataFrame()
 
 import hashlib
 
-def compute_file_hash(uploaded_file):
+HASH_CHUNK_SIZE = 1024 * 1024  # 1 MiB
+
+
+def compute_file_hash(uploaded_file, chunk_size=HASH_CHUNK_SIZE):
+    """
+    SHA-256 of an uploaded/open file or a path, read in fixed-size chunks
+    so large evidence never has to fit in memory at once.
+    """
     hasher = hashlib.sha256()
+    if isinstance(uploaded_file, (str, os.PathLike)):
+        with open(uploaded_file, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
     # Check if file-like or raw file object
     if hasattr(uploaded_file, "chunks"):
         for chunk in uploaded_file.chunks():
             hasher.update(chunk)
     else:
-        hasher.update(uploaded_file.read())
+        uploaded_file.seek(0)
+        for chunk in iter(lambda: uploaded_file.read(chunk_size), b""):
+            hasher.update(chunk)
     uploaded_file.seek(0)  # Reset file pointer after reading
     return hasher.hexdigest()
 
@@ -243,7 +390,7 @@ def convert_for_json(obj):
 import streamlit as st
 import json
 
-def display_forensic_report(report: dict):
+def display_forensic_report(report: dict, top_n=100, export_path=None):
     st.markdown("### 📑 Forensic Report Summary")
 
     # Section: Metadata
@@ -253,29 +400,39 @@ def display_forensic_report(report: dict):
             "Parameters": report.get("parameters", {})
         })
 
-    # Section: Summary Table
+    # Section: Summary Table (top-N rows only)
     summary = report.get("summary", [])
-    if not summary:
+    if summary is None or len(summary) == 0:
         st.info("No events in report.")
         return
 
-    summary_df = pd.DataFrame(summary)
+    summary_df = pd.DataFrame(summary[:top_n] if isinstance(summary, list) else summary.head(top_n))
     summary_df["timestamp"] = pd.to_datetime(summary_df["timestamp"], errors='coerce')
     summary_df = summary_df.sort_values("timestamp")
+    if "notes" not in summary_df.columns:
+        from anomaly_flags import get_flags, render_notes
+        summary_df["notes"] = render_notes(get_flags(summary_df))
 
     st.dataframe(summary_df[["timestamp", "type", "anomaly", "notes"]], use_container_width=True)
+    if len(summary) > top_n:
+        st.caption(f"Showing {top_n} of {len(summary)} events. Export the report for the full list.")
+
+    # Optional JSON view: metadata and the rows shown above, never the full event list
+    with st.expander("🧾 Report Preview (JSON)", expanded=False):
+        preview = {k: v for k, v in report.items() if k != "summary"}
+        preview["summary"] = convert_for_json(summary_df.to_dict(orient="records"))
+        st.code(json.dumps(preview, indent=2, default=str), language="json")
+
+    # Download the exported file from disk when one exists
+    if export_path and os.path.exists(export_path):
+        with open(export_path, "rb") as f:
+            st.download_button(
+                "⬇️ Download Report",
+                data=f,
+                file_name=os.path.basename(export_path),
+            )
+
 
-    # Optional JSON view
-    with st.expander("🧾 Full Report (Raw JSON)", expanded=False):
-        st.code(json.dumps(report, indent=2), language="json")
-
-    # Download button
-    st.download_button(
-        "⬇️ Download Report",
-        data=json.dumps(report, indent=2),
-        file_name="forensic_report.json",
-        mime="application/json"
-    )
 from fpdf import FPDF
 import matplotlib.pyplot as plt
 import pandas as pd
@@ -295,15 +452,28 @@ from reportlab.pdfgen import canvas
 from datetime import datetime
 import os
 
-def generate_forensic_pdf_report(report_data, output_path="forensic_report.pdf"):
+def generate_forensic_pdf_report(report_data, output_path="forensic_report.pdf", top_n=10, progress=None):
     """
     Generates a PDF report from structured report data.
     report_data: dict with keys - summary, alerts, parameters, file_hashes
+    top_n: number of alerts listed
+    progress: optional callback(steps_done, steps_total), called after each
+    section and after the file is saved
     """
     c = canvas.Canvas(output_path, pagesize=A4)
     width, height = A4
     y = height - 40
 
+    # summary, parameters, [tower lookup], alerts, hashes, save
+    steps_total = 5 + bool(report_data.get("tower_lookup"))
+    steps_done = 0
+
+    def step():
+        nonlocal steps_done
+        steps_done += 1
+        if progress is not None:
+            progress(steps_done, steps_total)
+
     def draw_title(title):
         nonlocal y
         c.setFont("Helvetica-Bold", 16)
@@ -350,12 +520,20 @@ def generate_forensic_pdf_report(report_data, output_path="forensic_report.pdf")
 
     # Summary
     draw_section("🧾 Investigation Summary", report_data.get("findings", {}))
+    step()
 
     # Parameters
     draw_section("⚙️ Parameters Used", report_data.get("parameters", {}))
+    step()
+
+    # Cell tower resolution
+    if report_data.get("tower_lookup"):
+        draw_section("📡 Cell Tower Lookup", report_data["tower_lookup"])
+        step()
 
     # Alerts
-    draw_list("📢 Alerts Raised", report_data.get("alerts", []))
+    draw_list("📢 Alerts Raised", report_data.get("alerts", []), limit=top_n)
+    step()
 
     # File Hashes
     hashes = {
@@ -363,6 +541,8 @@ def generate_forensic_pdf_report(report_data, output_path="forensic_report.pdf")
         for fh in report_data.get("file_hashes", [])
     }
     draw_section("🔐 File Hashes", hashes)
+    step()
 
     c.save()
+    step()
     return output_path